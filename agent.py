@@ -1,7 +1,17 @@
 import subprocess
 import os
 import sys
-import shutil
+import json
+import time
+import codecs
+import functools
+import contextlib
+import contextvars
+import queue
+import socket
+import threading
+import http.client
+from collections import deque
 
 # Fix Windows encoding issues - must be before any print statements
 if sys.platform == 'win32':
@@ -19,37 +29,927 @@ if sys.platform == 'win32':
         pass
 
 from pathlib import Path
-from typing import Optional
-from file_ops import save_to_file, execute_file, sanitize_filename
-from config import MODEL_NAME, TIMEOUT_SECONDS
-from prompt_templates import SYSTEM_PROMPT
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, TypeVar, Union
+from urllib.parse import urlsplit
+from file_ops import save_to_file, execute_file, sanitize_filename, clean_code, FileContentCache
+import telemetry
+from config import (
+    MODEL_NAME, TIMEOUT_SECONDS, OLLAMA_HOST, OLLAMA_HOSTS, OLLAMA_BACKEND, HTTP_POOL_SIZE, CACHE_ENABLED,
+    WARMUP_ENABLED, PING_INTERVAL_SECONDS, HEALTH_CHECK_INTERVAL_SECONDS, SYMBOL_INDEX_ENABLED,
+    CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_FILES, CONTEXT_READ_WORKERS, EDIT_MODE, EDIT_MIN_LINES, VALIDATE_ENABLED,
+    VALIDATE_MAX_ROUNDS, SPECULATIVE_CANDIDATES, OLLAMA_BIN, EXTRACT_ENABLED, STOP_SEQUENCES, NUM_PREDICT,
+    HISTORY_MODE, keep_alive_value
+)
+from prompt_templates import SYSTEM_PROMPT, EDIT_PROMPT, REPAIR_PROMPT
 from dataset_utils import replace_known_datasets
+from response_cache import ResponseCache, make_cache_key, content_digest
+from symbol_index import SymbolIndex, estimate_tokens
+from session import Session
+from patching import PatchError, apply_edit, make_patch, count_changed_lines, rewrite_changed_lines
+from validation import Validator, ValidationReport, RepairReport
+from speculation import CandidatePicker, SpeculationReport, SpeculationStats, candidate_options
+from extraction import CodeExtractor
+from history import GenerationHistory, HistoryMatch
+
+class OllamaError(Exception):
+    """Raised when the Ollama REST API returns an error or the connection fails."""
+
+class OllamaConnectionError(OllamaError):
+    """Raised when talking to an Ollama server fails at the network level."""
+
+class OllamaUnavailableError(OllamaConnectionError):
+    """Raised when no Ollama server is listening at the configured host."""
+
+class OllamaTimeoutError(OllamaConnectionError):
+    """Raised when the Ollama server does not answer within the timeout."""
+
+class OllamaCancelledError(OllamaError):
+    """Raised when a request is aborted through its CancelToken."""
+
+class CancelToken:
+    """
+    Lets one thread abort a blocking model call running in another.
+    
+    Code that blocks (socket reads, child processes) registers a callback that
+    unblocks it; cancel() runs the callbacks once. Callbacks registered after
+    cancellation run immediately.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self._cancelled = False
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+    
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+    
+    def register(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+    
+    def unregister(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+# The CancelToken of the request running in the current context (see cancellable)
+_request_cancel: "contextvars.ContextVar[Optional[CancelToken]]" = contextvars.ContextVar(
+    "request_cancel", default=None
+)
+
+def current_cancel() -> Optional[CancelToken]:
+    """Return the CancelToken of the request running in this context, if any."""
+    return _request_cancel.get()
+
+@contextlib.contextmanager
+def cancellable(token: Optional[CancelToken] = None) -> Iterator[CancelToken]:
+    """
+    Run the enclosed block as one request that `token` cancels.
+    
+    Model calls in the block without a token of their own, like session
+    turns, use this one, so cancelling it from any thread closes their
+    stream. Leaving the block with an exception (e.g. the KeyboardInterrupt
+    of Ctrl+C) cancels it too.
+    
+    Yields:
+        The token, a new one if none was given
+    """
+    token = token if token is not None else CancelToken()
+    reset = _request_cancel.set(token)
+    try:
+        yield token
+    except BaseException:
+        token.cancel()
+        raise
+    finally:
+        _request_cancel.reset(reset)
+
+@functools.lru_cache(maxsize=None)
+def find_ollama() -> Optional[str]:
+    """
+    Locate the ollama executable.
+
+    Searched once per process: OLLAMA_BIN, then PATH, then the usual Windows install folders.
+
+    Returns:
+        Path of the executable, or None if it is not installed
+    """
+    if OLLAMA_BIN:
+        return OLLAMA_BIN if os.path.exists(OLLAMA_BIN) else None
+    import shutil
+    ollama_path = shutil.which("ollama")
+    if ollama_path:
+        return ollama_path
+
+    # Check common Windows installation paths
+    if sys.platform == 'win32':
+        common_paths = [
+            os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Programs', 'Ollama', 'ollama.exe'),
+            os.path.join(os.environ.get('ProgramFiles', ''), 'Ollama', 'ollama.exe'),
+        ]
+        for path in common_paths:
+            if path and os.path.exists(path):
+                return path
+
+    return None
+
+def _normalize_host(host: str) -> str:
+    """Turn OLLAMA_HOST style values ("0.0.0.0", "host:port") into a base URL."""
+    host = host.strip().rstrip("/")
+    if "://" not in host:
+        host = "http://" + host
+    parts = urlsplit(host)
+    hostname = parts.hostname or "127.0.0.1"
+    if hostname == "0.0.0.0":
+        hostname = "127.0.0.1"
+    port = parts.port or (443 if parts.scheme == "https" else 11434)
+    return f"{parts.scheme}://{hostname}:{port}"
+
+class OllamaHTTPClient:
+    """
+    Minimal client for the Ollama REST API.
+    
+    Keeps a bounded pool of keep-alive connections so consecutive requests
+    skip process startup and TCP handshakes. Only the standard library is used.
+    """
+    
+    def __init__(self, host: str = OLLAMA_HOST, pool_size: int = HTTP_POOL_SIZE,
+                 timeout: float = TIMEOUT_SECONDS):
+        """
+        Args:
+            host: Base URL of the Ollama server, e.g. http://127.0.0.1:11434
+            pool_size: Maximum number of simultaneously open connections
+            timeout: Socket timeout in seconds for connect and each read
+        """
+        self.base_url = _normalize_host(host)
+        parts = urlsplit(self.base_url)
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+    
+    def _new_connection(self) -> http.client.HTTPConnection:
+        """Open a new (lazy) connection to the server."""
+        if self._scheme == "https":
+            return http.client.HTTPSConnection(self._host, self._port, timeout=self.timeout)
+        return http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+    
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """
+        Take a connection from the pool, blocking while all slots are busy.
+        
+        Returns:
+            tuple: (connection, reused) where reused tells if the connection was idle in the pool
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OllamaTimeoutError(f"No free connection to {self.base_url} after {self.timeout} seconds")
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+    
+    def _watch(self, conn: http.client.HTTPConnection, cancel: Optional[CancelToken]) -> None:
+        """Make `cancel` shut down the connection's socket, unblocking any pending read."""
+        if cancel is None:
+            return
+        
+        def abort() -> None:
+            sock = conn.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        
+        conn._cancel_hook = (cancel, abort)
+        cancel.register(abort)
+    
+    def _release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        """Return a connection to the pool, closing it if it cannot be reused."""
+        hook = getattr(conn, "_cancel_hook", None)
+        if hook is not None:
+            hook[0].unregister(hook[1])
+            conn._cancel_hook = None
+            reusable = reusable and not hook[0].cancelled
+        if reusable:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+    
+    def _wrap_error(self, exc: BaseException) -> OllamaError:
+        """Translate low-level socket/HTTP errors into OllamaError subclasses."""
+        if isinstance(exc, socket.timeout):
+            return OllamaTimeoutError(f"Request to {self.base_url} timed out after {self.timeout} seconds")
+        if isinstance(exc, ConnectionRefusedError):
+            return OllamaUnavailableError(f"No Ollama server at {self.base_url}")
+        if isinstance(exc, socket.gaierror):
+            return OllamaUnavailableError(f"Cannot resolve Ollama host {self.base_url}: {exc}")
+        return OllamaConnectionError(f"Connection to {self.base_url} failed: {exc}")
+    
+    def _check_cancelled(self, cancel: Optional[CancelToken]) -> None:
+        if cancel is not None and cancel.cancelled:
+            raise OllamaCancelledError("Request cancelled")
+    
+    def _send(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+              cancel: Optional[CancelToken] = None
+              ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """
+        Send a request and return the connection together with its response.
+        
+        A pooled connection may have been closed by the server while idle, so a
+        failure on a reused connection is retried once on a fresh one.
+        The caller owns the connection and must hand it back via _release().
+        """
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        
+        for attempt in range(2):
+            self._check_cancelled(cancel)
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                self._watch(conn, cancel)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                self._release(conn, reusable=False)
+                self._check_cancelled(cancel)
+                if reused and attempt == 0 and not isinstance(e, socket.timeout):
+                    continue
+                raise self._wrap_error(e) from e
+            except BaseException:
+                # Interrupted (Ctrl+C): closing the connection makes Ollama drop the request
+                self._release(conn, reusable=False)
+                raise
+            
+            if response.status >= 400:
+                try:
+                    raw = response.read()
+                except (OSError, http.client.HTTPException):
+                    raw = b""
+                self._release(conn, reusable=not response.will_close)
+                try:
+                    message = json.loads(raw).get("error", "")
+                except (ValueError, AttributeError):
+                    message = raw.decode("utf-8", errors="replace").strip()
+                raise OllamaError(f"HTTP {response.status}: {message or response.reason}")
+            
+            return conn, response
+        
+        raise OllamaConnectionError(f"Connection to {self.base_url} failed")
+    
+    def request_json(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                     cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """Send a request and decode the full JSON response body."""
+        conn, response = self._send(method, path, payload, cancel)
+        try:
+            raw = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._release(conn, reusable=False)
+            self._check_cancelled(cancel)
+            raise self._wrap_error(e) from e
+        except BaseException:
+            self._release(conn, reusable=False)
+            raise
+        self._release(conn, reusable=not response.will_close)
+        self._check_cancelled(cancel)
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError as e:
+            raise OllamaError(f"Invalid JSON from {path}: {e}") from e
+        if isinstance(data, dict) and data.get("error"):
+            raise OllamaError(str(data["error"]))
+        return data
+    
+    def stream_json(self, path: str, payload: Dict[str, Any],
+                    cancel: Optional[CancelToken] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Send a streaming request and yield each newline-delimited JSON message.
+        
+        Closing the generator early (or cancelling `cancel` from another thread)
+        closes the underlying connection, which makes Ollama abort the generation.
+        """
+        conn, response = self._send("POST", path, payload, cancel)
+        completed = False
+        done = False
+        try:
+            while True:
+                try:
+                    line = response.readline()
+                except (OSError, http.client.HTTPException) as e:
+                    self._check_cancelled(cancel)
+                    raise self._wrap_error(e) from e
+                self._check_cancelled(cancel)
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    message = json.loads(line)
+                except ValueError as e:
+                    raise OllamaError(f"Invalid JSON from {path}: {e}") from e
+                if message.get("error"):
+                    raise OllamaError(str(message["error"]))
+                done = done or bool(message.get("done"))
+                yield message
+            if not done:
+                # Ollama always ends a stream with a `done` message; anything else is a dropped connection
+                raise OllamaConnectionError(f"Connection to {self.base_url} closed mid-response")
+            completed = True
+        finally:
+            self._release(conn, reusable=completed and not response.will_close)
+    
+    def generate(self, prompt: str, model: str = MODEL_NAME, cancel: Optional[CancelToken] = None,
+                 **fields: Any) -> Dict[str, Any]:
+        """Call /api/generate without streaming and return the final message."""
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        payload.update(fields)
+        return self.request_json("POST", "/api/generate", payload, cancel)
+    
+    def stream_generate(self, prompt: str, model: str = MODEL_NAME, cancel: Optional[CancelToken] = None,
+                        **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Call /api/generate with streaming and yield each partial message."""
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        payload.update(fields)
+        return self.stream_json("/api/generate", payload, cancel)
+    
+    def chat(self, messages: List[Dict[str, str]], model: str = MODEL_NAME, **fields: Any) -> Dict[str, Any]:
+        """Call /api/chat without streaming and return the final message."""
+        payload = {"model": model, "messages": messages, "stream": False}
+        payload.update(fields)
+        return self.request_json("POST", "/api/chat", payload)
+    
+    def close(self) -> None:
+        """Close all idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_T = TypeVar("_T")
+
+# A context file path, comma-separated paths, or a list of paths; entries may be glob patterns
+ContextFiles = Union[str, Sequence[str], None]
+
+class Endpoint:
+    """One Ollama server of an EndpointPool, with its load and latency statistics."""
+    
+    LATENCY_WINDOW = 200
+    
+    def __init__(self, host: str, pool_size: int, timeout: float):
+        self.client = OllamaHTTPClient(host, pool_size, timeout)
+        self.base_url = self.client.base_url
+        self.outstanding = 0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+        self.last_error = ""
+        self.last_check: Optional[float] = None
+        self.latencies: Deque[float] = deque(maxlen=self.LATENCY_WINDOW)
+        self.first_chunk_latencies: Deque[float] = deque(maxlen=self.LATENCY_WINDOW)
+    
+    def mean_latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of this endpoint's counters and latency percentiles (milliseconds)."""
+        def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+            if not values:
+                return None
+            ordered = sorted(values)
+            return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1000, 1)
+        
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "latency_ms_mean": round(self.mean_latency() * 1000, 1) if self.latencies else None,
+            "latency_ms_p50": percentile(self.latencies, 50),
+            "latency_ms_p95": percentile(self.latencies, 95),
+            "first_chunk_ms_p50": percentile(self.first_chunk_latencies, 50),
+        }
+
+class EndpointPool:
+    """
+    Routes requests across several Ollama servers.
+    
+    Each request goes to the healthy endpoint with the fewest outstanding
+    requests (ties broken by mean latency). Connection failures and timeouts
+    mark an endpoint unhealthy and the request is retried on the next one;
+    streams only fail over before their first message. A background thread
+    re-checks every endpoint periodically so recovered servers rejoin.
+    Offers the same request methods as OllamaHTTPClient.
+    """
+    
+    HEALTH_TIMEOUT_SECONDS = 5
+    
+    def __init__(self, hosts: Iterable[str] = OLLAMA_HOSTS, pool_size: int = HTTP_POOL_SIZE,
+                 timeout: float = TIMEOUT_SECONDS,
+                 health_interval: float = HEALTH_CHECK_INTERVAL_SECONDS):
+        """
+        Args:
+            hosts: Base URLs of the Ollama servers
+            pool_size: Connection pool size per endpoint
+            timeout: Request timeout in seconds
+            health_interval: Seconds between health checks, 0 to disable
+                (never started for a single endpoint)
+        """
+        self.endpoints = [Endpoint(host, pool_size, timeout) for host in hosts]
+        if not self.endpoints:
+            raise ValueError("EndpointPool needs at least one host")
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._health_clients = {
+            e.base_url: OllamaHTTPClient(e.base_url, 1, self.HEALTH_TIMEOUT_SECONDS) for e in self.endpoints
+        }
+        self._health_thread: Optional[threading.Thread] = None
+        if len(self.endpoints) > 1 and health_interval > 0:
+            self._health_thread = threading.Thread(
+                target=self._health_loop, args=(health_interval,), name="ollama-health", daemon=True
+            )
+            self._health_thread.start()
+    
+    @property
+    def base_url(self) -> str:
+        return ", ".join(e.base_url for e in self.endpoints)
+    
+    def begin(self, exclude: Iterable[str] = ()) -> Optional[Endpoint]:
+        """
+        Choose an endpoint for a new request and count it as outstanding.
+        
+        Unhealthy endpoints are only used when no healthy one is left.
+        
+        Returns:
+            The endpoint, or None if every endpoint is in `exclude`
+        """
+        excluded = set(exclude)
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.base_url not in excluded]
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.healthy] or candidates
+            endpoint = min(healthy, key=lambda e: (e.outstanding, e.mean_latency()))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+    
+    def first_chunk(self, endpoint: Endpoint, started: float) -> None:
+        """Record time to the first streamed message."""
+        with self._lock:
+            endpoint.first_chunk_latencies.append(time.monotonic() - started)
+    
+    def end(self, endpoint: Endpoint, started: float, error: Optional[BaseException] = None) -> None:
+        """Finish a request started with begin(), recording its latency or failure."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.latencies.append(time.monotonic() - started)
+                endpoint.healthy = True
+            elif not isinstance(error, OllamaCancelledError):
+                endpoint.failures += 1
+                endpoint.last_error = str(error)
+                if isinstance(error, OllamaConnectionError):
+                    endpoint.healthy = False
+    
+    def _give_up(self, errors: List[OllamaError]) -> OllamaError:
+        """Pick the exception to raise after every endpoint failed."""
+        if not errors:
+            return OllamaUnavailableError("No Ollama endpoint available")
+        if all(isinstance(e, OllamaUnavailableError) for e in errors):
+            return OllamaUnavailableError("; ".join(str(e) for e in errors))
+        return errors[-1]
+    
+    def _call(self, fn: Callable[[OllamaHTTPClient], _T]) -> _T:
+        """Run fn against endpoints until one succeeds."""
+        tried: List[str] = []
+        errors: List[OllamaError] = []
+        while True:
+            endpoint = self.begin(tried)
+            if endpoint is None:
+                raise self._give_up(errors)
+            tried.append(endpoint.base_url)
+            started = time.monotonic()
+            try:
+                result = fn(endpoint.client)
+            except OllamaCancelledError as e:
+                self.end(endpoint, started, e)
+                raise
+            except OllamaError as e:
+                self.end(endpoint, started, e)
+                errors.append(e)
+                continue
+            except BaseException as e:
+                self.end(endpoint, started, OllamaCancelledError(str(e)))
+                raise
+            self.end(endpoint, started)
+            return result
+    
+    def request_json(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                     cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """Send a request to the least loaded endpoint, failing over on errors."""
+        return self._call(lambda client: client.request_json(method, path, payload, cancel))
+    
+    def stream_json(self, path: str, payload: Dict[str, Any],
+                    cancel: Optional[CancelToken] = None) -> Iterator[Dict[str, Any]]:
+        """Stream from the least loaded endpoint, failing over until the first message arrives."""
+        tried: List[str] = []
+        errors: List[OllamaError] = []
+        while True:
+            endpoint = self.begin(tried)
+            if endpoint is None:
+                raise self._give_up(errors)
+            tried.append(endpoint.base_url)
+            started = time.monotonic()
+            received = False
+            outcome: Optional[BaseException] = OllamaCancelledError("Stream closed")
+            try:
+                for message in endpoint.client.stream_json(path, payload, cancel):
+                    if not received:
+                        received = True
+                        self.first_chunk(endpoint, started)
+                    yield message
+                outcome = None
+                return
+            except OllamaCancelledError:
+                raise
+            except OllamaError as e:
+                outcome = e
+                if received:
+                    raise
+                errors.append(e)
+            finally:
+                self.end(endpoint, started, outcome)
+    
+    def generate(self, prompt: str, model: str = MODEL_NAME, cancel: Optional[CancelToken] = None,
+                 **fields: Any) -> Dict[str, Any]:
+        """Call /api/generate without streaming and return the final message."""
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        payload.update(fields)
+        return self.request_json("POST", "/api/generate", payload, cancel)
+    
+    def stream_generate(self, prompt: str, model: str = MODEL_NAME, cancel: Optional[CancelToken] = None,
+                        **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Call /api/generate with streaming and yield each partial message."""
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        payload.update(fields)
+        return self.stream_json("/api/generate", payload, cancel)
+    
+    def chat(self, messages: List[Dict[str, str]], model: str = MODEL_NAME, **fields: Any) -> Dict[str, Any]:
+        """Call /api/chat without streaming and return the final message."""
+        payload = {"model": model, "messages": messages, "stream": False}
+        payload.update(fields)
+        return self.request_json("POST", "/api/chat", payload)
+    
+    def check_health(self) -> None:
+        """Probe every endpoint once and update its healthy flag."""
+        for endpoint in self.endpoints:
+            try:
+                self._health_clients[endpoint.base_url].request_json("GET", "/api/version")
+                healthy, error = True, ""
+            except OllamaError as e:
+                healthy, error = False, str(e)
+            with self._lock:
+                endpoint.healthy = healthy
+                endpoint.last_check = time.time()
+                if error:
+                    endpoint.last_error = error
+    
+    def _health_loop(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            self.check_health()
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-endpoint load, health and latency statistics."""
+        with self._lock:
+            return [e.stats() for e in self.endpoints]
+    
+    def close(self) -> None:
+        """Stop health checks and close all idle connections."""
+        self._closed.set()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+        for client in self._health_clients.values():
+            client.close()
+
+class Flight:
+    """Shared state of one in-flight model call and the callers attached to it."""
+    
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.error = ""
+        self.done = False
+        self.subscribers = 0
+        self.cancel = CancelToken()
+        self._cond = threading.Condition()
+    
+    def publish(self, chunk: str) -> None:
+        """Append a chunk and wake every subscriber."""
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+    
+    def finish(self, error: str = "") -> None:
+        """Mark the call complete (or failed) and wake every subscriber."""
+        with self._cond:
+            if self.done:
+                return
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+    
+    def wake(self) -> None:
+        """Wake every subscriber so that a cancelled one can stop waiting."""
+        with self._cond:
+            self._cond.notify_all()
+    
+    def wait(self, index: int, cancel: Optional[CancelToken] = None) -> tuple[List[str], bool, str]:
+        """Block until there are chunks after index, the flight is done or cancel is set."""
+        with self._cond:
+            while index >= len(self.chunks) and not self.done and not (cancel is not None and cancel.cancelled):
+                self._cond.wait()
+            return self.chunks[index:], self.done, self.error
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight model calls.
+    
+    The first caller for a key starts a producer thread that runs the real
+    call and publishes its chunks to a Flight. Callers arriving while it runs attach to the same Flight and
+    replay every chunk from the beginning. The call is cancelled only when the
+    last attached caller goes away.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Flight] = {}
+        self._counters = {"calls": 0, "coalesced": 0, "cancelled": 0}
+    
+    def join(self, key: str, start: Callable[[Flight], None]) -> Flight:
+        """
+        Attach to the flight for key, calling start(flight) if a new one is created.
+        
+        Every join must be matched by a leave().
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                self._counters["coalesced"] += 1
+                return flight
+            flight = Flight(key)
+            flight.subscribers = 1
+            self._flights[key] = flight
+            self._counters["calls"] += 1
+        start(flight)
+        return flight
+    
+    def leave(self, flight: Flight) -> None:
+        """Detach a caller; the last one out cancels an unfinished call."""
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned:
+                self._counters["cancelled"] += 1
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+        if abandoned:
+            flight.cancel.cancel()
+    
+    def complete(self, flight: Flight, error: str = "") -> None:
+        """Finish a flight so that new callers start a fresh call."""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(error)
+    
+    def run(self, flight: Flight, produce: Callable[[CancelToken], Iterator[tuple[str, str]]]) -> None:
+        """Drive a (chunk, error) producer to completion, publishing into flight."""
+        error = ""
+        try:
+            for chunk, chunk_error in produce(flight.cancel):
+                if chunk_error:
+                    error = chunk_error
+                    break
+                flight.publish(chunk)
+        except Exception as e:
+            error = f"❌ Unexpected error calling Ollama: {str(e)}"
+        finally:
+            self.complete(flight, error)
+    
+    def stream(self, key: str, produce: Callable[[CancelToken], Iterator[tuple[str, str]]]
+               ) -> Iterator[tuple[str, str]]:
+        """
+        Run produce(cancel) once per key on a background thread and stream its output.
+        
+        Cancelling the caller's request (see cancellable) detaches it like
+        closing the stream does; the call itself stops once nobody is left.
+        
+        Yields:
+            tuple: (chunk, error_message) exactly like the producer
+        """
+        # The producer thread inherits the caller's context, so model timings land in its trace
+        flight = self.join(key, lambda f: threading.Thread(
+            target=contextvars.copy_context().run, args=(self.run, f, produce), name="ollama-flight", daemon=True
+        ).start())
+        cancel = current_cancel()
+        if cancel is not None:
+            cancel.register(flight.wake)
+        index = 0
+        try:
+            while True:
+                chunks, done, error = flight.wait(index, cancel)
+                index += len(chunks)
+                for chunk in chunks:
+                    yield chunk, ""
+                if done:
+                    if error:
+                        yield "", error
+                    return
+                if cancel is not None and cancel.cancelled:
+                    yield "", "⏹️ Generation cancelled."
+                    return
+        finally:
+            if cancel is not None:
+                cancel.unregister(flight.wake)
+            self.leave(flight)
+    
+    def stats(self) -> Dict[str, int]:
+        """Return counters: calls started, calls saved by coalescing, abandoned calls, in flight now."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._flights)
+            return stats
 
 class CodingAgent:
     """AI coding assistant that uses local Ollama LLM for code generation."""
     
-    def __init__(self):
-        """Initialize the coding agent."""
-        self._check_ollama_available()
+    def __init__(self, backend: Optional[str] = None, host: Optional[Any] = None,
+                 use_cache: bool = True, cache: Optional[ResponseCache] = None,
+                 warmup: Optional[bool] = None, ping_interval: Optional[float] = None,
+                 pool_size: Optional[int] = None, candidates: Optional[int] = None):
+        """
+        Initialize the coding agent.
+        
+        Args:
+            backend: "auto", "http" or "cli" (defaults to OLLAMA_BACKEND)
+            host: Ollama server URL, or a list of URLs to balance across, for the REST
+                backend (defaults to OLLAMA_HOSTS)
+            use_cache: Default for reading cached responses; fresh results are still stored
+            cache: Response cache to use (defaults to one built from config, if enabled)
+            warmup: Preload MODEL_NAME on a background thread (defaults to WARMUP_ENABLED)
+            ping_interval: Seconds of idleness before pinging the model to keep it loaded,
+                0 to disable (defaults to PING_INTERVAL_SECONDS)
+            pool_size: Maximum number of concurrent connections per server (defaults to HTTP_POOL_SIZE)
+            candidates: Answers generated at once per request, the first valid one winning
+                (defaults to SPECULATIVE_CANDIDATES; 1 disables speculation)
+        """
+        self.backend = (backend or OLLAMA_BACKEND).lower()
+        self.candidates = candidates or SPECULATIVE_CANDIDATES
+        self.speculation = SpeculationStats()
+        self.http_client: Optional[EndpointPool] = None
+        if self.backend != "cli":
+            hosts = [host] if isinstance(host, str) else (host or OLLAMA_HOSTS)
+            # Every candidate of a speculative request needs its own connection
+            self.http_client = EndpointPool(hosts, pool_size=max(pool_size or HTTP_POOL_SIZE, self.candidates))
+        self.use_cache = use_cache
+        self.cache = cache if cache is not None else (ResponseCache() if CACHE_ENABLED else None)
+        self.flights = SingleFlight()
+        self._symbol_index: Optional[SymbolIndex] = None
+        self._index_lock = threading.Lock()
+        self.file_cache = FileContentCache()
+        self._read_pool: Optional["ThreadPoolExecutor"] = None
+        self._read_pool_lock = threading.Lock()
+        self._validator: Optional[Validator] = None
+        self._validator_lock = threading.Lock()
+        self._history: Optional[GenerationHistory] = None
+        self._history_lock = threading.Lock()
+        
+        self.keep_alive = keep_alive_value()
+        self.warmup_seconds: Optional[float] = None
+        self._last_activity = time.monotonic()
+        self._closed = threading.Event()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._ping_thread: Optional[threading.Thread] = None
+        if self.http_client is not None:
+            if WARMUP_ENABLED if warmup is None else warmup:
+                self._warmup_thread = threading.Thread(target=self.warm_up, name="ollama-warmup", daemon=True)
+                self._warmup_thread.start()
+            interval = PING_INTERVAL_SECONDS if ping_interval is None else ping_interval
+            if interval > 0:
+                self._ping_thread = threading.Thread(
+                    target=self._keep_model_loaded, args=(interval,), name="ollama-keepalive", daemon=True
+                )
+                self._ping_thread.start()
+    
+    def _model_fields(self) -> Dict[str, Any]:
+        """Extra /api/generate fields shared by every model call."""
+        return {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+    
+    def _code_options(self) -> Dict[str, Any]:
+        """Ollama `options` for requests answered with code (not edits): stop sequences and output cap."""
+        options: Dict[str, Any] = {}
+        if STOP_SEQUENCES:
+            options["stop"] = list(STOP_SEQUENCES)
+        if NUM_PREDICT:
+            options["num_predict"] = NUM_PREDICT
+        return options
+    
+    def _load_model(self, endpoint: Endpoint) -> Dict[str, Any]:
+        """Ask one Ollama server to load MODEL_NAME; an empty prompt loads the model without generating."""
+        self._last_activity = time.monotonic()
+        return endpoint.client.generate("", MODEL_NAME, **self._model_fields())
+    
+    def warm_up(self) -> Optional[float]:
+        """
+        Load the model into memory on every server so the first request does not pay for it.
+        
+        Returns:
+            Seconds the load took, or None if no server could be reached
+        """
+        if self.http_client is None:
+            return None
+        start = time.perf_counter()
+        loaded = False
+        endpoints = self.http_client.endpoints
+        for endpoint in endpoints:
+            where = f" on {endpoint.base_url}" if len(endpoints) > 1 else ""
+            try:
+                result = self._load_model(endpoint)
+            except OllamaConnectionError:
+                continue
+            except OllamaError as e:
+                print(f"⚠️ Warning: Could not preload {MODEL_NAME}{where}: {e}")
+                continue
+            loaded = True
+            load = result.get("load_duration")
+            detail = f" (model load {load / 1e9:.1f}s)" if isinstance(load, (int, float)) and load else ""
+            print(f"🔥 {MODEL_NAME} ready{where} in {time.perf_counter() - start:.1f}s{detail}")
+        if not loaded:
+            return None
+        self.warmup_seconds = time.perf_counter() - start
+        return self.warmup_seconds
+    
+    def _keep_model_loaded(self, interval: float) -> None:
+        """Ping the model whenever the agent has been idle for `interval` seconds."""
+        while True:
+            idle = time.monotonic() - self._last_activity
+            if self._closed.wait(max(interval - idle, 1)):
+                return
+            if time.monotonic() - self._last_activity < interval:
+                continue
+            for endpoint in self.http_client.endpoints:
+                try:
+                    self._load_model(endpoint)
+                except OllamaError:
+                    # Server down or busy: count this as activity and retry after another interval
+                    self._last_activity = time.monotonic()
+    
+    def close(self) -> None:
+        """Stop background threads and close pooled connections."""
+        self._closed.set()
+        if self.http_client is not None:
+            self.http_client.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self._symbol_index is not None:
+            self._symbol_index.close()
+        if self._read_pool is not None:
+            self._read_pool.shutdown(wait=False)
+        if self._validator is not None:
+            self._validator.close()
+        if self._history is not None:
+            self._history.close()
     
     def _check_ollama_available(self) -> bool:
         """Check if Ollama is available in the system."""
-        import shutil
-        ollama_path = shutil.which("ollama")
-        if ollama_path:
-            return True
-        
-        # Check common Windows installation paths
-        if sys.platform == 'win32':
-            common_paths = [
-                os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Programs', 'Ollama', 'ollama.exe'),
-                os.path.join(os.environ.get('ProgramFiles', ''), 'Ollama', 'ollama.exe'),
-            ]
-            for path in common_paths:
-                if path and os.path.exists(path):
-                    return True
-        
-        return False
+        return find_ollama() is not None
 
     def read_file_content(self, filepath: str) -> str:
         """Read file content with proper error handling and encoding."""
@@ -75,18 +975,11 @@ class CodingAgent:
                 print(f"⚠️ Warning: '{filepath}' is not a file. Proceeding without file context.")
                 return ""
             
-            # Try UTF-8 first, then fallback to other encodings
-            try:
-                with open(path, 'r', encoding='utf-8', errors='replace') as f:
-                    return f.read()
-            except UnicodeDecodeError:
-                # Fallback to latin-1 which can read any byte sequence
-                try:
-                    with open(path, 'r', encoding='latin-1', errors='replace') as f:
-                        return f.read()
-                except Exception:
-                    print(f"⚠️ Warning: Could not decode '{filepath}'. Proceeding without file context.")
-                    return ""
+            # Decoded once as UTF-8 (invalid bytes replaced) and reused until the file changes
+            return self.file_cache.read(path)
+        except ValueError as e:
+            print(f"⚠️ Warning: Skipping '{filepath}': {e}. Proceeding without file context.")
+            return ""
         except PermissionError:
             print(f"⚠️ Warning: Permission denied reading '{filepath}'. Proceeding without file context.")
             return ""
@@ -94,77 +987,538 @@ class CodingAgent:
             print(f"⚠️ Warning: Error reading file '{filepath}': {e}. Proceeding without file context.")
             return ""
 
-    def _get_ollama_path(self) -> str:
-        """Get the path to Ollama executable."""
-        # First try to find it in PATH
-        ollama_path = shutil.which("ollama")
-        if ollama_path:
-            return ollama_path
+    def expand_context_paths(self, context_files: Union[str, Sequence[str], None]) -> List[str]:
+        """
+        Turn a context file specification into a list of paths.
+        
+        Args:
+            context_files: A path, a comma-separated list of paths, or a list of paths;
+                any entry may be a glob pattern ("src/*.py", "**/*.py")
         
-        # Check common Windows installation paths
-        if sys.platform == 'win32':
-            common_paths = [
-                os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Programs', 'Ollama', 'ollama.exe'),
-                os.path.join(os.environ.get('ProgramFiles', ''), 'Ollama', 'ollama.exe'),
-            ]
-            for path in common_paths:
-                if path and os.path.exists(path):
-                    return path
+        Returns:
+            Matching paths in order, without duplicates, at most CONTEXT_MAX_FILES
+        """
+        if not context_files:
+            return []
+        import glob
+        entries = context_files.split(",") if isinstance(context_files, str) else list(context_files)
+        paths: List[str] = []
+        for entry in (e.strip() for e in entries):
+            if not entry:
+                continue
+            if glob.has_magic(entry):
+                matches = sorted(m for m in glob.glob(entry, recursive=True) if os.path.isfile(m))
+                if not matches:
+                    print(f"⚠️ Warning: No files match '{entry}'.")
+                paths.extend(matches)
+            else:
+                paths.append(entry)
+        paths = list(dict.fromkeys(paths))
+        if len(paths) > CONTEXT_MAX_FILES:
+            print(f"⚠️ Warning: {len(paths)} context files given, using the first {CONTEXT_MAX_FILES}.")
+            paths = paths[:CONTEXT_MAX_FILES]
+        return paths
+
+    def read_file_contents(self, context_files: Union[str, Sequence[str], None]) -> List[tuple[str, str]]:
+        """
+        Read several context files concurrently.
         
-        return "ollama"  # Fallback to just "ollama" and let subprocess handle the error
+        Returns:
+            list: (path, content) for every file that could be read, in the given order
+        """
+        paths = self.expand_context_paths(context_files)
+        if len(paths) <= 1:
+            contents = [self.read_file_content(path) for path in paths]
+        else:
+            with self._read_pool_lock:
+                if self._read_pool is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._read_pool = ThreadPoolExecutor(CONTEXT_READ_WORKERS, thread_name_prefix="context-read")
+            contents = list(self._read_pool.map(self.read_file_content, paths))
+        return [(path, content) for path, content in zip(paths, contents) if content]
+
+    def _get_ollama_path(self) -> str:
+        """Get the path to Ollama executable."""
+        # Fallback to just "ollama" and let subprocess handle the error
+        return find_ollama() or OLLAMA_BIN or "ollama"
     
-    def call_ollama(self, prompt: str) -> tuple[str, str]:
+    @telemetry.traced("call")
+    def call_ollama(self, prompt: str, use_cache: Optional[bool] = None,
+                    context_digest: str = "") -> tuple[str, str]:
         """
-        Call Ollama API with proper error handling.
+        Call Ollama with proper error handling.
+        
+        Uses the REST API when available and falls back to `ollama run`
+        when the backend is "auto" and no server is reachable.
+        
+        Args:
+            prompt: The instruction, rendered into SYSTEM_PROMPT before sending
+            use_cache: Set False to bypass cached responses (defaults to self.use_cache)
+            context_digest: Hash of the context file content, part of the cache key
         
         Returns:
             tuple: (response, error_message) where response is the code or empty string, and error_message is any error
         """
+        response, error, _ = self._call_ollama_cached(prompt, use_cache, context_digest)
+        return response, error
+
+    def _request_key(self, full_prompt: str, context_digest: str, options: Optional[Dict[str, Any]] = None,
+                     extract: bool = False) -> str:
+        """
+        Identify a model call by everything that shapes its answer.
+        
+        Besides the model, prompt and context that is the generation options and
+        whether the answer is cut down to its code block. Whether the stream is
+        closed early once the code is complete is left out: it changes only how
+        long the request runs, not the code that is kept.
+        
+        Args:
+            options: Ollama `options` sent with the request
+            extract: Whether the answer goes through _extract_stream
+        """
+        settings = {"options": options or {}, "extract": extract and EXTRACT_ENABLED}
+        return make_cache_key(MODEL_NAME, full_prompt, context_digest, settings)
+
+    def _cache_key(self, full_prompt: str, context_digest: str, options: Optional[Dict[str, Any]] = None,
+                   extract: bool = False) -> Optional[str]:
+        """Return the cache key for a request (see _request_key), or None when caching is disabled."""
+        if self.cache is None:
+            return None
+        return self._request_key(full_prompt, context_digest, options, extract)
+
+    def _cache_lookup(self, key: Optional[str], use_cache: Optional[bool]) -> Optional[str]:
+        """Return a cached response unless the cache is disabled or bypassed."""
+        if key is None or not (self.use_cache if use_cache is None else use_cache):
+            return None
+        return self.cache.get(key)
+
+    def _call_ollama_cached(self, prompt: str, use_cache: Optional[bool],
+                            context_digest: str, template: str = SYSTEM_PROMPT) -> tuple[str, str, bool]:
+        """
+        Answer from the cache or the backend.
+        
+        Identical calls already in flight are joined instead of repeated.
+        With code extraction on, the answer is streamed anyway, so the request
+        can stop as soon as the code block is complete.
+        
+        Returns:
+            tuple: (response, error_message, from_cache)
+        """
+        full_prompt = template.format(instruction=prompt)
+        options = self._code_options()
+        key = self._cache_key(full_prompt, context_digest, options, extract=True)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached, "", True
+        
+        if EXTRACT_ENABLED:
+            produce = self._streaming_producer(full_prompt, key)
+        else:
+            def produce(cancel: CancelToken) -> Iterator[tuple[str, str]]:
+                response, error = self._call_backend(full_prompt, cancel, {"options": options} if options else None)
+                if key is not None and response and not error:
+                    self.cache.put(key, response)
+                yield response, error
+        
+        parts = []
+        flight_key = self._request_key(full_prompt, context_digest, options, extract=True)
+        for chunk, error in self.flights.stream(flight_key, produce):
+            if error:
+                return "", error, False
+            parts.append(chunk)
+        return "".join(parts).strip(), "", False
+
+    def _call_backend(self, full_prompt: str, cancel: Optional[CancelToken] = None,
+                      fields: Optional[Dict[str, Any]] = None) -> tuple[str, str]:
+        """
+        Send a rendered prompt to the configured backend.
+        
+        Args:
+            fields: Extra /api/generate fields (ignored by the CLI)
+        """
+        if self.http_client is not None:
+            try:
+                return self._call_http(full_prompt, cancel, fields)
+            except OllamaUnavailableError as e:
+                if self.backend != "auto":
+                    return "", f"❌ Ollama server not reachable: {e}. Start it with: ollama serve"
+        return self._call_cli(full_prompt, cancel)
+
+    def _call_http(self, full_prompt: str, cancel: Optional[CancelToken] = None,
+                   fields: Optional[Dict[str, Any]] = None) -> tuple[str, str]:
+        """
+        Generate through the REST API.
+        
+        Raises:
+            OllamaUnavailableError: If no server is listening, so the caller can fall back
+        """
+        self._last_activity = time.monotonic()
+        started = time.perf_counter()
+        try:
+            result = self.http_client.generate(full_prompt, MODEL_NAME, cancel, **self._model_fields(), **(fields or {}))
+        except OllamaUnavailableError:
+            raise
+        except OllamaTimeoutError:
+            return "", f"❌ Ollama request timed out after {TIMEOUT_SECONDS} seconds."
+        except OllamaCancelledError:
+            return "", "⏹️ Generation cancelled."
+        except OllamaError as e:
+            return "", f"❌ Ollama error: {e}"
+        except Exception as e:
+            return "", f"❌ Unexpected error calling Ollama: {str(e)}"
+        finally:
+            telemetry.record("model", time.perf_counter() - started, backend="http")
+        telemetry.record_model(result)
+        
+        output = str(result.get("response", "")).strip()
+        if not output:
+            return "", "❌ Ollama returned empty response. The model might not be loaded. Try: ollama pull " + MODEL_NAME
+        
+        return output, ""
+
+    def _call_cli(self, full_prompt: str, cancel: Optional[CancelToken] = None) -> tuple[str, str]:
+        """Generate by spawning `ollama run` (fallback backend)."""
         try:
             ollama_path = self._get_ollama_path()
-            full_prompt = SYSTEM_PROMPT.format(instruction=prompt)
-            result = subprocess.run(
+            process = subprocess.Popen(
                 [ollama_path, "run", MODEL_NAME, full_prompt],
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
                 encoding='utf-8',
-                errors='replace',
-                timeout=TIMEOUT_SECONDS
+                errors='replace'
             )
-            
-            if result.returncode != 0:
-                error_msg = result.stderr.strip() if result.stderr else "Unknown error"
-                return "", f"❌ Ollama error (code {result.returncode}): {error_msg}"
-            
-            output = result.stdout.strip()
-            if not output:
-                return "", "❌ Ollama returned empty response. The model might not be loaded. Try: ollama pull " + MODEL_NAME
-            
-            return output, ""
-        except subprocess.TimeoutExpired:
-            return "", f"❌ Ollama request timed out after {TIMEOUT_SECONDS} seconds."
         except FileNotFoundError:
             return "", "❌ Error: 'ollama' command not found. Please install Ollama from https://ollama.ai and ensure it's in your PATH."
         except Exception as e:
             return "", f"❌ Unexpected error calling Ollama: {str(e)}"
+        
+        if cancel is not None:
+            cancel.register(process.kill)
+        started = time.perf_counter()
+        try:
+            stdout, stderr = process.communicate(timeout=TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            return "", f"❌ Ollama request timed out after {TIMEOUT_SECONDS} seconds."
+        except BaseException:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            if cancel is not None:
+                cancel.unregister(process.kill)
+            telemetry.record("model", time.perf_counter() - started, backend="cli")
+        
+        if cancel is not None and cancel.cancelled:
+            return "", "⏹️ Generation cancelled."
+        
+        if process.returncode != 0:
+            error_msg = stderr.strip() if stderr else "Unknown error"
+            return "", f"❌ Ollama error (code {process.returncode}): {error_msg}"
+        
+        output = stdout.strip()
+        if not output:
+            return "", "❌ Ollama returned empty response. The model might not be loaded. Try: ollama pull " + MODEL_NAME
+        
+        return output, ""
 
-    def generate_code(self, instruction: str, context_file: Optional[str] = None) -> tuple[str, str]:
+    @telemetry.traced("call")
+    def call_ollama_stream(self, prompt: str, use_cache: Optional[bool] = None,
+                           context_digest: str = "") -> Iterator[tuple[str, str]]:
         """
-        Generate code from instruction and return the result.
+        Stream a completion from Ollama chunk by chunk.
         
-        Returns:
-            tuple: (code, status_message) where code is the generated code and status_message is any error/info
+        Closing the generator early aborts the underlying request. A cached
+        response is delivered as a single chunk.
+        
+        Yields:
+            tuple: (chunk, error_message); chunks arrive with an empty error, and
+            a failure is reported once as ("", error_message) before the stream ends
         """
-        if not instruction or not instruction.strip():
-            return "", "❌ Empty instruction provided."
+        for chunk, error, _ in self._stream_ollama_cached(prompt, use_cache, context_digest):
+            yield chunk, error
+
+    def _stream_ollama_cached(self, prompt: str, use_cache: Optional[bool], context_digest: str,
+                              template: str = SYSTEM_PROMPT, extract: bool = True) -> Iterator[tuple[str, str, bool]]:
+        """
+        Stream from the cache or the backend, storing complete responses.
+        
+        Args:
+            extract: Whether the answer is code, to be cut down to its code block (see _extract_stream)
+        
+        Yields:
+            tuple: (chunk, error_message, from_cache)
+        """
+        full_prompt = template.format(instruction=prompt)
+        # Only code answers get the code options, see _streaming_producer
+        options = self._code_options() if extract else None
+        key = self._cache_key(full_prompt, context_digest, options, extract)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            yield cached, "", True
+            return
         
-        context_code = ""
-        if context_file and context_file.strip():
-            context_code = self.read_file_content(context_file.strip())
+        flight_key = self._request_key(full_prompt, context_digest, options, extract)
+        for chunk, error in self.flights.stream(flight_key, self._streaming_producer(full_prompt, key, extract)):
+            yield chunk, error, False
+
+    def _streaming_producer(self, full_prompt: str, cache_key: Optional[str], extract: bool = True
+                            ) -> Callable[[CancelToken], Iterator[tuple[str, str]]]:
+        """Build the flight producer that streams from the backend and caches complete responses."""
+        def produce(cancel: CancelToken) -> Iterator[tuple[str, str]]:
+            parts = []
+            if extract:
+                options = self._code_options()
+                stream = self._extract_stream(self._stream_backend(full_prompt, cancel,
+                                                                   {"options": options} if options else None))
+            else:
+                stream = self._stream_backend(full_prompt, cancel)
+            for chunk, error in stream:
+                if error:
+                    yield "", error
+                    return
+                parts.append(chunk)
+                yield chunk, ""
+            
+            response = "".join(parts).strip()
+            if cache_key is not None and response:
+                self.cache.put(cache_key, response)
+        return produce
+
+    def _extract_stream(self, stream: Iterator[tuple[str, str]],
+                        stop_early: bool = True) -> Iterator[tuple[str, str]]:
+        """
+        Pass on only the code of a streamed answer (see extraction.CodeExtractor).
+        
+        Once the code block closes the backend stream is closed, which aborts
+        the request instead of generating the explanation that usually follows.
+        With stop_early=False the rest of the answer is received and dropped
+        instead, so Ollama still sends its final message (with the session
+        context). The time spent and what was dropped are recorded as an
+        "extract" span of the current trace.
+        Does nothing with OLLAMA_EXTRACT=0.
+        """
+        if not EXTRACT_ENABLED:
+            yield from stream
+            return
+        extractor = CodeExtractor()
+        spent = 0.0
+        try:
+            for chunk, error in stream:
+                if error:
+                    yield "", error
+                    return
+                began = time.perf_counter()
+                code = extractor.feed(chunk)
+                spent += time.perf_counter() - began
+                if code:
+                    yield code, ""
+                if extractor.closed and stop_early:
+                    break
+            rest = extractor.finish()
+            if rest:
+                yield rest, ""
+        finally:
+            stream.close()
+            report = extractor.report()
+            telemetry.record("extract", spent, chatter_tokens=report["dropped_tokens"],
+                             early_stop=report["closed"] and stop_early)
+
+    def _stream_backend(self, full_prompt: str, cancel: Optional[CancelToken] = None,
+                        fields: Optional[Dict[str, Any]] = None,
+                        on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        cli_prompt: Optional[str] = None) -> Iterator[tuple[str, str]]:
+        """
+        Stream a rendered prompt from the configured backend.
+        
+        Args:
+            fields: Extra /api/generate fields (ignored by the CLI)
+            on_done: Called with the final /api/generate message
+            cli_prompt: Prompt to send instead if the request falls back to the CLI
+        """
+        if self.http_client is not None:
+            try:
+                yield from self._stream_http(full_prompt, cancel, fields, on_done)
+                return
+            except OllamaUnavailableError as e:
+                if self.backend != "auto":
+                    yield "", f"❌ Ollama server not reachable: {e}. Start it with: ollama serve"
+                    return
+        yield from self._stream_cli(cli_prompt or full_prompt, cancel)
+
+    def _stream_http(self, full_prompt: str, cancel: Optional[CancelToken] = None,
+                     fields: Optional[Dict[str, Any]] = None,
+                     on_done: Optional[Callable[[Dict[str, Any]], None]] = None) -> Iterator[tuple[str, str]]:
+        """
+        Stream through the REST API.
+        
+        Raises:
+            OllamaUnavailableError: If no server is listening, so the caller can fall back
+        """
+        self._last_activity = time.monotonic()
+        started = time.perf_counter()
+        ttft: Optional[float] = None
+        received = False
+        try:
+            for message in self.http_client.stream_generate(full_prompt, MODEL_NAME, cancel,
+                                                            **self._model_fields(), **(fields or {})):
+                chunk = message.get("response", "")
+                if chunk:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        telemetry.record("ttft", ttft)
+                    received = True
+                    yield chunk, ""
+                if message.get("done"):
+                    telemetry.record_model(message, ttft)
+                    if on_done is not None:
+                        on_done(message)
+        except OllamaUnavailableError:
+            if received:
+                yield "", "❌ Lost connection to Ollama mid-response."
+                return
+            raise
+        except OllamaTimeoutError:
+            yield "", f"❌ Ollama request timed out after {TIMEOUT_SECONDS} seconds."
+            return
+        except OllamaCancelledError:
+            yield "", "⏹️ Generation cancelled."
+            return
+        except OllamaError as e:
+            yield "", f"❌ Ollama error: {e}"
+            return
+        finally:
+            self._last_activity = time.monotonic()
+            telemetry.record("model", time.perf_counter() - started, backend="http")
+        
+        if not received:
+            yield "", "❌ Ollama returned empty response. The model might not be loaded. Try: ollama pull " + MODEL_NAME
+
+    def _stream_cli(self, full_prompt: str, cancel: Optional[CancelToken] = None) -> Iterator[tuple[str, str]]:
+        """Stream stdout of `ollama run` (fallback backend)."""
+        try:
+            process = subprocess.Popen(
+                [self._get_ollama_path(), "run", MODEL_NAME, full_prompt],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            yield "", "❌ Error: 'ollama' command not found. Please install Ollama from https://ollama.ai and ensure it's in your PATH."
+            return
+        except Exception as e:
+            yield "", f"❌ Unexpected error calling Ollama: {str(e)}"
+            return
+        
+        # Read stdout on a helper thread so the timeout also works on Windows pipes
+        chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        
+        def pump() -> None:
+            try:
+                while True:
+                    data = process.stdout.read1(4096)
+                    if not data:
+                        break
+                    chunks.put(data)
+            finally:
+                chunks.put(None)
+        
+        threading.Thread(target=pump, daemon=True).start()
+        if cancel is not None:
+            cancel.register(process.kill)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        deadline = time.monotonic() + TIMEOUT_SECONDS
+        started = time.perf_counter()
+        received = False
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    data = chunks.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    yield "", f"❌ Ollama request timed out after {TIMEOUT_SECONDS} seconds."
+                    return
+                if data is None:
+                    break
+                text = decoder.decode(data)
+                if text:
+                    if not received:
+                        telemetry.record("ttft", time.perf_counter() - started)
+                    received = True
+                    yield text, ""
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                received = True
+                yield tail, ""
+            
+            returncode = process.wait(timeout=max(deadline - time.monotonic(), 1))
+            if cancel is not None and cancel.cancelled:
+                yield "", "⏹️ Generation cancelled."
+            elif returncode != 0:
+                stderr = process.stderr.read().decode("utf-8", errors="replace").strip()
+                yield "", f"❌ Ollama error (code {returncode}): {stderr or 'Unknown error'}"
+            elif not received:
+                yield "", "❌ Ollama returned empty response. The model might not be loaded. Try: ollama pull " + MODEL_NAME
+        except subprocess.TimeoutExpired:
+            yield "", f"❌ Ollama request timed out after {TIMEOUT_SECONDS} seconds."
+        finally:
+            telemetry.record("model", time.perf_counter() - started, backend="cli")
+            if cancel is not None:
+                cancel.unregister(process.kill)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+    def build_prompt(self, instruction: str, context_file: ContextFiles = None,
+                     context_code: Optional[str] = None) -> str:
+        """
+        Build the model prompt from the instruction and optional context.
+        
+        Args:
+            instruction: What the user wants
+            context_file: Path, comma-separated paths, list of paths or glob patterns
+                of files whose content is injected as context
+            context_code: Pasted code used as context when no file is given
+        """
+        return self._prepare_prompt(instruction, context_file, context_code)[0]
+
+    def _prepare_prompt(self, instruction: str, context_file: ContextFiles,
+                        context_code: Optional[str]) -> tuple[str, str]:
+        """
+        Build the prompt and hash the context it embeds.
+        
+        Returns:
+            tuple: (prompt, context_digest)
+        """
+        with telemetry.span("prompt"):
+            return self._assemble_prompt(instruction, context_file, context_code)
+
+    def _assemble_prompt(self, instruction: str, context_file: ContextFiles,
+                         context_code: Optional[str]) -> tuple[str, str]:
+        intro = "You are provided this existing code"
+        files = self.read_file_contents(context_file)
+        if files:
+            names = [name for name, _ in files]
+            if len(files) == 1:
+                context_code = files[0][1]
+                source = f" from {names[0]}"
+            else:
+                context_code = "\n\n".join(f"# File: {name}\n{content.rstrip()}" for name, content in files)
+                source = f" from {len(files)} files ({', '.join(names)})"
+            excerpt = self._select_context(instruction, names, context_code)
+            if excerpt:
+                context_code = excerpt
+                intro = "You are provided the parts of the existing code relevant to this request"
+        else:
+            context_code = context_code.strip() if context_code else ""
+            source = ""
 
         # Build the final prompt, inject file content if present
         if context_code:
-            prompt = f"""You are provided this existing code from {context_file}:
+            prompt = f"""{intro}{source}:
 ```python
 {context_code}
 ```
@@ -174,9 +1528,239 @@ Based on this code, {instruction}"""
             prompt = instruction
 
         # Apply dataset replacements
-        prompt = replace_known_datasets(prompt)
+        with telemetry.span("datasets"):
+            prompt = replace_known_datasets(prompt)
+        return prompt, content_digest(context_code)
+
+    @property
+    def symbol_index(self) -> SymbolIndex:
+        """Index of the working directory, opened on first use."""
+        with self._index_lock:
+            if self._symbol_index is None:
+                self._symbol_index = SymbolIndex(Path.cwd())
+            return self._symbol_index
+
+    def _select_context(self, instruction: str, context_files: List[str], content: str) -> str:
+        """
+        Pick the definitions relevant to the instruction when Python context
+        files are too big for CONTEXT_TOKEN_BUDGET.
+        
+        Returns:
+            The selected excerpt, or "" to use the files whole
+        """
+        if (not SYMBOL_INDEX_ENABLED or not all(f.endswith(".py") for f in context_files)
+                or estimate_tokens(content) <= CONTEXT_TOKEN_BUDGET):
+            return ""
+        try:
+            return self.symbol_index.select(instruction, context_files, CONTEXT_TOKEN_BUDGET)
+        except Exception as e:
+            print(f"⚠️ Warning: Symbol index unavailable ({e}). Using the whole file as context.")
+            return ""
+
+    def new_session(self) -> Session:
+        """Start a conversation whose turns refine each other's code."""
+        return Session()
+
+    @property
+    def validator(self) -> Validator:
+        """Static checker for generated code, created on first use."""
+        with self._validator_lock:
+            if self._validator is None:
+                self._validator = Validator()
+            return self._validator
+
+    @property
+    def history(self) -> GenerationHistory:
+        """Earlier generations, searchable by instruction similarity, opened on first use."""
+        with self._history_lock:
+            if self._history is None:
+                self._history = GenerationHistory()
+            return self._history
+
+    def _context_hash(self, context_file: ContextFiles, context_code: Optional[str]) -> str:
+        """Hash of a request's whole context, so history entries only match requests about the same code."""
+        files = self.read_file_contents(context_file)
+        if files:
+            return content_digest("\n\n".join(f"# File: {name}\n{content.rstrip()}" for name, content in files))
+        return content_digest(context_code.strip() if context_code else "")
+
+    def find_similar(self, instruction: str, context_file: ContextFiles = None, context_code: Optional[str] = None,
+                     use_cache: Optional[bool] = None, session: Optional[Session] = None) -> Optional[HistoryMatch]:
+        """
+        Look for an earlier generation whose instruction is close to this one (see HISTORY_THRESHOLD).
+        
+        Like the cache, this is skipped when use_cache is False and for follow-up turns of a session.
+        
+        Returns:
+            The most similar earlier generation for the same model and context, or None
+        """
+        if HISTORY_MODE == "off" or not (self.use_cache if use_cache is None else use_cache):
+            return None
+        if session is not None and session.turns:
+            return None
+        with telemetry.span("history") as fields:
+            match = self.history.find(instruction, self._context_hash(context_file, context_code))
+            fields["hit"] = match is not None
+            if match is not None:
+                fields["similarity"] = round(match.similarity, 3)
+        return match
+
+    def reuse(self, match: HistoryMatch, instruction: str, session: Optional[Session] = None) -> str:
+        """
+        Take an earlier generation as the answer to an instruction.
+        
+        Returns:
+            The status message for the reused code
+        """
+        self.history.use(match.id)
+        if session is not None:
+            session.record(instruction, match.code)
+        return f"✅ Code generated successfully! (from history, {match.describe()})"
+
+    def remember(self, instruction: str, code: str, context_file: ContextFiles = None,
+                 context_code: Optional[str] = None) -> None:
+        """Add a generated result to the history (a no-op when HISTORY_MODE is "off")."""
+        if HISTORY_MODE == "off" or not code.strip():
+            return
+        with telemetry.span("history_store"):
+            self.history.add(instruction, self._context_hash(context_file, context_code), code)
+
+    def _served(self, instruction: str, context_file: ContextFiles, context_code: Optional[str],
+                use_cache: Optional[bool], session: Optional[Session]) -> Optional[HistoryMatch]:
+        """The history match to answer with directly, when HISTORY_MODE is "serve"."""
+        if HISTORY_MODE != "serve":
+            return None
+        return self.find_similar(instruction, context_file, context_code, use_cache, session)
 
-        response, error = self.call_ollama(prompt)
+    def resolve_datasets(self, code: str) -> str:
+        """Replace short dataset names in generated code with their full paths, as in the prompt."""
+        with telemetry.span("datasets"):
+            return replace_known_datasets(code)
+
+    def _prepare_repair(self, instruction: str, code: str, validation: ValidationReport) -> tuple[str, str]:
+        """
+        Build the prompt asking the model to fix code that failed validation.
+        
+        Returns:
+            tuple: (prompt, context_digest)
+        """
+        prompt = f"""Instruction: {replace_known_datasets(instruction)}
+
+Code:
+```python
+{code}
+```
+
+Problems found:
+{validation.describe()}"""
+        return prompt, content_digest(code)
+
+    @telemetry.traced("validate")
+    def validate_and_repair(self, instruction: str, response: str, use_cache: Optional[bool] = None,
+                            max_rounds: Optional[int] = None, directory: str = ".",
+                            on_round: Optional[Callable[[int, ValidationReport], None]] = None
+                            ) -> tuple[str, RepairReport]:
+        """
+        Check generated code and let the model fix what fails.
+        
+        Syntax errors and undefined names are sent back with the code for up to
+        max_rounds repair attempts; missing imports are only reported. Repair
+        answers are cached like any other model call.
+        
+        Args:
+            instruction: The instruction the code was generated for
+            response: The model's answer
+            max_rounds: Repair attempts (defaults to VALIDATE_MAX_ROUNDS)
+            directory: Where the code will be saved, for resolving local imports
+            on_round: Called with (round number, failed validation) before each repair
+        
+        Returns:
+            tuple: (code, RepairReport); the response unchanged if it needed no repair
+        """
+        rounds = VALIDATE_MAX_ROUNDS if max_rounds is None else max_rounds
+        report = RepairReport()
+        code = response
+        while True:
+            with telemetry.span("checks") as fields:
+                validation = self.validator.validate(clean_code(code), directory)
+                fields["errors"] = len(validation.errors)
+            report.validations.append(validation)
+            if validation.ok or report.rounds >= rounds:
+                return code, report
+            if on_round is not None:
+                on_round(report.rounds + 1, validation)
+            prompt, digest = self._prepare_repair(instruction, clean_code(code), validation)
+            started = time.monotonic()
+            repaired, error, _ = self._call_ollama_cached(prompt, use_cache, digest, template=REPAIR_PROMPT)
+            report.model_seconds += time.monotonic() - started
+            if error or not repaired:
+                report.error = error or "❌ No response received from Ollama."
+                return code, report
+            code = repaired
+
+    def _check_streamed(self, instruction: str, code: str, status: str, source: str, use_cache: Optional[bool],
+                        session: Optional[Session] = None) -> tuple[str, str]:
+        """
+        Validate (and repair) the code of a finished streamed generation, unless it came from history.
+        
+        Args:
+            source: Where the code came from (see generate_code_stream_with_source)
+        
+        Returns:
+            tuple: (code, status_message) with the checks added to the status
+        """
+        if not VALIDATE_ENABLED or source == "history":
+            return code, status
+        code, report = self.validate_and_repair(instruction, code, use_cache)
+        if report.rounds and session is not None:
+            session.amend(code)
+        return code, f"{status}\n🧪 Checks: {report.summary()}"
+
+    @telemetry.traced("generate")
+    def generate_code(self, instruction: str, context_file: ContextFiles = None,
+                      context_code: Optional[str] = None, use_cache: Optional[bool] = None,
+                      session: Optional[Session] = None) -> tuple[str, str]:
+        """
+        Generate code from instruction and return the result.
+        
+        Args:
+            session: Conversation this instruction continues (see new_session)
+        
+        Returns:
+            tuple: (code, status_message) where code is the generated code and status_message is any error/info
+        """
+        if not instruction or not instruction.strip():
+            return "", "❌ Empty instruction provided."
+        
+        if self.speculative(context_file):
+            return self._generate_speculative(instruction, context_file, context_code, use_cache, session)
+        
+        if session is not None:
+            first_turn = not session.turns
+            parts = []
+            status = source = ""
+            for chunk, status, source in self.generate_code_stream_with_source(instruction, context_file,
+                                                                               context_code, use_cache, session):
+                parts.append(chunk)
+            code = "".join(parts).strip()
+            if not status.startswith("✅"):
+                return "", status
+            code, status = self._check_streamed(instruction, code, status, source, use_cache, session)
+            code = self.resolve_datasets(code)
+            if first_turn and source != "history":
+                self.remember(instruction, code, context_file, context_code)
+            return code, status
+        
+        if self.edit_target(context_file) is not None:
+            code, _, status = self.edit_code(instruction, context_file, use_cache)
+            return code, status
+        
+        match = self._served(instruction, context_file, context_code, use_cache, session)
+        if match is not None:
+            return match.code, self.reuse(match, instruction)
+        
+        prompt, digest = self._prepare_prompt(instruction, context_file, context_code)
+        response, error, from_cache = self._call_ollama_cached(prompt, use_cache, digest)
         
         if error:
             return "", error
@@ -184,29 +1768,579 @@ Based on this code, {instruction}"""
         if not response:
             return "", "❌ No response received from Ollama. Please try again."
         
-        return response, "✅ Code generated successfully!"
+        status = "✅ Code generated successfully! (from cache)" if from_cache else "✅ Code generated successfully!"
+        if VALIDATE_ENABLED:
+            response, report = self.validate_and_repair(instruction, response, use_cache)
+            status += f"\n🧪 Checks: {report.summary()}"
+        response = self.resolve_datasets(response)
+        self.remember(instruction, response, context_file, context_code)
+        return response, status
 
-    def handle_instruction(self, instruction: str, context_file: Optional[str] = None) -> None:
+    def speculative(self, context_file: ContextFiles = None) -> bool:
+        """Whether requests with this context generate several candidates (not in edit mode or over the CLI)."""
+        return self.candidates > 1 and self.http_client is not None and self.edit_target(context_file) is None
+
+    def _generate_speculative(self, instruction: str, context_file: ContextFiles, context_code: Optional[str],
+                              use_cache: Optional[bool], session: Optional[Session]) -> tuple[str, str]:
+        """generate_code with self.candidates concurrent candidates; see _speculate."""
+        match = self._served(instruction, context_file, context_code, use_cache, session)
+        if match is not None:
+            return match.code, self.reuse(match, instruction, session)
+        first_turn = session is None or not session.turns
+        prompt, digest = self._prepare_prompt(instruction, context_file, context_code)
+        response, error, report = self._speculate(instruction, prompt, digest, use_cache, session)
+        if error:
+            return "", error
+        if report is None:
+            status = "✅ Code generated successfully! (from cache)"
+        else:
+            status = f"✅ Code generated successfully! ({report.summary()})"
+        if VALIDATE_ENABLED:
+            response, repair = self.validate_and_repair(instruction, response, use_cache)
+            if repair.rounds and session is not None:
+                session.amend(response)
+            status += f"\n🧪 Checks: {repair.summary()}"
+        response = self.resolve_datasets(response)
+        if first_turn:
+            self.remember(instruction, response, context_file, context_code)
+        return response, status
+
+    def _speculate(self, instruction: str, prompt: str, digest: str, use_cache: Optional[bool],
+                   session: Optional[Session] = None) -> tuple[str, str, Optional[SpeculationReport]]:
+        """
+        Generate self.candidates answers at once and keep the first that passes validation.
+        
+        The checks need complete code, so a candidate is checked only when its
+        stream ends (with code extraction on, at the end of its code block),
+        never while it is still streaming. The first valid one wins and the
+        others are cancelled mid-stream. If none is valid, the one with the
+        fewest errors is returned for repair. Candidates use the same backend
+        path as a single answer, including the CLI fallback. The winner is
+        cached and recorded in the session like a single answer would be.
+        
+        Returns:
+            tuple: (response, error_message, report); report is None for a cached answer
+        """
+        cli_prompt = None
+        if session is not None:
+            full_prompt, fields = session.render(instruction, prompt)
+            if fields:
+                cli_prompt = session.render(instruction, prompt, continuation=False)[0]
+        else:
+            full_prompt, fields = SYSTEM_PROMPT.format(instruction=prompt), {}
+        # Candidate options only vary the sampling; the winner answers the plain request
+        key = (self._cache_key(full_prompt, digest, self._code_options(), extract=True)
+               if session is None or not session.turns else None)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            if session is not None:
+                session.record(instruction, cached)
+            return cached, "", None
+        
+        picker = CandidatePicker(self.candidates)
+        tokens = [CancelToken() for _ in range(self.candidates)]
+        results: "queue.Queue[tuple[int, str, str, Optional[ValidationReport], Dict[str, Any], float]]" = queue.Queue()
+        started = time.monotonic()
+        
+        def run(index: int, options: Dict[str, Any]) -> None:
+            final: Dict[str, Any] = {}
+            parts, error = [], ""
+            with telemetry.span("candidate", index=index):
+                try:
+                    stream = self._stream_backend(full_prompt, tokens[index],
+                                                  {**fields, "options": {**self._code_options(), **options}},
+                                                  final.update, cli_prompt)
+                    for chunk, error in self._extract_stream(stream):
+                        if error:
+                            break
+                        parts.append(chunk)
+                except Exception as e:
+                    # Every candidate must report back, or the results loop below waits forever
+                    error = f"❌ Unexpected error calling Ollama: {str(e)}"
+            text = "".join(parts).strip()
+            validation = self.validator.validate(clean_code(text)) if text and not error else None
+            results.put((index, text, error, validation, final, time.monotonic() - started))
+        
+        def cancel_all() -> None:
+            for token in tokens:
+                token.cancel()
+        
+        # Cancelling the request stops every candidate, which then reports back
+        request = current_cancel()
+        if request is not None:
+            request.register(cancel_all)
+        for index, options in enumerate(candidate_options(self.candidates)):
+            threading.Thread(target=contextvars.copy_context().run, args=(run, index, options),
+                             name=f"candidate-{index}", daemon=True).start()
+        
+        errors = []
+        try:
+            for _ in range(self.candidates):
+                index, text, error, validation, final, elapsed = results.get()
+                if validation is None:
+                    errors.append(error)
+                elif picker.offer(index, text, validation, final, elapsed):
+                    break
+        finally:
+            if request is not None:
+                request.unregister(cancel_all)
+            # Also when interrupted (Ctrl+C): no candidate may keep generating
+            cancel_all()
+        self.speculation.record(picker.report)
+        
+        if picker.best is None:
+            return "", errors[0] if errors else "❌ No response received from Ollama. Please try again.", picker.report
+        response, final = picker.best
+        if session is not None:
+            session.record(instruction, response, final)
+        if key is not None:
+            self.cache.put(key, response)
+        return response, "", picker.report
+
+    def generate_code_stream(self, instruction: str, context_file: ContextFiles = None,
+                             context_code: Optional[str] = None,
+                             use_cache: Optional[bool] = None,
+                             session: Optional[Session] = None) -> Iterator[tuple[str, str]]:
+        """
+        Streaming variant of generate_code.
+        
+        Yields:
+            tuple: (chunk, status_message); chunks arrive with an empty status and the
+            stream always ends with ("", status_message) describing the outcome
+        """
+        stream = self.generate_code_stream_with_source(instruction, context_file, context_code, use_cache, session)
+        try:
+            for chunk, status, _ in stream:
+                yield chunk, status
+        finally:
+            stream.close()
+
+    @telemetry.traced("generate", status=lambda item: item[1])
+    def generate_code_stream_with_source(self, instruction: str, context_file: ContextFiles = None,
+                                         context_code: Optional[str] = None,
+                                         use_cache: Optional[bool] = None,
+                                         session: Optional[Session] = None) -> Iterator[tuple[str, str, str]]:
+        """
+        generate_code_stream that also tells where a successful answer came from.
+        
+        Yields:
+            tuple: (chunk, status_message, source); source is "" except on the final
+            item of a successful answer, where it is "model", "cache" or "history"
+        """
+        if not instruction or not instruction.strip():
+            yield "", "❌ Empty instruction provided.", ""
+            return
+        
+        match = self._served(instruction, context_file, context_code, use_cache, session)
+        if match is not None:
+            yield match.code, "", ""
+            yield "", self.reuse(match, instruction, session), "history"
+            return
+        
+        prompt, digest = self._prepare_prompt(instruction, context_file, context_code)
+        if session is not None:
+            stream = self._stream_session(instruction, prompt, digest, session, use_cache)
+        else:
+            stream = self._stream_ollama_cached(prompt, use_cache, digest)
+        received = False
+        from_cache = False
+        for chunk, error, from_cache in stream:
+            if error:
+                yield "", error, ""
+                return
+            received = True
+            yield chunk, "", ""
+        
+        if not received:
+            yield "", "❌ No response received from Ollama. Please try again.", ""
+            return
+        
+        if from_cache:
+            yield "", "✅ Code generated successfully! (from cache)", "cache"
+        else:
+            yield "", "✅ Code generated successfully!", "model"
+
+    def edit_target(self, context_file: ContextFiles, edit: Optional[bool] = None) -> Optional[tuple[str, str]]:
+        """
+        Decide whether a request should use edit mode.
+        
+        Args:
+            context_file: The request's context files
+            edit: Force edit mode on or off (defaults to EDIT_MODE)
+        
+        Returns:
+            tuple: (path, content) of the single file to edit, or None for full regeneration
+        """
+        mode = EDIT_MODE if edit is None else ("on" if edit else "off")
+        if mode == "off":
+            return None
+        paths = self.expand_context_paths(context_file)
+        if len(paths) != 1:
+            return None
+        content = self.read_file_content(paths[0])
+        if not content.strip():
+            return None
+        if mode == "auto" and (not paths[0].endswith(".py") or content.count("\n") + 1 < EDIT_MIN_LINES):
+            return None
+        return paths[0], content
+
+    def _prepare_edit(self, instruction: str, path: str, content: str) -> tuple[str, str]:
+        """
+        Build the edit-mode prompt for one file.
+        
+        Large files are shown as the excerpts the symbol index selects; SEARCH
+        blocks copied from them still match the full file.
+        
+        Returns:
+            tuple: (prompt, context_digest)
+        """
+        shown = self._select_context(instruction, [path], content) or content
+        label = f"Relevant parts of {path}" if shown is not content else f"File {path}"
+        # Dataset names are replaced in the instruction only; the code must stay verbatim to match
+        prompt = f"""{label}:
+```python
+{shown}
+```
+
+Instruction: {replace_known_datasets(instruction)}"""
+        return prompt, content_digest(shown)
+
+    def _apply_edit(self, path: str, content: str, response: str) -> tuple[str, str]:
+        """
+        Apply an edit-mode response.
+        
+        Dataset names are resolved in the changed lines only, so the patch shows
+        every line that differs from the file.
+        
+        Returns:
+            tuple: (edited_code, patch)
+        
+        Raises:
+            PatchError: If the edits do not apply cleanly
+        """
+        edited = rewrite_changed_lines(content, apply_edit(content, response), self.resolve_datasets)
+        return edited, make_patch(content, edited, path)
+
+    @telemetry.traced("edit")
+    def edit_code(self, instruction: str, context_file: ContextFiles,
+                  use_cache: Optional[bool] = None) -> tuple[str, str, str]:
+        """
+        Change an existing file by asking the model for edits only.
+        
+        Much faster than regenerating a long file for a small change, since
+        output tokens dominate latency. Falls back to full regeneration when
+        the edits do not apply.
+        
+        Returns:
+            tuple: (code, patch, status_message) where code is the complete updated file and
+            patch a unified diff against it (empty after a fallback)
+        """
+        code, patch, status = "", "", ""
+        for code, patch, status in self.edit_code_stream(instruction, context_file, use_cache):
+            pass
+        return (code, patch, status) if status.startswith("✅") else ("", "", status)
+
+    @telemetry.traced("edit")
+    def edit_code_stream(self, instruction: str, context_file: ContextFiles,
+                         use_cache: Optional[bool] = None) -> Iterator[tuple[str, str, str]]:
+        """
+        Streaming variant of edit_code.
+        
+        Yields:
+            tuple: (text, patch, status_message) where text is everything received so far;
+            the last item carries the complete updated file, the patch and the outcome
+        """
+        if not instruction or not instruction.strip():
+            yield "", "", "❌ Empty instruction provided."
+            return
+        target = self.edit_target(context_file, edit=True)
+        if target is None:
+            yield "", "", "❌ Edit mode needs exactly one readable context file."
+            return
+        
+        path, content = target
+        prompt, digest = self._prepare_edit(instruction, path, content)
+        text = ""
+        from_cache = False
+        for chunk, error, from_cache in self._stream_ollama_cached(prompt, use_cache, digest, EDIT_PROMPT,
+                                                                   extract=False):
+            if error:
+                yield text, "", error
+                return
+            text += chunk
+            yield text, "", ""
+        
+        try:
+            with telemetry.span("apply_edit"):
+                edited, patch = self._apply_edit(path, content, text)
+        except PatchError as e:
+            yield text, "", f"↩️ Edit did not apply ({e}); regenerating the whole file..."
+            text = ""
+            for chunk, status, source in self.generate_code_stream_with_source(instruction, path,
+                                                                               use_cache=use_cache):
+                text += chunk
+                if status.startswith("✅"):
+                    text, status = self._check_streamed(instruction, text, status, source, use_cache)
+                    text = self.resolve_datasets(text)
+                yield text, "", status
+            return
+        
+        status = f"✅ Edit applied to {path} ({count_changed_lines(patch)} changed lines)!"
+        yield edited, patch, status + (" (from cache)" if from_cache else "")
+
+    def _stream_session(self, instruction: str, prompt: str, digest: str, session: Session,
+                        use_cache: Optional[bool]) -> Iterator[tuple[str, str, bool]]:
+        """
+        Stream one turn of a session, continuing from the context Ollama returned last turn.
+        
+        Only a session's first turn matches a plain request, so only it uses the cache.
+        The turn is not shared with other callers, so it is cancelled through the
+        request's own token (see cancellable).
+        
+        Yields:
+            tuple: (chunk, error_message, from_cache)
+        """
+        full_prompt, fields = session.render(instruction, prompt, continuation=self.http_client is not None)
+        cli_prompt = session.render(instruction, prompt, continuation=False)[0] if fields else None
+        key = None
+        if not session.turns:
+            key = self._cache_key(full_prompt, digest, self._code_options(), extract=True)
+            cached = self._cache_lookup(key, use_cache)
+            if cached is not None:
+                session.record(instruction, cached)
+                yield cached, "", True
+                return
+        
+        final: Dict[str, Any] = {}
+        parts = []
+        options = self._code_options()
+        if options:
+            fields = {**fields, "options": options}
+        # Over HTTP the answer is received to the end even after its code block: stopping
+        # early would lose the context Ollama sends last, and the next turn would have to
+        # resend the whole conversation
+        stream = self._stream_backend(full_prompt, current_cancel(), fields, final.update, cli_prompt)
+        for chunk, error in self._extract_stream(stream, stop_early=self.http_client is None):
+            if error:
+                yield "", error, False
+                return
+            parts.append(chunk)
+            yield chunk, "", False
+        
+        response = "".join(parts).strip()
+        if response:
+            session.record(instruction, response, final)
+            if key is not None:
+                self.cache.put(key, response)
+
+    def handle_instruction(self, instruction: str, context_file: ContextFiles = None,
+                           use_cache: Optional[bool] = None, session: Optional[Session] = None) -> None:
         """Handle a coding instruction from the user (CLI version)."""
         if not instruction or not instruction.strip():
             print("❌ Empty instruction provided.")
             return
         
         print("🤖 Thinking...")
+        # The reuse question appears only for some instructions, so it is asked only at a terminal:
+        # a script piping answers into the prompts would get out of step
+        code, edited_path = self.answer_instruction(instruction, context_file, use_cache, session,
+                                                    offer=sys.stdin.isatty())
+        if edited_path:
+            self._offer_patch(edited_path, code)
+        elif code:
+            self._offer_save(code)
 
-        code, status = self.generate_code(instruction, context_file)
+    def run_instruction(self, instruction: str, context_file: ContextFiles = None, save_as: Optional[str] = None,
+                        run: bool = False, use_cache: Optional[bool] = None,
+                        session: Optional[Session] = None) -> bool:
+        """
+        Handle a coding instruction without prompting (CLI one-shot and daemon version).
+        
+        Args:
+            save_as: Path to write the result to, e.g. the context file itself to apply an edit
+            run: Execute the saved file
+        
+        Returns:
+            True if code was produced (and saved and ran successfully, when asked to)
+        """
+        if not instruction or not instruction.strip():
+            print("❌ Empty instruction provided.")
+            return False
         
+        print("🤖 Thinking...")
+        code, edited_path = self.answer_instruction(instruction, context_file, use_cache, session)
         if not code:
+            return False
+        if not save_as:
+            return True
+        directory = os.path.dirname(save_as)
+        # An edited file is complete code already; extracting it again could only lose lines
+        if not save_to_file(os.path.basename(save_as), code, directory=directory or None,
+                            clean=edited_path is None):
+            return False
+        # save_to_file may have adjusted the name, e.g. added .py
+        return execute_file(os.path.join(directory, sanitize_filename(save_as))) if run else True
+
+    def answer_instruction(self, instruction: str, context_file: ContextFiles = None,
+                           use_cache: Optional[bool] = None, session: Optional[Session] = None,
+                           offer: bool = False) -> tuple[str, Optional[str]]:
+        """
+        Print the answer to an instruction as it streams, with the checks and the patch of an edit.
+        
+        Args:
+            offer: Ask whether to reuse a similar earlier generation, when HISTORY_MODE is "offer";
+                only the interactive loop asks, one-shot and daemon runs never wait for input
+        
+        Returns:
+            tuple: (code, edited_path) where code is empty on failure and edited_path is the
+            context file the code is a patched version of (None for newly generated code)
+        """
+        target = self.edit_target(context_file)
+        if offer and target is None and HISTORY_MODE == "offer":
+            match = self.find_similar(instruction, context_file, use_cache=use_cache, session=session)
+            if match is not None and self._offer_reuse(match):
+                print(f"\n🧠 Plan:\n{match.code}")
+                print(self.reuse(match, instruction, session))
+                return match.code, None
+        # The trace ends before any save prompts, so it measures the assistant and not the user
+        with telemetry.request("instruction"), cancellable():
+            if target is not None:
+                code, patch = self._stream_edit(instruction, target[0], use_cache, session)
+            else:
+                code, patch = self._stream_generation(instruction, context_file, use_cache, session), ""
+        return code, target[0] if patch else None
+
+    def _stream_generation(self, instruction: str, context_file: ContextFiles, use_cache: Optional[bool],
+                           session: Optional[Session]) -> str:
+        """CLI flow for generation: print the answer as it streams and return the checked code ("" on failure)."""
+        first_turn = session is None or not session.turns
+        if self.speculative(context_file):
+            print(f"🎲 Generating {self.candidates} candidates...")
+            code, status = self.generate_code(instruction, context_file, use_cache=use_cache, session=session)
+            if code:
+                print(f"\n🧠 Plan:\n{code}")
             print(status)
-            return
+            return code
+
+        parts = []
+        status = source = ""
+        for chunk, status, source in self.generate_code_stream_with_source(instruction, context_file,
+                                                                           use_cache=use_cache, session=session):
+            if chunk:
+                if not parts:
+                    print("\n🧠 Plan:")
+                parts.append(chunk)
+                print(chunk, end="", flush=True)
+        code = "".join(parts)
         
-        print("\n🧠 Plan:\n" + code)
+        if parts:
+            print()
+        if not code or not status.startswith("✅"):
+            print(status)
+            return ""
+        if source == "cache":
+            print("⚡ Served from cache")
+        elif source == "history":
+            print(f"♻️ Served from history ({status.split('(from history, ', 1)[1]}")
+            return code
+        elif session is not None and session.last_prompt_tokens is not None and session.stats()["turns"] > 1:
+            print(f"🔁 Turn {session.stats()['turns']}: evaluated {session.last_prompt_tokens} new prompt tokens")
+        self._report_extraction()
+
+        if VALIDATE_ENABLED:
+            code = self._check_code(instruction, code, use_cache, session)
+        resolved = self.resolve_datasets(code)
+        if resolved != code:
+            print("📚 Dataset names resolved to their full paths in load_dataset calls")
+            code = resolved
+        if first_turn:
+            self.remember(instruction, code, context_file)
+        return code
+
+    def _report_extraction(self) -> None:
+        """Print what code extraction saved in the current request, if anything."""
+        trace = telemetry.current()
+        spans = [span for span in trace.to_dict()["spans"] if span["name"] == "extract"] if trace else []
+        chatter = sum(span.get("chatter_tokens") or 0 for span in spans)
+        if any(span.get("early_stop") for span in spans):
+            print(f"✂️ Stopped the model at the end of the code block (~{chatter} tokens of fences and chatter dropped)")
+        elif chatter:
+            print(f"✂️ Dropped ~{chatter} tokens of fences and chatter around the code")
+
+    def _check_code(self, instruction: str, code: str, use_cache: Optional[bool],
+                    session: Optional[Session]) -> str:
+        """CLI flow for validation: report problems, show repaired code and return the final version."""
+        def announce(round_number: int, validation: ValidationReport) -> None:
+            print(f"\n🔧 Repair round {round_number}, fixing:\n{validation.describe()}")
+        
+        checked, report = self.validate_and_repair(instruction, code, use_cache, on_round=announce)
+        if report.rounds and checked != code:
+            print(f"\n🧠 Repaired code:\n{checked}")
+            if session is not None:
+                session.amend(checked)
+        if report.error:
+            print(report.error)
+        for warning in report.validations[-1].warnings:
+            print(f"⚠️ {warning}")
+        print(f"🧪 Checks: {report.summary()}")
+        return checked
+
+    def _stream_edit(self, instruction: str, path: str, use_cache: Optional[bool],
+                     session: Optional[Session]) -> tuple[str, str]:
+        """
+        CLI flow for edit mode: stream the edits and show the patch.
+        
+        Returns:
+            tuple: (code, patch); patch is empty after falling back to regeneration,
+            and both are empty on failure
+        """
+        shown = ""
+        code, patch, status = "", "", ""
+        for code, patch, status in self.edit_code_stream(instruction, path, use_cache):
+            if status.startswith("↩️"):
+                print(f"\n{status}")
+                shown = ""
+            elif not patch and code.startswith(shown) and code != shown:
+                if not shown:
+                    print("\n✏️ Edits:")
+                print(code[len(shown):], end="", flush=True)
+                shown = code
+        print()
+        if not code or not status.startswith("✅"):
+            print(status)
+            return "", ""
+        if session is not None:
+            session.record(instruction, code)
+        if patch:
+            print(f"\n📝 Patch:\n{patch}")
+        elif code != shown:
+            print(f"\n🧠 Checked code:\n{code}")
+        print(status)
+        return code, patch
+
+    def _offer_reuse(self, match: HistoryMatch) -> bool:
+        """Ask whether to take a similar earlier generation instead of generating anew."""
+        answer = input(f"♻️ An earlier answer is {match.describe()}. Reuse it? (y/n): ").lower().strip()
+        return answer == "y"
+
+    def _offer_patch(self, path: str, code: str) -> None:
+        """Ask whether to write an edited file back (and then run it)."""
+        apply = input(f"💾 Apply to {path}? (y/n): ").lower().strip()
+        if apply == "y":
+            if save_to_file(os.path.basename(path), code, directory=os.path.dirname(path) or None, clean=False):
+                run = input("▶️ Run this file? (y/n): ").lower().strip()
+                if run == "y":
+                    execute_file(path)
+        else:
+            self._offer_save(code, clean=False)
 
+    def _offer_save(self, code: str, clean: bool = True) -> None:
+        """Ask whether to save (and then run) generated code; clean=False for an edited file."""
         save = input("💾 Save to file? (y/n): ").lower().strip()
         if save == "y":
             filename = input("📄 Filename (e.g., tool.py): ").strip()
             if filename:
-                if save_to_file(filename, code):
+                if save_to_file(filename, code, clean=clean):
                     run = input("▶️ Run this file? (y/n): ").lower().strip()
                     if run == "y":
                         # Use sanitized filename from save_to_file
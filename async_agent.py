@@ -0,0 +1,245 @@
+import asyncio
+import contextlib
+import time
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+from config import ASYNC_MAX_CONCURRENCY
+from session import Session
+from validation import ValidationReport, RepairReport
+from agent import CodingAgent, ContextFiles, CancelToken, cancellable
+import telemetry
+
+_T = TypeVar("_T")
+
+class AsyncCodingAgent:
+    """
+    Asyncio front end to CodingAgent.
+
+    Every request runs the synchronous agent's own implementation on a worker
+    thread, so cache, sessions, edits, checks and speculation behave exactly
+    as they do for CodingAgent. At most max_concurrency requests run at once;
+    the others wait on the event loop without holding a thread. Methods keep
+    the (result, error/status) tuple contract of the synchronous class, and
+    cancelling a task cancels its request (see agent.cancellable), which
+    aborts its model calls or kills its `ollama run` process.
+    """
+
+    def __init__(self, agent: Optional[CodingAgent] = None, max_concurrency: int = ASYNC_MAX_CONCURRENCY):
+        """
+        Args:
+            agent: Synchronous agent that serves the requests
+            max_concurrency: Maximum number of requests running at once
+        """
+        self.agent = agent if agent is not None else CodingAgent()
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """Semaphore limiting running requests (created on first use inside the loop)."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @contextlib.asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        """Hold one of the max_concurrency slots, recording the wait as a "queue" span."""
+        waiting = time.perf_counter()
+        async with self.semaphore:
+            telemetry.record("queue", time.perf_counter() - waiting)
+            yield
+
+    async def _run(self, function: Callable[..., _T], *args: Any) -> _T:
+        """
+        Run a blocking CodingAgent call on a worker thread as one cancellable request.
+
+        If the awaiting task is cancelled, the request is cancelled too and
+        CancelledError is raised once the worker has stopped.
+        """
+        token = CancelToken()
+
+        def call() -> _T:
+            with cancellable(token):
+                return function(*args)
+
+        async with self._slot():
+            # to_thread copies the context, so the worker's spans land in this task's trace
+            worker = asyncio.ensure_future(asyncio.to_thread(call))
+            try:
+                return await asyncio.shield(worker)
+            except asyncio.CancelledError:
+                token.cancel()
+                await asyncio.gather(worker, return_exceptions=True)
+                raise
+
+    async def _iterate(self, function: Callable[..., Iterator[_T]], *args: Any) -> AsyncIterator[_T]:
+        """
+        Run a CodingAgent generator on a worker thread and yield its items as they arrive.
+
+        Closing the iterator early (callers close it explicitly, like
+        telemetry.traced does) or cancelling the task cancels the request; the
+        generator is closed on its own thread before this returns.
+        """
+        loop = asyncio.get_running_loop()
+        # (item, exception) pairs from the worker; None once it is done
+        items: "asyncio.Queue[Optional[tuple[Any, Optional[BaseException]]]]" = asyncio.Queue()
+        token = CancelToken()
+
+        def send(message: Optional[tuple[Any, Optional[BaseException]]]) -> None:
+            try:
+                loop.call_soon_threadsafe(items.put_nowait, message)
+            except RuntimeError:
+                # The event loop is closed, so nobody is reading any more
+                token.cancel()
+
+        def pump() -> None:
+            with cancellable(token):
+                stream = function(*args)
+                try:
+                    for item in stream:
+                        send((item, None))
+                        if token.cancelled:
+                            break
+                except Exception as e:
+                    send((None, e))
+                finally:
+                    stream.close()
+                    send(None)
+
+        async with self._slot():
+            worker = asyncio.ensure_future(asyncio.to_thread(pump))
+            finished = False
+            try:
+                while True:
+                    message = await items.get()
+                    if message is None:
+                        finished = True
+                        return
+                    item, error = message
+                    if error is not None:
+                        raise error
+                    yield item
+            finally:
+                if not finished:
+                    token.cancel()
+                await asyncio.gather(worker, return_exceptions=True)
+
+    @telemetry.traced("call")
+    async def call_ollama(self, prompt: str, use_cache: Optional[bool] = None,
+                          context_digest: str = "") -> tuple[str, str]:
+        """
+        Async version of CodingAgent.call_ollama.
+
+        Returns:
+            tuple: (response, error_message) where response is the code or empty string, and error_message is any error
+        """
+        return await self._run(self.agent.call_ollama, prompt, use_cache, context_digest)
+
+    @telemetry.traced("call")
+    async def call_ollama_stream(self, prompt: str, use_cache: Optional[bool] = None,
+                                 context_digest: str = "") -> AsyncIterator[tuple[str, str]]:
+        """
+        Async version of CodingAgent.call_ollama_stream.
+
+        Yields:
+            tuple: (chunk, error_message); a failure is reported once as ("", error_message)
+        """
+        stream = self._iterate(self.agent.call_ollama_stream, prompt, use_cache, context_digest)
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
+
+    @telemetry.traced("generate")
+    async def generate_code(self, instruction: str, context_file: ContextFiles = None,
+                            context_code: Optional[str] = None, use_cache: Optional[bool] = None,
+                            session: Optional[Session] = None) -> tuple[str, str]:
+        """
+        Async version of CodingAgent.generate_code.
+
+        Returns:
+            tuple: (code, status_message) where code is the generated code and status_message is any error/info
+        """
+        return await self._run(self.agent.generate_code, instruction, context_file, context_code, use_cache,
+                               session)
+
+    @telemetry.traced("generate")
+    async def generate_code_stream(self, instruction: str, context_file: ContextFiles = None,
+                                   context_code: Optional[str] = None,
+                                   use_cache: Optional[bool] = None,
+                                   session: Optional[Session] = None) -> AsyncIterator[tuple[str, str]]:
+        """
+        Async version of CodingAgent.generate_code_stream.
+
+        Yields:
+            tuple: (chunk, status_message); the stream always ends with ("", status_message)
+        """
+        stream = self._iterate(self.agent.generate_code_stream, instruction, context_file, context_code, use_cache,
+                               session)
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
+
+    @telemetry.traced("generate", status=lambda item: item[1])
+    async def generate_code_stream_with_source(self, instruction: str, context_file: ContextFiles = None,
+                                               context_code: Optional[str] = None,
+                                               use_cache: Optional[bool] = None,
+                                               session: Optional[Session] = None
+                                               ) -> AsyncIterator[tuple[str, str, str]]:
+        """
+        Async version of CodingAgent.generate_code_stream_with_source.
+
+        Yields:
+            tuple: (chunk, status_message, source); source is "model", "cache" or "history" on the final item
+            of a successful answer
+        """
+        stream = self._iterate(self.agent.generate_code_stream_with_source, instruction, context_file,
+                               context_code, use_cache, session)
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
+
+    @telemetry.traced("validate")
+    async def validate_and_repair(self, instruction: str, response: str, use_cache: Optional[bool] = None,
+                                  max_rounds: Optional[int] = None, directory: str = ".",
+                                  on_round: Optional[Callable[[int, ValidationReport], None]] = None
+                                  ) -> tuple[str, RepairReport]:
+        """
+        Async version of CodingAgent.validate_and_repair.
+
+        on_round is called on the worker thread.
+        """
+        return await self._run(self.agent.validate_and_repair, instruction, response, use_cache, max_rounds,
+                               directory, on_round)
+
+    @telemetry.traced("edit")
+    async def edit_code(self, instruction: str, context_file: ContextFiles,
+                        use_cache: Optional[bool] = None) -> tuple[str, str, str]:
+        """
+        Async version of CodingAgent.edit_code.
+
+        Returns:
+            tuple: (code, patch, status_message)
+        """
+        return await self._run(self.agent.edit_code, instruction, context_file, use_cache)
+
+    @telemetry.traced("edit")
+    async def edit_code_stream(self, instruction: str, context_file: ContextFiles,
+                               use_cache: Optional[bool] = None) -> AsyncIterator[tuple[str, str, str]]:
+        """
+        Async version of CodingAgent.edit_code_stream.
+
+        Yields:
+            tuple: (text, patch, status_message) like the synchronous version
+        """
+        stream = self._iterate(self.agent.edit_code_stream, instruction, context_file, use_cache)
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
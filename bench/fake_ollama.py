@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for Ollama, for benchmarks.
+
+Server mode speaks the parts of the REST API the agent uses:
+/api/generate and /api/chat (streamed or not), /api/version and /api/tags.
+
+    python bench/fake_ollama.py serve --port 11500 --token-rate 200 --latency 0.05
+
+CLI mode behaves like `ollama run MODEL PROMPT`. Point OLLAMA_BIN at this file
+and configure it through FAKE_OLLAMA_* environment variables:
+
+    OLLAMA_BIN=bench/fake_ollama.py OLLAMA_BACKEND=cli python main.py
+
+The answer is a valid Python script derived from the prompt, so identical
+prompts get identical answers. Timing: --latency seconds before the first
+token, then --token-rate tokens per second. With --failure-rate a seeded
+share of requests fails, either with an HTTP 500 error or by dropping the
+connection mid-stream (--failure-mode). The `stop` and `num_predict`
+options are honoured, and --chatter wraps answers in the preamble, fence and
+explanation chatty models add; GET /fake/stats reports how many tokens were
+planned and how many actually sent before clients hung up.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# Characters per fake token, roughly what real tokenizers average on code
+CHARS_PER_TOKEN = 4
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+class FakeModel:
+    """Produces answers and their timing."""
+
+    def __init__(self, token_rate: float = 100.0, latency: float = 0.05, tokens: int = 120,
+                 failure_rate: float = 0.0, failure_mode: str = "error", chatter: bool = False, seed: int = 0):
+        """
+        Args:
+            token_rate: Tokens streamed per second (0 for no delay)
+            latency: Seconds before the first token, standing in for prompt evaluation
+            tokens: Length of each answer in tokens
+            failure_rate: Share of requests that fail, between 0 and 1
+            failure_mode: "error" (HTTP 500 / exit code 1) or "drop" (stop mid-answer)
+            chatter: Wrap the code in a markdown fence followed by an explanation, like chatty models do
+            seed: Seed for the failure draws
+        """
+        self.token_rate = token_rate
+        self.latency = latency
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.chatter = chatter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_planned = 0
+        self.tokens_sent = 0
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def answer(self, prompt: str) -> List[str]:
+        """The answer to prompt, split into tokens."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        lines = [f'"""Generated for request {digest[:12]}."""', ""]
+        budget = self.tokens * CHARS_PER_TOKEN
+        i = 0
+        while sum(len(line) + 1 for line in lines) < budget - 40:
+            factor = int(digest[i % 60:i % 60 + 4], 16) % 97 + 1
+            lines += [f"def step_{i}(value):", f"    return value * {factor} + {i}", ""]
+            i += 1
+        lines.append(f"print(step_0(1) if {i} else 0)")
+        text = "\n".join(lines) + "\n"
+        if self.chatter:
+            text = (f"Here is the script you asked for:\n\n```python\n{text}```\n\n"
+                    f"This script defines {i} helper functions and prints the first result. Each helper "
+                    f"multiplies its input by a constant and adds its own index.\n\nExample usage:\n"
+                    f"```python\nprint(step_0(2))\n```\n\nLet me know if you need anything else!")
+        return [text[j:j + CHARS_PER_TOKEN] for j in range(0, len(text), CHARS_PER_TOKEN)]
+
+    def limit(self, tokens: List[str], options: Dict[str, Any]) -> List[str]:
+        """Apply the `stop` and `num_predict` options to an answer."""
+        stops = options.get("stop") or []
+        if stops:
+            text = "".join(tokens)
+            text = text[:min((text.find(stop) for stop in stops if stop in text), default=len(text))]
+            tokens = [text[j:j + CHARS_PER_TOKEN] for j in range(0, len(text), CHARS_PER_TOKEN)]
+        if options.get("num_predict", 0) > 0:
+            tokens = tokens[:options["num_predict"]]
+        return tokens
+
+    def count(self, planned: int, sent: int) -> None:
+        """Record the length of an answer and how much of it the client received."""
+        with self._lock:
+            self.tokens_planned += planned
+            self.tokens_sent += sent
+
+    def pace(self, started: float, index: int) -> None:
+        """Sleep until token index is due."""
+        due = started + self.latency + (index / self.token_rate if self.token_rate > 0 else 0)
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def final_message(self, prompt: str, tokens: int, started: float, first_token: float) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "context": list(range(min(tokens, 64))),
+            "total_duration": int((now - started) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": max(len(prompt) // CHARS_PER_TOKEN, 1),
+            "prompt_eval_duration": int((first_token - started) * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int((now - first_token) * 1e9),
+        }
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOllama/1.0"
+
+    @property
+    def model(self) -> FakeModel:
+        return self.server.model
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, body: Dict[str, Any]) -> None:
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        if self.path == "/api/version":
+            self._send_json(200, {"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "fake:latest"}]})
+        elif self.path == "/fake/stats":
+            self._send_json(200, {"requests": self.model.requests, "tokens_planned": self.model.tokens_planned,
+                                  "tokens_sent": self.model.tokens_sent})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if self.path not in ("/api/generate", "/api/chat"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        chat = self.path == "/api/chat"
+        prompt = "\n".join(m.get("content", "") for m in payload.get("messages", [])) if chat else payload.get("prompt", "")
+        started = time.monotonic()
+        if not prompt:
+            # An empty prompt only loads the model
+            self._send_json(200, {"done": True, "done_reason": "load", "response": ""})
+            return
+        fail = self.model.should_fail()
+        if fail and self.model.failure_mode == "error":
+            self.model.pace(started, 0)
+            self._send_json(500, {"error": "fake failure"})
+            return
+
+        tokens = self.model.limit(self.model.answer(prompt), payload.get("options") or {})
+        drop_at = len(tokens) // 2 if fail else None
+
+        def message(text: str) -> Dict[str, Any]:
+            if chat:
+                return {"message": {"role": "assistant", "content": text}, "done": False}
+            return {"response": text, "done": False}
+
+        if not payload.get("stream", True):
+            self.model.pace(started, len(tokens))
+            first_token = started + self.model.latency
+            body = message("".join(tokens))
+            body.update(self.model.final_message(prompt, len(tokens), started, first_token))
+            if fail:
+                # Announce the full body but close after half of it
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data[:len(data) // 2])
+                self.close_connection = True
+                return
+            self._send_json(200, body)
+            self.model.count(len(tokens), len(tokens))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        first_token = started
+        sent = 0
+        try:
+            for i, token in enumerate(tokens):
+                self.model.pace(started, i)
+                if i == 0:
+                    first_token = time.monotonic()
+                if i == drop_at:
+                    # Simulate a crashed server: close without finishing the chunked body
+                    self.close_connection = True
+                    return
+                self._send_chunk(message(token))
+                sent += 1
+            final = message("")
+            final.update(self.model.final_message(prompt, len(tokens), started, first_token))
+            self._send_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the request
+            pass
+        finally:
+            self.model.count(len(tokens), sent)
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, model: FakeModel):
+        super().__init__(address, FakeOllamaHandler)
+        self.model = model
+
+def start_server(model: FakeModel, host: str = "127.0.0.1", port: int = 0) -> FakeOllamaServer:
+    """Serve model on a background thread; port 0 picks a free port (see server.server_port)."""
+    server = FakeOllamaServer((host, port), model)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+def _model_from_env() -> FakeModel:
+    return FakeModel(
+        token_rate=_env_float("FAKE_OLLAMA_TOKEN_RATE", 100.0),
+        latency=_env_float("FAKE_OLLAMA_LATENCY", 0.05),
+        tokens=int(_env_float("FAKE_OLLAMA_TOKENS", 120)),
+        failure_rate=_env_float("FAKE_OLLAMA_FAILURE_RATE", 0.0),
+        failure_mode=os.getenv("FAKE_OLLAMA_FAILURE_MODE", "error"),
+        chatter=os.getenv("FAKE_OLLAMA_CHATTER", "0") == "1",
+        # Separate CLI processes draw independently unless a seed is given
+        seed=int(os.getenv("FAKE_OLLAMA_SEED", str(random.randrange(1 << 30)))),
+    )
+
+def run_cli(prompt: str, model: FakeModel) -> int:
+    """Behave like `ollama run`: stream the answer to stdout."""
+    started = time.monotonic()
+    if model.should_fail() and model.failure_mode == "error":
+        model.pace(started, 0)
+        print("Error: fake failure", file=sys.stderr)
+        return 1
+    tokens = model.answer(prompt)
+    for i, token in enumerate(tokens):
+        model.pace(started, i)
+        sys.stdout.write(token)
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server and CLI for benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the REST API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=11434, help="0 picks a free port, printed on startup")
+    serve.add_argument("--token-rate", type=float, default=100.0, help="tokens per second (0: no delay)")
+    serve.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    serve.add_argument("--tokens", type=int, default=120, help="answer length in tokens")
+    serve.add_argument("--failure-rate", type=float, default=0.0, help="share of failing requests (0-1)")
+    serve.add_argument("--failure-mode", choices=("error", "drop"), default="error")
+    serve.add_argument("--chatter", action="store_true", help="wrap answers in a fence followed by prose")
+    serve.add_argument("--seed", type=int, default=0)
+    run = commands.add_parser("run", help="answer one prompt like `ollama run` (settings from FAKE_OLLAMA_*)")
+    run.add_argument("model")
+    run.add_argument("prompt", nargs="?", default="")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        return run_cli(args.prompt or sys.stdin.read(), _model_from_env())
+
+    model = FakeModel(args.token_rate, args.latency, args.tokens, args.failure_rate, args.failure_mode,
+                      args.chatter, args.seed)
+    server = FakeOllamaServer((args.host, args.port), model)
+    print(f"http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
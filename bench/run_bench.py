@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the agent against the deterministic fake Ollama.
+
+    python bench/run_bench.py --out bench/results/current.json
+    python bench/run_bench.py --compare bench/results/previous.json
+
+Measures time to first token, latency percentiles and throughput under
+concurrency for model calls (REST API and CLI backend), generate_code and
+batch mode, plus the local steps: replace_known_datasets, clean_code and
+execute_file. The extract group measures how many tokens stopping at the
+end of the code block saves on answers padded with chatter. The history
+group times near-duplicate lookups in a generation history of
+--history-entries instructions, and the abort group how long Ctrl+C takes
+to stop a streaming generation or a running script. Results are written as JSON so runs of different versions can
+be compared with --compare. The response cache, generation history and
+model warm-up are disabled so every request reaches the fake server.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKE_OLLAMA = os.path.join(BENCH_DIR, "fake_ollama.py")
+
+# Metrics shown by --compare, where lower is better
+COMPARED_METRICS = ("ttft_p50", "latency_p50", "latency_p95", "seconds_per_call", "wall_seconds", "abort_p50")
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+def summarize(latencies: List[float], wall: float, ttfts: Optional[List[float]] = None,
+              failures: int = 0) -> Dict[str, Any]:
+    """Percentiles and throughput for one benchmark run."""
+    result: Dict[str, Any] = {
+        "requests": len(latencies) + failures,
+        "failures": failures,
+        "wall_seconds": wall,
+        "throughput_per_second": len(latencies) / wall if wall > 0 else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+    }
+    if ttfts is not None:
+        result["ttft_p50"] = percentile(ttfts, 50)
+        result["ttft_p95"] = percentile(ttfts, 95)
+    return result
+
+def concurrent_calls(call: Callable[[int], Optional[float]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Run call(i) for i in range(requests) on concurrency threads.
+
+    call returns the time to first token (or None) and raises on failure.
+    """
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    failures = 0
+
+    def timed(i: int):
+        started = time.perf_counter()
+        ttft = call(i)
+        return time.perf_counter() - started, ttft
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(timed, i) for i in range(requests)]
+        for future in futures:
+            try:
+                latency, ttft = future.result()
+            except Exception:
+                failures += 1
+                continue
+            latencies.append(latency)
+            if ttft is not None:
+                ttfts.append(ttft)
+    return summarize(latencies, time.perf_counter() - started, ttfts or None, failures)
+
+def micro(fn: Callable[[], Any], min_seconds: float = 0.2) -> Dict[str, Any]:
+    """Time a fast function by repeating it for at least min_seconds."""
+    fn()
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return {"calls": calls, "seconds_per_call": elapsed / calls}
+
+def bench_model_calls(agent, args) -> Dict[str, Any]:
+    """call_ollama_stream (TTFT) and call_ollama over the REST API."""
+    results: Dict[str, Any] = {}
+    for concurrency in args.concurrency:
+        def streamed(i: int, concurrency: int = concurrency) -> Optional[float]:
+            started = time.perf_counter()
+            ttft = None
+            for chunk, error in agent.call_ollama_stream(f"stream {concurrency} {i}", use_cache=False):
+                if error:
+                    raise RuntimeError(error)
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+            return ttft
+
+        def blocking(i: int, concurrency: int = concurrency) -> None:
+            _, error = agent.call_ollama(f"call {concurrency} {i}", use_cache=False)
+            if error:
+                raise RuntimeError(error)
+
+        results[f"call_ollama_stream/c{concurrency}"] = concurrent_calls(streamed, args.requests, concurrency)
+        results[f"call_ollama/c{concurrency}"] = concurrent_calls(blocking, args.requests, concurrency)
+    return results
+
+def bench_cli_calls(args) -> Dict[str, Any]:
+    """call_ollama through the CLI backend, one fake `ollama run` process per request."""
+    from agent import CodingAgent
+    agent = CodingAgent(backend="cli", use_cache=False, warmup=False)
+    results: Dict[str, Any] = {}
+    try:
+        for concurrency in (1, max(args.concurrency)):
+            def streamed(i: int, concurrency: int = concurrency) -> Optional[float]:
+                started = time.perf_counter()
+                ttft = None
+                for chunk, error in agent.call_ollama_stream(f"cli {concurrency} {i}", use_cache=False):
+                    if error:
+                        raise RuntimeError(error)
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                return ttft
+            results[f"call_ollama_cli/c{concurrency}"] = concurrent_calls(streamed, args.cli_requests, concurrency)
+    finally:
+        agent.close()
+    return results
+
+def bench_generate(agent, args) -> Dict[str, Any]:
+    """generate_code end to end: prompt assembly, model call and validation."""
+    results: Dict[str, Any] = {}
+    for concurrency in args.concurrency:
+        def generate(i: int, concurrency: int = concurrency) -> None:
+            code, status = agent.generate_code(f"write helper number {i} for run {concurrency}", use_cache=False)
+            if not code:
+                raise RuntimeError(status)
+        results[f"generate_code/c{concurrency}"] = concurrent_calls(generate, args.requests, concurrency)
+    return results
+
+def bench_extract(args) -> Dict[str, Any]:
+    """generate_code_stream against chatty answers: tokens generated versus the full answers."""
+    from agent import CodingAgent
+    from fake_ollama import FakeModel, start_server
+    model = FakeModel(args.token_rate, args.latency, args.tokens, chatter=True)
+    server = start_server(model)
+    agent = CodingAgent(backend="http", host=f"http://127.0.0.1:{server.server_port}", use_cache=False,
+                        warmup=False, pool_size=1)
+    
+    def generate(i: int) -> None:
+        status = ""
+        for _, status in agent.generate_code_stream(f"write chatty helper number {i}", use_cache=False):
+            pass
+        if not status.startswith("✅"):
+            raise RuntimeError(status)
+    try:
+        result = concurrent_calls(generate, args.requests, 1)
+    finally:
+        agent.close()
+        server.shutdown()
+    result.update({
+        "tokens_planned": model.tokens_planned,
+        "tokens_generated": model.tokens_sent,
+        "tokens_saved_share": 1 - model.tokens_sent / model.tokens_planned if model.tokens_planned else None,
+    })
+    return {"extract/chatter": result}
+
+def bench_batch(agent, args) -> Dict[str, Any]:
+    """main.run_batch over a JSONL file of jobs."""
+    import main
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = os.path.join(tmp, "jobs.jsonl")
+        with open(jobs, "w", encoding="utf-8") as f:
+            for i in range(args.requests):
+                f.write(json.dumps({"instruction": f"batch job {i}", "filename": f"job_{i}.py"}) + "\n")
+        workers = max(args.concurrency)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            code = main.run_batch(agent, jobs, tmp, workers)
+        wall = time.perf_counter() - started
+        results[f"batch/w{workers}"] = {
+            "jobs": args.requests,
+            "succeeded": code == 0,
+            "wall_seconds": wall,
+            "throughput_per_second": args.requests / wall,
+        }
+    return results
+
+def bench_local(args) -> Dict[str, Any]:
+    """
+    replace_known_datasets and clean_code at growing input sizes.
+
+    Dataset replacement runs with the built-in aliases and with a registry of
+    --aliases synthetic ones; ns_per_byte stays flat when the cost is linear
+    in the input and independent of the number of aliases.
+    """
+    from dataset_utils import DatasetRegistry, KNOWN_DATASETS, replace_known_datasets
+    from file_ops import clean_code
+    results: Dict[str, Any] = {}
+    large = DatasetRegistry(KNOWN_DATASETS)
+    large.update({f"dataset_{i}": f"org_{i % 97}/dataset-{i}" for i in range(args.aliases)})
+    lines = [
+        "df = load_dataset('iris')  # plus some ordinary code around it\n",
+        'train = load_dataset("dataset_42", split="train", streaming=True)\n',
+        "other = load_dataset('not-an-alias')\n",
+    ]
+    filler = "value = compute(value) + 1\n"
+    for size in args.sizes:
+        text = ""
+        i = 0
+        while len(text) < size:
+            text += lines[i % len(lines)] + filler * 8
+            i += 1
+        results[f"replace_known_datasets/{size}"] = micro(lambda: replace_known_datasets(text))
+        results[f"replace_known_datasets_{args.aliases}_aliases/{size}"] = micro(
+            lambda: replace_known_datasets(text, large))
+        fenced = f"```python\n{text}```"
+        results[f"clean_code/{size}"] = micro(lambda: clean_code(fenced))
+    for key, value in results.items():
+        size = int(key.split("/")[1])
+        value["mb_per_second"] = size / value["seconds_per_call"] / 1e6
+        value["ns_per_byte"] = value["seconds_per_call"] / size * 1e9
+    return results
+
+def bench_history(args) -> Dict[str, Any]:
+    """
+    GenerationHistory lookups among --history-entries synthetic instructions.
+
+    Lookups are timed for unrelated instructions (misses), rephrasings of
+    stored ones (hits) and with the history empty, to show the cost does
+    not grow with the number of entries.
+    """
+    from history import GenerationHistory
+    rng = random.Random(42)
+    syllables = "ka lo mi ne ra tu shi po de fa gu vi ze ba".split()
+    words = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(3000)})
+
+    def instruction() -> str:
+        return " ".join(rng.choice(words) for _ in range(rng.randint(3, 9)))
+
+    stored = [instruction() for _ in range(args.history_entries)]
+    misses = [instruction() for _ in range(500)]
+    rephrased = [f"write a python script to {text} please" for text in rng.sample(stored, 500)]
+    results: Dict[str, Any] = {}
+    history = GenerationHistory(None, max_entries=args.history_entries)
+    try:
+        queries = iter(misses * 1000)
+        results["history_find/empty"] = micro(lambda: history.find(next(queries), ""))
+        started = time.perf_counter()
+        history.add_many((text, "", f"print({i})") for i, text in enumerate(stored))
+        results["history_add"] = {"entries": len(stored), "seconds_per_call": (time.perf_counter() - started) / len(stored)}
+        for name, texts in (("miss", misses), ("hit", rephrased)):
+            queries = iter(texts * 1000)
+            results[f"history_find/{name}"] = micro(lambda: history.find(next(queries), ""))
+        results["history_find/hit"]["hit_rate"] = sum(history.find(text, "") is not None for text in rephrased) / len(rephrased)
+    finally:
+        history.close()
+    return results
+
+def bench_abort(agent, args) -> Dict[str, Any]:
+    """
+    Time from Ctrl+C until control is back, as at the interactive prompt.
+
+    SIGINT is sent to this process, handled by main.interrupt_handler, while
+    a generation streams and while a script runs; the time is measured until
+    the KeyboardInterrupt has unwound, which includes closing the model
+    stream or killing the script.
+    """
+    import threading
+    import telemetry
+    from file_ops import get_execution_pool
+    from main import interrupt_handler
+
+    def abort_after(delay: float, action: Callable[[], Any]) -> float:
+        timer = threading.Timer(delay, os.kill, args=(os.getpid(), signal.SIGINT))
+        timer.start()
+        try:
+            action()
+        except KeyboardInterrupt:
+            return time.perf_counter() - telemetry.interrupted_at()
+        finally:
+            timer.cancel()
+        raise RuntimeError("finished before it could be interrupted")
+
+    def generate(i: int) -> None:
+        for _ in agent.generate_code_stream(f"write a long program number {i}", use_cache=False):
+            pass
+
+    def summary(times: List[float]) -> Dict[str, Any]:
+        return {"runs": len(times), "abort_p50": percentile(times, 50), "abort_p95": percentile(times, 95),
+                "abort_max": max(times)}
+
+    results: Dict[str, Any] = {}
+    previous = signal.signal(signal.SIGINT, interrupt_handler)
+    try:
+        # Halfway through the answer
+        delay = args.latency + args.tokens / args.token_rate / 2 if args.token_rate else args.latency
+        results["abort/generate"] = summary(
+            [abort_after(delay, lambda i=i: generate(i)) for i in range(args.requests)])
+        with tempfile.TemporaryDirectory() as tmp:
+            script = os.path.join(tmp, "sleeper.py")
+            with open(script, "w", encoding="utf-8") as f:
+                f.write("import time\ntime.sleep(60)\n")
+            pool = get_execution_pool()
+            pool.start()
+            pool.ready.wait(30)
+            results["abort/execute"] = summary(
+                [abort_after(0.2, lambda: pool.run(script)) for _ in range(args.exec_runs)])
+    finally:
+        signal.signal(signal.SIGINT, previous)
+    return results
+
+def bench_execute(args) -> Dict[str, Any]:
+    """execute_file on a small script, through the warm pool and with a new interpreter per run."""
+    from exec_pool import ExecutionPool
+    from file_ops import execute_file
+    import file_ops
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        script = os.path.join(tmp, "hello.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write("import json\nprint(json.dumps({'ok': True}))\n")
+        pool = file_ops.get_execution_pool()
+        pool.start()
+        pool.ready.wait(30)
+
+        def pooled(i: int) -> None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if not execute_file(script, stream=False):
+                    raise RuntimeError("script failed")
+
+        fresh_pool = ExecutionPool(enabled=False)
+
+        def fresh(i: int) -> None:
+            if not fresh_pool.run(script).ok:
+                raise RuntimeError("script failed")
+
+        results["execute_file/pooled"] = concurrent_calls(pooled, args.exec_runs, 1)
+        results["execute_file/fresh_interpreter"] = concurrent_calls(fresh, args.exec_runs, 1)
+    return results
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> None:
+    """Print the change of each shared metric between two result files."""
+    print(f"{'benchmark':45} {'metric':18} {'before':>10} {'after':>10} {'change':>8}", file=sys.stderr)
+    for name, metrics in current["results"].items():
+        old = previous.get("results", {}).get(name)
+        if not old:
+            continue
+        for metric in COMPARED_METRICS:
+            after, before = metrics.get(metric), old.get(metric)
+            if not after or not before:
+                continue
+            change = (after - before) / before
+            print(f"{name:45} {metric:18} {before:10.4g} {after:10.4g} {change:+8.1%}", file=sys.stderr)
+
+def start_fake_server(args) -> tuple:
+    """Start fake_ollama.py serve in its own process so it does not share our GIL."""
+    command = [sys.executable, FAKE_OLLAMA, "serve", "--port", "0", "--token-rate", str(args.token_rate),
+               "--latency", str(args.latency), "--tokens", str(args.tokens),
+               "--failure-rate", str(args.failure_rate), "--failure-mode", args.failure_mode]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("fake Ollama server did not start")
+    return process, url
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the agent against a fake Ollama.")
+    parser.add_argument("--requests", type=int, default=20, help="requests per benchmark run (default: 20)")
+    parser.add_argument("--cli-requests", type=int, default=5, help="requests per CLI backend run (default: 5)")
+    parser.add_argument("--exec-runs", type=int, default=10, help="script runs per execute_file mode (default: 10)")
+    parser.add_argument("--concurrency", default="1,4", help="comma-separated concurrency levels (default: 1,4)")
+    parser.add_argument("--aliases", type=int, default=5000,
+                        help="synthetic dataset aliases for the large-registry run (default: 5000)")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="input sizes in characters for the local benchmarks (default: 1000,10000,100000)")
+    parser.add_argument("--history-entries", type=int, default=100000,
+                        help="instructions stored for the history lookups (default: 100000)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="fake model tokens per second (default: 200)")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model seconds to first token (default: 0.05)")
+    parser.add_argument("--tokens", type=int, default=120, help="fake answer length in tokens (default: 120)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of failing fake requests (default: 0)")
+    parser.add_argument("--failure-mode", choices=("error", "drop"), default="error")
+    parser.add_argument("--only", help="comma-separated groups to run: "
+                        "model,cli,generate,extract,batch,local,history,abort,execute")
+    parser.add_argument("--out", metavar="FILE", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", metavar="FILE", help="print changes against an earlier results file")
+    args = parser.parse_args(argv)
+    # The benchmarks run in a temporary directory; resolve file arguments first
+    args.out = os.path.abspath(args.out) if args.out else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    groups = set(args.only.split(",")) if args.only else {
+        "model", "cli", "generate", "extract", "batch", "local", "history", "abort", "execute"}
+    server, url = start_fake_server(args)
+
+    # Configuration is read at import time, so set it before importing the agent
+    os.environ.update({
+        "OLLAMA_HOST": url,
+        "OLLAMA_HOSTS": url,
+        "OLLAMA_BIN": FAKE_OLLAMA,
+        "OLLAMA_CACHE": "0",
+        "OLLAMA_HISTORY": "off",
+        "OLLAMA_WARMUP": "0",
+        "OLLAMA_POOL_SIZE": str(max(args.concurrency)),
+        "FAKE_OLLAMA_TOKEN_RATE": str(args.token_rate),
+        "FAKE_OLLAMA_LATENCY": str(args.latency),
+        "FAKE_OLLAMA_TOKENS": str(args.tokens),
+        "FAKE_OLLAMA_FAILURE_RATE": str(args.failure_rate),
+        "FAKE_OLLAMA_FAILURE_MODE": args.failure_mode,
+    })
+    sys.path.insert(0, REPO_DIR)
+    from agent import CodingAgent
+
+    results: Dict[str, Any] = {}
+    agent = CodingAgent(backend="http", use_cache=False, warmup=False, pool_size=max(args.concurrency))
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # Keep the symbol index and saved files out of the repository
+            os.chdir(workdir)
+            if "model" in groups:
+                results.update(bench_model_calls(agent, args))
+            if "cli" in groups:
+                results.update(bench_cli_calls(args))
+            if "generate" in groups:
+                results.update(bench_generate(agent, args))
+            if "extract" in groups:
+                results.update(bench_extract(args))
+            if "batch" in groups:
+                results.update(bench_batch(agent, args))
+            if "local" in groups:
+                results.update(bench_local(args))
+            if "history" in groups:
+                results.update(bench_history(args))
+            if "abort" in groups:
+                results.update(bench_abort(agent, args))
+            if "execute" in groups:
+                results.update(bench_execute(args))
+            os.chdir(cwd)
+    finally:
+        agent.close()
+        server.kill()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("out", "compare", "only")},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"📊 Results written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
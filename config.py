@@ -1,17 +1,308 @@
 import os
-from typing import Optional
+from typing import List, Optional
 
 # Default configuration values
 DEFAULT_MODEL_NAME = "mistral:latest"
 DEFAULT_TIMEOUT_SECONDS = 300
+DEFAULT_OLLAMA_HOST = "http://127.0.0.1:11434"
+DEFAULT_OLLAMA_BACKEND = "auto"
+DEFAULT_HTTP_POOL_SIZE = 4
+DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS = 15
+DEFAULT_CACHE_PATH = ".response_cache.sqlite"
+DEFAULT_SYMBOL_INDEX_PATH = ".symbol_index.sqlite"
+DEFAULT_CONTEXT_TOKEN_BUDGET = 2000
+DEFAULT_CONTEXT_MAX_FILES = 20
+DEFAULT_CONTEXT_MAX_FILE_BYTES = 1024 * 1024
+DEFAULT_CONTEXT_CACHE_ENTRIES = 128
+DEFAULT_CONTEXT_READ_WORKERS = 8
+DEFAULT_CACHE_MEMORY_ENTRIES = 256
+DEFAULT_CACHE_DISK_ENTRIES = 5000
+DEFAULT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_KEEP_ALIVE = "30m"
+DEFAULT_SESSION_MAX_TURNS = 8
+DEFAULT_EDIT_MODE = "auto"
+DEFAULT_EDIT_MIN_LINES = 40
+DEFAULT_SESSION_MAX_CONTEXT_TOKENS = 3072
+DEFAULT_PING_INTERVAL_SECONDS = 0
+DEFAULT_ASYNC_MAX_CONCURRENCY = 4
+DEFAULT_UI_GENERATE_CONCURRENCY = 2
+DEFAULT_UI_RUN_CONCURRENCY = 2
+DEFAULT_UI_QUEUE_SIZE = 16
+DEFAULT_EXEC_PRELOAD = "numpy,pandas,matplotlib,sklearn"
+DEFAULT_EXEC_TIMEOUT_SECONDS = 300
+DEFAULT_EXEC_CPU_SECONDS = 0
+DEFAULT_EXEC_MEMORY_MB = 0
+DEFAULT_EXEC_MAX_OPEN_FILES = 1024
+DEFAULT_EXEC_OUTPUT_HEAD_LINES = 200
+DEFAULT_EXEC_OUTPUT_TAIL_LINES = 800
+DEFAULT_VALIDATE_MAX_ROUNDS = 2
+DEFAULT_SPECULATIVE_CANDIDATES = 1
+DEFAULT_SPECULATIVE_TEMPERATURES = "0.4,0.8,1.0"
+DEFAULT_VALIDATE_WORKERS = 2
+DEFAULT_TRACE_LOG_PATH = ""
+DEFAULT_TRACE_LOG_MAX_MB = 50
+DEFAULT_UI_METRICS_PORT = 7861
+DEFAULT_DAEMON_SOCKET_PATH = ".agent_daemon.sock"
+DEFAULT_DAEMON_IDLE_SECONDS = 3600
+DEFAULT_DAEMON_START_TIMEOUT_SECONDS = 30
+DEFAULT_NUM_PREDICT = 0
+DEFAULT_HISTORY_MODE = "offer"
+DEFAULT_HISTORY_PATH = ".generation_history.sqlite"
+DEFAULT_HISTORY_THRESHOLD = 0.8
+DEFAULT_HISTORY_MAX_ENTRIES = 100000
 
 # Configuration with environment variable support
 MODEL_NAME: str = os.getenv("OLLAMA_MODEL", DEFAULT_MODEL_NAME)
 TIMEOUT_SECONDS: int = int(os.getenv("OLLAMA_TIMEOUT", str(DEFAULT_TIMEOUT_SECONDS)))
 
+# Ollama REST API settings.
+# OLLAMA_BACKEND selects how the model is called:
+#   "http" - REST API only
+#   "cli"  - spawn `ollama run` for every request (legacy behaviour)
+#   "auto" - REST API, falling back to the CLI when no server is reachable
+OLLAMA_HOST: str = os.getenv("OLLAMA_HOST", DEFAULT_OLLAMA_HOST)
+OLLAMA_BACKEND: str = os.getenv("OLLAMA_BACKEND", DEFAULT_OLLAMA_BACKEND).strip().lower()
+HTTP_POOL_SIZE: int = int(os.getenv("OLLAMA_POOL_SIZE", str(DEFAULT_HTTP_POOL_SIZE)))
+# Path of the `ollama` executable for the CLI backend (default: looked up on PATH)
+OLLAMA_BIN: Optional[str] = os.getenv("OLLAMA_BIN") or None
+# Comma-separated list of Ollama servers to balance across (defaults to OLLAMA_HOST).
+# Each request goes to the healthy server with the fewest outstanding requests.
+OLLAMA_HOSTS: List[str] = [h.strip() for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()] or [OLLAMA_HOST]
+HEALTH_CHECK_INTERVAL_SECONDS: int = int(os.getenv("OLLAMA_HEALTH_INTERVAL", str(DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS)))
+# Maximum number of requests AsyncCodingAgent runs at once, each on a worker thread
+ASYNC_MAX_CONCURRENCY: int = int(os.getenv("OLLAMA_MAX_CONCURRENCY", str(DEFAULT_ASYNC_MAX_CONCURRENCY)))
+
+# Response cache settings (set OLLAMA_CACHE=0 to disable, OLLAMA_CACHE_PATH="" for memory only)
+CACHE_ENABLED: bool = os.getenv("OLLAMA_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+CACHE_PATH: Optional[str] = os.getenv("OLLAMA_CACHE_PATH", DEFAULT_CACHE_PATH) or None
+CACHE_MEMORY_ENTRIES: int = int(os.getenv("OLLAMA_CACHE_MEMORY_ENTRIES", str(DEFAULT_CACHE_MEMORY_ENTRIES)))
+CACHE_DISK_ENTRIES: int = int(os.getenv("OLLAMA_CACHE_DISK_ENTRIES", str(DEFAULT_CACHE_DISK_ENTRIES)))
+CACHE_TTL_SECONDS: int = int(os.getenv("OLLAMA_CACHE_TTL", str(DEFAULT_CACHE_TTL_SECONDS)))
+
+# Context files: how many files one request may include (after glob expansion), the
+# largest file accepted, how many decoded files are kept in memory, and read threads
+CONTEXT_MAX_FILES: int = int(os.getenv("OLLAMA_CONTEXT_MAX_FILES", str(DEFAULT_CONTEXT_MAX_FILES)))
+CONTEXT_MAX_FILE_BYTES: int = int(os.getenv("OLLAMA_CONTEXT_MAX_FILE_BYTES", str(DEFAULT_CONTEXT_MAX_FILE_BYTES)))
+CONTEXT_CACHE_ENTRIES: int = int(os.getenv("OLLAMA_CONTEXT_CACHE_ENTRIES", str(DEFAULT_CONTEXT_CACHE_ENTRIES)))
+CONTEXT_READ_WORKERS: int = int(os.getenv("OLLAMA_CONTEXT_READ_WORKERS", str(DEFAULT_CONTEXT_READ_WORKERS)))
+
+# Context selection: a context file estimated above OLLAMA_CONTEXT_TOKENS tokens is not pasted
+# whole; the definitions relevant to the instruction are picked from an AST index of the
+# working directory (OLLAMA_SYMBOL_INDEX=0 disables this and always pastes the whole file)
+SYMBOL_INDEX_ENABLED: bool = os.getenv("OLLAMA_SYMBOL_INDEX", "1").strip().lower() not in ("0", "false", "no", "off")
+SYMBOL_INDEX_PATH: Optional[str] = os.getenv("OLLAMA_SYMBOL_INDEX_PATH", DEFAULT_SYMBOL_INDEX_PATH) or None
+CONTEXT_TOKEN_BUDGET: int = int(os.getenv("OLLAMA_CONTEXT_TOKENS", str(DEFAULT_CONTEXT_TOKEN_BUDGET)))
+
+# Edit mode: with a single context file, ask the model for SEARCH/REPLACE edits instead of the
+# whole updated file, falling back to full regeneration if they do not apply.
+#   "on"   - always, "off" - never,
+#   "auto" - only for Python files of at least OLLAMA_EDIT_MIN_LINES lines
+EDIT_MODE: str = os.getenv("OLLAMA_EDIT_MODE", DEFAULT_EDIT_MODE).strip().lower()
+EDIT_MIN_LINES: int = int(os.getenv("OLLAMA_EDIT_MIN_LINES", str(DEFAULT_EDIT_MIN_LINES)))
+
+# Conversation sessions: turns kept verbatim, and the size of Ollama's returned context
+# (in tokens) after which it is dropped and the conversation restarts from a summary.
+# Keep OLLAMA_SESSION_MAX_TOKENS below the model's context window (num_ctx).
+SESSION_MAX_TURNS: int = int(os.getenv("OLLAMA_SESSION_TURNS", str(DEFAULT_SESSION_MAX_TURNS)))
+SESSION_MAX_CONTEXT_TOKENS: int = int(os.getenv("OLLAMA_SESSION_MAX_TOKENS", str(DEFAULT_SESSION_MAX_CONTEXT_TOKENS)))
+
+# Model residency: preload the model at startup on a background thread, ask Ollama to keep
+# it loaded for OLLAMA_KEEP_ALIVE ("30m", "1h", seconds, or -1 for forever; "" uses the
+# server default) and, if OLLAMA_PING_INTERVAL > 0, ping it whenever the agent sat idle that long.
+WARMUP_ENABLED: bool = os.getenv("OLLAMA_WARMUP", "1").strip().lower() not in ("0", "false", "no", "off")
+KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", DEFAULT_KEEP_ALIVE).strip()
+PING_INTERVAL_SECONDS: int = int(os.getenv("OLLAMA_PING_INTERVAL", str(DEFAULT_PING_INTERVAL_SECONDS)))
+
+def keep_alive_value(value: str = KEEP_ALIVE) -> Optional[object]:
+    """Return KEEP_ALIVE in the form the Ollama API expects, or None to omit it."""
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+# Validation: generated code is checked for syntax errors, undefined names and missing
+# imports before it is shown as final. Syntax errors and undefined names are sent back to
+# the model for up to OLLAMA_REPAIR_ROUNDS repair attempts (OLLAMA_VALIDATE=0 disables this)
+VALIDATE_ENABLED: bool = os.getenv("OLLAMA_VALIDATE", "1").strip().lower() not in ("0", "false", "no", "off")
+VALIDATE_MAX_ROUNDS: int = int(os.getenv("OLLAMA_REPAIR_ROUNDS", str(DEFAULT_VALIDATE_MAX_ROUNDS)))
+VALIDATE_WORKERS: int = int(os.getenv("OLLAMA_VALIDATE_WORKERS", str(DEFAULT_VALIDATE_WORKERS)))
+
+# Code extraction: answers are cut down to their code block as they stream, dropping a fence and
+# any explanation before or after it, and the request is aborted as soon as the block closes
+# (OLLAMA_EXTRACT=0 keeps whole answers). Code requests can also pass the server stop sequences,
+# OLLAMA_STOP (a JSON list, or one string where \n stands for a newline), and an output cap in
+# tokens, OLLAMA_NUM_PREDICT (0 = model default). Edit-mode requests get neither.
+EXTRACT_ENABLED: bool = os.getenv("OLLAMA_EXTRACT", "1").strip().lower() not in ("0", "false", "no", "off")
+NUM_PREDICT: int = int(os.getenv("OLLAMA_NUM_PREDICT", str(DEFAULT_NUM_PREDICT)))
+
+def stop_sequences(value: str) -> List[str]:
+    """Parse OLLAMA_STOP into the list of stop sequences for the Ollama `stop` option."""
+    if not value:
+        return []
+    if value.lstrip().startswith("["):
+        import json
+        sequences = json.loads(value)
+        if not isinstance(sequences, list) or not all(isinstance(s, str) and s for s in sequences):
+            raise ValueError("OLLAMA_STOP must be a JSON list of non-empty strings")
+        return sequences
+    return [value.replace("\\n", "\n").replace("\\t", "\t")]
+
+STOP_SEQUENCES: List[str] = stop_sequences(os.getenv("OLLAMA_STOP", ""))
+
+# Speculative generation: with OLLAMA_CANDIDATES > 1 that many answers are generated at once,
+# the first one to pass the checks is used and the rest are cancelled. The first candidate uses
+# the model's defaults; the others get their own seed and a temperature from
+# OLLAMA_CANDIDATE_TEMPERATURES (comma-separated, used in turn). Needs the REST API.
+SPECULATIVE_CANDIDATES: int = int(os.getenv("OLLAMA_CANDIDATES", str(DEFAULT_SPECULATIVE_CANDIDATES)))
+SPECULATIVE_TEMPERATURES: List[float] = [
+    float(t) for t in os.getenv("OLLAMA_CANDIDATE_TEMPERATURES", DEFAULT_SPECULATIVE_TEMPERATURES).split(",") if t.strip()
+]
+
+# Running generated scripts: a warm fork server imports OLLAMA_EXEC_PRELOAD (comma-separated
+# modules) once and forks a fresh worker per run (OLLAMA_EXEC_POOL=0 spawns a new interpreter
+# every time instead). Limits per run: wall-clock timeout, CPU seconds, address space in MiB
+# and open files; 0 leaves a limit unset.
+EXEC_POOL_ENABLED: bool = os.getenv("OLLAMA_EXEC_POOL", "1").strip().lower() not in ("0", "false", "no", "off")
+EXEC_PRELOAD_MODULES: List[str] = [m.strip() for m in os.getenv("OLLAMA_EXEC_PRELOAD", DEFAULT_EXEC_PRELOAD).split(",") if m.strip()]
+EXEC_TIMEOUT_SECONDS: int = int(os.getenv("OLLAMA_EXEC_TIMEOUT", str(DEFAULT_EXEC_TIMEOUT_SECONDS)))
+EXEC_CPU_SECONDS: int = int(os.getenv("OLLAMA_EXEC_CPU_SECONDS", str(DEFAULT_EXEC_CPU_SECONDS)))
+EXEC_MEMORY_MB: int = int(os.getenv("OLLAMA_EXEC_MEMORY_MB", str(DEFAULT_EXEC_MEMORY_MB)))
+EXEC_MAX_OPEN_FILES: int = int(os.getenv("OLLAMA_EXEC_MAX_FILES", str(DEFAULT_EXEC_MAX_OPEN_FILES)))
+# Script output is streamed as it is written; only the first and last lines of each stream
+# are kept in memory, and OLLAMA_EXEC_SPOOL=1 writes the complete output to a temporary file
+EXEC_OUTPUT_HEAD_LINES: int = int(os.getenv("OLLAMA_EXEC_HEAD_LINES", str(DEFAULT_EXEC_OUTPUT_HEAD_LINES)))
+EXEC_OUTPUT_TAIL_LINES: int = int(os.getenv("OLLAMA_EXEC_TAIL_LINES", str(DEFAULT_EXEC_OUTPUT_TAIL_LINES)))
+EXEC_SPOOL_OUTPUT: bool = os.getenv("OLLAMA_EXEC_SPOOL", "0").strip().lower() in ("1", "true", "yes", "on")
+
+# Web UI limits: simultaneous generations, simultaneous script runs, and how many
+# requests of each kind may wait in line before new ones are rejected
+UI_GENERATE_CONCURRENCY: int = int(os.getenv("UI_GENERATE_CONCURRENCY", str(DEFAULT_UI_GENERATE_CONCURRENCY)))
+UI_RUN_CONCURRENCY: int = int(os.getenv("UI_RUN_CONCURRENCY", str(DEFAULT_UI_RUN_CONCURRENCY)))
+UI_QUEUE_SIZE: int = int(os.getenv("UI_QUEUE_SIZE", str(DEFAULT_UI_QUEUE_SIZE)))
+
+# Generation history: every generated result is stored with an index over the instruction's
+# words, so a rephrased request for the same context can reuse it. OLLAMA_HISTORY selects what
+# happens when an earlier instruction is at least OLLAMA_HISTORY_THRESHOLD similar (0-1):
+#   "offer" - the interactive CLI asks whether to reuse it, the web UI shows a reuse button;
+#             one-shot, daemon and batch runs just generate
+#   "serve" - the stored result is returned right away, like a cache hit
+#   "off"   - no history is kept
+# OLLAMA_HISTORY_PATH="" keeps it in memory only. Bypassing the cache also bypasses the history.
+HISTORY_MODE: str = os.getenv("OLLAMA_HISTORY", DEFAULT_HISTORY_MODE).strip().lower()
+HISTORY_PATH: Optional[str] = os.getenv("OLLAMA_HISTORY_PATH", DEFAULT_HISTORY_PATH) or None
+HISTORY_THRESHOLD: float = float(os.getenv("OLLAMA_HISTORY_THRESHOLD", str(DEFAULT_HISTORY_THRESHOLD)))
+HISTORY_MAX_ENTRIES: int = int(os.getenv("OLLAMA_HISTORY_MAX_ENTRIES", str(DEFAULT_HISTORY_MAX_ENTRIES)))
+
+# Extra dataset aliases for load_dataset calls: a JSON object or `alias full/path` lines
+DATASET_ALIASES_PATH: str = os.getenv("OLLAMA_DATASET_ALIASES", "")
+
+# Request tracing: per-request timing spans are appended to OLLAMA_TRACE_LOG as JSON lines,
+# if set (off by default, so no run leaves a file behind); the file is rotated to <path>.1 when it grows past the size limit.
+# The web UI serves the aggregated metrics in Prometheus text format on UI_METRICS_PORT (0 disables).
+TRACE_LOG_PATH: str = os.getenv("OLLAMA_TRACE_LOG", DEFAULT_TRACE_LOG_PATH)
+TRACE_LOG_MAX_MB: int = int(os.getenv("OLLAMA_TRACE_LOG_MAX_MB", str(DEFAULT_TRACE_LOG_MAX_MB)))
+UI_METRICS_PORT: int = int(os.getenv("UI_METRICS_PORT", str(DEFAULT_UI_METRICS_PORT)))
+
+# Agent daemon behind `main.py "instruction"`: one per working directory, listening on a Unix
+# socket at this path (where Unix sockets are unavailable, a file naming a localhost TCP port).
+# An auto-started daemon exits after OLLAMA_DAEMON_IDLE seconds without requests (0 = never).
+DAEMON_SOCKET_PATH: str = os.getenv("OLLAMA_DAEMON_SOCKET", DEFAULT_DAEMON_SOCKET_PATH)
+DAEMON_IDLE_SECONDS: int = int(os.getenv("OLLAMA_DAEMON_IDLE", str(DEFAULT_DAEMON_IDLE_SECONDS)))
+# Seconds a client waits for a daemon it started to accept connections
+DAEMON_START_TIMEOUT_SECONDS: int = int(os.getenv("OLLAMA_DAEMON_START_TIMEOUT", str(DEFAULT_DAEMON_START_TIMEOUT_SECONDS)))
+
 # Validation
 if TIMEOUT_SECONDS <= 0:
     raise ValueError("TIMEOUT_SECONDS must be a positive integer")
 
 if not MODEL_NAME or not MODEL_NAME.strip():
     raise ValueError("MODEL_NAME cannot be empty")
+
+if OLLAMA_BACKEND not in ("auto", "http", "cli"):
+    raise ValueError("OLLAMA_BACKEND must be one of: auto, http, cli")
+
+if HTTP_POOL_SIZE <= 0:
+    raise ValueError("HTTP_POOL_SIZE must be a positive integer")
+
+if ASYNC_MAX_CONCURRENCY <= 0:
+    raise ValueError("ASYNC_MAX_CONCURRENCY must be a positive integer")
+
+if CACHE_MEMORY_ENTRIES <= 0 or CACHE_DISK_ENTRIES <= 0:
+    raise ValueError("Cache sizes must be positive integers")
+
+if CACHE_TTL_SECONDS < 0:
+    raise ValueError("CACHE_TTL_SECONDS cannot be negative")
+
+if min(CONTEXT_MAX_FILES, CONTEXT_MAX_FILE_BYTES, CONTEXT_CACHE_ENTRIES, CONTEXT_READ_WORKERS) <= 0:
+    raise ValueError("Context file limits must be positive integers")
+
+if CONTEXT_TOKEN_BUDGET <= 0:
+    raise ValueError("CONTEXT_TOKEN_BUDGET must be a positive integer")
+
+if EDIT_MODE not in ("auto", "on", "off"):
+    raise ValueError("EDIT_MODE must be one of: auto, on, off")
+
+if SESSION_MAX_TURNS <= 0 or SESSION_MAX_CONTEXT_TOKENS <= 0:
+    raise ValueError("Session limits must be positive integers")
+
+if PING_INTERVAL_SECONDS < 0:
+    raise ValueError("PING_INTERVAL_SECONDS cannot be negative")
+
+if UI_GENERATE_CONCURRENCY <= 0 or UI_RUN_CONCURRENCY <= 0:
+    raise ValueError("UI concurrency limits must be positive integers")
+
+if UI_QUEUE_SIZE < 0:
+    raise ValueError("UI_QUEUE_SIZE cannot be negative")
+
+if HEALTH_CHECK_INTERVAL_SECONDS < 0:
+    raise ValueError("HEALTH_CHECK_INTERVAL_SECONDS cannot be negative")
+
+if VALIDATE_MAX_ROUNDS < 0:
+    raise ValueError("VALIDATE_MAX_ROUNDS cannot be negative")
+
+if VALIDATE_WORKERS <= 0:
+    raise ValueError("VALIDATE_WORKERS must be a positive integer")
+
+if HISTORY_MODE not in ("offer", "serve", "off"):
+    raise ValueError("HISTORY_MODE must be one of: offer, serve, off")
+
+if not 0 < HISTORY_THRESHOLD <= 1:
+    raise ValueError("HISTORY_THRESHOLD must be greater than 0 and at most 1")
+
+if HISTORY_MAX_ENTRIES <= 0:
+    raise ValueError("HISTORY_MAX_ENTRIES must be a positive integer")
+
+if NUM_PREDICT < 0:
+    raise ValueError("NUM_PREDICT cannot be negative")
+
+if SPECULATIVE_CANDIDATES <= 0:
+    raise ValueError("SPECULATIVE_CANDIDATES must be a positive integer")
+
+if not SPECULATIVE_TEMPERATURES or min(SPECULATIVE_TEMPERATURES) < 0:
+    raise ValueError("SPECULATIVE_TEMPERATURES must list non-negative numbers")
+
+if EXEC_TIMEOUT_SECONDS <= 0:
+    raise ValueError("EXEC_TIMEOUT_SECONDS must be a positive integer")
+
+if min(EXEC_CPU_SECONDS, EXEC_MEMORY_MB, EXEC_MAX_OPEN_FILES) < 0:
+    raise ValueError("Execution limits cannot be negative")
+
+if EXEC_OUTPUT_HEAD_LINES < 0 or EXEC_OUTPUT_TAIL_LINES < 0:
+    raise ValueError("Execution output line limits cannot be negative")
+
+if TRACE_LOG_MAX_MB <= 0:
+    raise ValueError("TRACE_LOG_MAX_MB must be a positive integer")
+
+if not 0 <= UI_METRICS_PORT <= 65535:
+    raise ValueError("UI_METRICS_PORT must be between 0 and 65535")
+
+if not DAEMON_SOCKET_PATH.strip():
+    raise ValueError("DAEMON_SOCKET_PATH cannot be empty")
+
+if DAEMON_IDLE_SECONDS < 0:
+    raise ValueError("DAEMON_IDLE_SECONDS cannot be negative")
+
+if DAEMON_START_TIMEOUT_SECONDS <= 0:
+    raise ValueError("DAEMON_START_TIMEOUT_SECONDS must be a positive integer")
@@ -0,0 +1,444 @@
+"""
+Long-running agent daemon and the thin client behind `main.py "instruction"`.
+
+The daemon hosts one CodingAgent, so its response cache, file caches, sessions
+and warm model connections outlive each invocation. It serves the working
+directory it was started in, on a Unix socket there (DAEMON_SOCKET_PATH).
+Messages are JSON lines: the client sends one request and receives the text the
+request prints, as it is printed, followed by a "done" message.
+
+The client half needs only the standard library and config, so a client
+invocation never imports the agent.
+"""
+import contextvars
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, TextIO, Tuple
+
+from config import DAEMON_SOCKET_PATH, DAEMON_IDLE_SECONDS, DAEMON_START_TIMEOUT_SECONDS
+
+# Bumped whenever the messages change, so clients never talk to a daemon running older code
+PROTOCOL_VERSION = 1
+# Named conversations kept by the daemon (--session); the least recently used is dropped beyond this
+MAX_SESSIONS = 32
+
+class DaemonError(Exception):
+    """The agent daemon could not be reached or started."""
+
+def _unix_sockets() -> bool:
+    """Unix sockets are used where available; otherwise a localhost TCP port."""
+    return hasattr(socket, "AF_UNIX")
+
+def _connect(path: str, timeout: Optional[float] = None) -> Tuple[socket.socket, Optional[str]]:
+    """
+    Connect to the daemon listening at `path`.
+
+    Returns:
+        tuple: (socket, token); the token authenticates TCP clients and is None for Unix sockets
+
+    Raises:
+        OSError: If no daemon is listening
+    """
+    token = None
+    if _unix_sockets():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address: Any = path
+    else:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            address, token = ("127.0.0.1", int(info["port"])), str(info["token"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ConnectionRefusedError(f"unreadable daemon address file {path}: {e}")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except BaseException:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return sock, token
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+# Where text printed by the current request goes: a function taking (stream name, text)
+_client_output: "contextvars.ContextVar[Optional[Callable[[str, str], None]]]" = contextvars.ContextVar(
+    "client_output", default=None
+)
+
+class _RoutedStream:
+    """
+    Stand-in for sys.stdout/sys.stderr in the daemon.
+
+    Text printed while a request is handled, including by threads started with
+    a copy of its context, goes to that request's client; anything else goes to
+    the daemon's own stream (its log file when auto-started).
+    """
+
+    def __init__(self, name: str, stream: TextIO):
+        self._name = name
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        send = _client_output.get()
+        if send is None:
+            return self._stream.write(text)
+        send(self._name, text)
+        return len(text)
+
+    def flush(self) -> None:
+        if _client_output.get() is None:
+            self._stream.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+class _Client:
+    """One connected client; sends are serialized and stop quietly once it disconnects."""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._lock = threading.Lock()
+        self.connected = True
+
+    def send(self, message: Dict[str, Any]) -> None:
+        data = _encode(message)
+        with self._lock:
+            if not self.connected:
+                return
+            try:
+                self._sock.sendall(data)
+            except OSError:
+                # The client went away (e.g. Ctrl+C); the request still completes and is cached
+                self.connected = False
+
+    def output(self, name: str, text: str) -> None:
+        self.send({name: text})
+
+    def finish(self, ok: bool, **fields: Any) -> None:
+        self.send(dict(fields, done=True, ok=ok))
+
+class AgentDaemon:
+    """Serves instructions from clients in the working directory with one shared CodingAgent."""
+
+    def __init__(self, agent: Any, path: str = DAEMON_SOCKET_PATH, idle_seconds: float = DAEMON_IDLE_SECONDS):
+        """
+        Args:
+            agent: The CodingAgent answering every request
+            path: Socket path (or, without Unix sockets, the file naming the TCP port)
+            idle_seconds: Exit after this long without requests, 0 to run until stopped
+        """
+        self.agent = agent
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.cwd = os.getcwd()
+        self.token: Optional[str] = None
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        self._active = 0
+        self._last_request = time.monotonic()
+        self._active_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _listen(self) -> socket.socket:
+        if _unix_sockets():
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.path)
+            # Only the owner may send instructions (they can write and run files)
+            os.chmod(self.path, 0o600)
+        else:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(("127.0.0.1", 0))
+            self.token = os.urandom(16).hex()
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"port": listener.getsockname()[1], "token": self.token, "pid": os.getpid()}, f)
+        listener.listen(16)
+        return listener
+
+    def _idle(self) -> bool:
+        with self._active_lock:
+            return (self.idle_seconds > 0 and self._active == 0
+                    and time.monotonic() - self._last_request >= self.idle_seconds)
+
+    def serve_forever(self) -> None:
+        """Accept clients until stop() is called or the daemon has been idle too long."""
+        listener = self._listen()
+        # Wake up every second to notice stop() and the idle timeout
+        listener.settimeout(1.0)
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    if self._idle():
+                        print(f"💤 Idle for {self.idle_seconds}s, stopping.")
+                        break
+                    continue
+                conn.settimeout(None)
+                with self._active_lock:
+                    self._active += 1
+                    self._last_request = time.monotonic()
+                threading.Thread(target=self._serve_client, args=(conn,), name="daemon-client", daemon=True).start()
+        finally:
+            listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def stop(self) -> None:
+        """Make serve_forever() return; requests in progress are not waited for."""
+        self._stop.set()
+
+    def _serve_client(self, conn: socket.socket) -> None:
+        client = _Client(conn)
+        try:
+            with conn, conn.makefile("rb") as reader:
+                line = reader.readline()
+                if not line:
+                    return
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    client.finish(False, error="❌ Malformed request.")
+                    return
+                self._dispatch(client, request)
+        except OSError:
+            pass
+        finally:
+            with self._active_lock:
+                self._active -= 1
+                self._last_request = time.monotonic()
+
+    def _dispatch(self, client: _Client, request: Dict[str, Any]) -> None:
+        if self.token is not None and request.get("token") != self.token:
+            client.finish(False, error="❌ Invalid daemon token.")
+            return
+        if request.get("version") != PROTOCOL_VERSION:
+            client.finish(False, error="❌ The agent daemon runs a different version. Restart it with: main.py --stop-daemon")
+            return
+        command = request.get("command")
+        if command == "ping":
+            client.finish(True, pid=os.getpid(), cwd=self.cwd)
+        elif command == "stop":
+            client.finish(True, pid=os.getpid())
+            self.stop()
+        elif command == "instruction":
+            self._run_instruction(client, request)
+        else:
+            client.finish(False, error=f"❌ Unknown command: {command!r}")
+
+    def _session(self, name: Optional[str]) -> Any:
+        """The named conversation, created on first use; None for one-off instructions."""
+        if not name:
+            return None
+        with self._sessions_lock:
+            session = self._sessions.pop(name, None) or self.agent.new_session()
+            self._sessions[name] = session
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+            return session
+
+    def _run_instruction(self, client: _Client, request: Dict[str, Any]) -> None:
+        # Relative context and output paths only mean the same thing in the same directory
+        if os.path.realpath(str(request.get("cwd", ""))) != os.path.realpath(self.cwd):
+            client.finish(False, error=f"❌ This agent daemon serves {self.cwd}.")
+            return
+        token = _client_output.set(client.output)
+        try:
+            ok = self.agent.run_instruction(
+                str(request.get("instruction", "")),
+                request.get("context") or None,
+                save_as=request.get("save") or None,
+                run=bool(request.get("run")),
+                use_cache=request.get("use_cache"),
+                session=self._session(request.get("session"))
+            )
+        except Exception as e:
+            print(f"❌ Unexpected error: {e}")
+            ok = False
+        finally:
+            _client_output.reset(token)
+        client.finish(ok)
+
+def serve(path: str = DAEMON_SOCKET_PATH, idle_seconds: float = DAEMON_IDLE_SECONDS) -> int:
+    """
+    Run the agent daemon for the working directory in the foreground.
+
+    Returns:
+        Process exit code
+    """
+    running = ping(path)
+    if running is not None:
+        print(f"✅ Agent daemon already running (pid {running.get('pid')}).")
+        return 0
+    if _unix_sockets() and os.path.exists(path):
+        # Left behind by a daemon that did not shut down cleanly
+        os.unlink(path)
+
+    import signal
+    from agent import CodingAgent
+    from exec_pool import get_execution_pool
+
+    agent = CodingAgent()
+    get_execution_pool().start()
+    daemon = AgentDaemon(agent, path, idle_seconds)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _RoutedStream("out", stdout), _RoutedStream("err", stderr)
+    try:
+        print(f"🛰️ Agent daemon {os.getpid()} serving {daemon.cwd} on {path}")
+        daemon.serve_forever()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        agent.close()
+    return 0
+
+def _request(message: Dict[str, Any], path: str, timeout: Optional[float] = None,
+             start: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Send one request and yield the daemon's replies.
+
+    Args:
+        start: Start a daemon first if none is listening
+
+    Raises:
+        OSError: If no daemon is listening (and start is False)
+        DaemonError: If a daemon had to be started and did not come up
+    """
+    try:
+        sock, token = _connect(path, timeout)
+    except OSError:
+        if not start:
+            raise
+        start_daemon(path)
+        sock, token = _connect(path, timeout)
+    message = dict(message, version=PROTOCOL_VERSION)
+    if token is not None:
+        message["token"] = token
+    with sock, sock.makefile("rb") as reader:
+        sock.sendall(_encode(message))
+        for line in reader:
+            yield json.loads(line)
+
+def ping(path: str = DAEMON_SOCKET_PATH) -> Optional[Dict[str, Any]]:
+    """
+    Returns:
+        The daemon's reply (with its pid), or None if no daemon is listening
+    """
+    try:
+        for reply in _request({"command": "ping"}, path, timeout=2.0):
+            return reply
+    except (OSError, ValueError):
+        pass
+    return None
+
+def start_daemon(path: str = DAEMON_SOCKET_PATH) -> None:
+    """
+    Start a daemon for the working directory in the background and wait until it answers.
+
+    Its output goes to a log file next to the socket.
+
+    Raises:
+        DaemonError: If it exits or does not answer within DAEMON_START_TIMEOUT_SECONDS
+    """
+    import subprocess
+    main_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    log_path = os.path.splitext(path)[0] + ".log"
+    env = dict(os.environ, OLLAMA_DAEMON_SOCKET=path, PYTHONUNBUFFERED="1")
+    if os.name == "posix":
+        detach: Dict[str, Any] = {"start_new_session": True}
+    else:
+        detach = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, main_script, "--daemon"],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env,
+            **detach
+        )
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if ping(path) is not None:
+            return
+        if process.poll() is not None:
+            # Exit code 0: another client started a daemon first
+            if process.returncode == 0 and ping(path) is not None:
+                return
+            raise DaemonError(f"Agent daemon exited with code {process.returncode}, see {log_path}")
+        time.sleep(0.05)
+    raise DaemonError(f"Agent daemon did not answer within {DAEMON_START_TIMEOUT_SECONDS}s, see {log_path}")
+
+def stop_daemon(path: str = DAEMON_SOCKET_PATH) -> bool:
+    """
+    Ask the daemon to exit.
+
+    Returns:
+        True if a daemon was running
+    """
+    try:
+        for reply in _request({"command": "stop"}, path, timeout=5.0):
+            return bool(reply.get("done"))
+    except (OSError, ValueError):
+        pass
+    return False
+
+def run_instruction(instruction: str, context: Optional[str] = None, save: Optional[str] = None,
+                    run: bool = False, session: Optional[str] = None, use_cache: Optional[bool] = None,
+                    path: str = DAEMON_SOCKET_PATH) -> int:
+    """
+    Send an instruction to the daemon (starting it if needed) and print its output as it arrives.
+
+    Args:
+        instruction: What to generate or change
+        context: Context file path(s) or glob patterns, comma-separated
+        save: Where to write the result
+        run: Execute the saved file
+        session: Name of a conversation to continue across invocations
+        use_cache: False to bypass cached responses
+
+    Returns:
+        Process exit code: 0 if code was produced (and saved and ran, when asked to)
+    """
+    message = {
+        "command": "instruction",
+        "cwd": os.getcwd(),
+        "instruction": instruction,
+        "context": context,
+        "save": save,
+        "run": run,
+        "session": session,
+        "use_cache": use_cache
+    }
+    try:
+        for reply in _request(message, path, start=True):
+            if "out" in reply:
+                sys.stdout.write(reply["out"])
+                sys.stdout.flush()
+            elif "err" in reply:
+                sys.stderr.write(reply["err"])
+                sys.stderr.flush()
+            elif reply.get("done"):
+                if reply.get("error"):
+                    print(reply["error"])
+                return 0 if reply.get("ok") else 1
+    except DaemonError as e:
+        print(f"❌ {e}")
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"❌ Lost connection to the agent daemon: {e}")
+        return 1
+    print("❌ Lost connection to the agent daemon.")
+    return 1
@@ -1,5 +1,9 @@
+import json
 import re
-from typing import Dict
+import threading
+from typing import Dict, Mapping, Optional
+
+from config import DATASET_ALIASES_PATH
 
 # Mapping of short dataset names to their full HuggingFace dataset paths
 KNOWN_DATASETS: Dict[str, str] = {
@@ -11,26 +15,124 @@ KNOWN_DATASETS: Dict[str, str] = {
     "yelp": "yelp_polarity"
 }
 
-def replace_known_datasets(code: str) -> str:
+# The dataset name of a load_dataset call: the first positional argument or path=...,
+# followed by anything (split=..., streaming=...). Aliases are looked up in a dict, so
+# one pass over the text costs the same however many aliases are registered. The pattern
+# starts with a literal so the regex engine can skip ahead; the word boundary before it
+# is checked on each match instead, which keeps that fast path.
+LOAD_DATASET_PATTERN = re.compile(
+    r"""load_dataset\s*\(\s*(?:path\s*=\s*)?(?P<quote>['"])(?P<name>[^'"\\\n]+)(?P=quote)""",
+    re.IGNORECASE
+)
+
+class DatasetRegistry:
+    """
+    Short dataset names and the HuggingFace paths they stand for.
+
+    Names are matched case-insensitively. Replacement is a single pass, so
+    an alias whose target is itself an alias is not followed further.
+    """
+
+    def __init__(self, aliases: Optional[Mapping[str, str]] = None):
+        """
+        Args:
+            aliases: Short name to full dataset path
+        """
+        self._aliases: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if aliases:
+            self.update(aliases)
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._aliases
+
+    def get(self, name: str) -> Optional[str]:
+        return self._aliases.get(name.lower())
+
+    def update(self, aliases: Mapping[str, str]) -> None:
+        """Add or override aliases."""
+        with self._lock:
+            for name, full_name in aliases.items():
+                if name.strip() and full_name.strip():
+                    self._aliases[name.strip().lower()] = full_name.strip()
+
+    @staticmethod
+    def parse(text: str) -> Dict[str, str]:
+        """
+        Parse an alias file: a JSON object, or one `alias full/path` pair per line
+        (separated by whitespace, `=` or a comma; `#` starts a comment).
+
+        Raises:
+            ValueError: If a line has no target
+        """
+        if text.lstrip().startswith("{"):
+            data = json.loads(text)
+            return {str(k): str(v) for k, v in data.items()}
+        aliases: Dict[str, str] = {}
+        for line_no, line in enumerate(text.splitlines(), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = re.split(r"\s*[=,]\s*|\s+", line, maxsplit=1)
+            if len(parts) != 2 or not parts[1]:
+                raise ValueError(f"line {line_no}: expected 'alias full/path', got {line!r}")
+            aliases[parts[0]] = parts[1]
+        return aliases
+
+    def load(self, path: str) -> int:
+        """
+        Add the aliases in an alias file (see parse).
+
+        Returns:
+            Number of aliases read
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            aliases = self.parse(f.read())
+        self.update(aliases)
+        return len(aliases)
+
+    def replace(self, code: str) -> str:
+        """Rewrite the dataset name of every load_dataset call that uses a known alias."""
+        aliases = self._aliases
+
+        def substitute(match: "re.Match[str]") -> str:
+            start = match.start()
+            full_name = aliases.get(match.group("name").lower())
+            if full_name is None or (start > 0 and (code[start - 1].isalnum() or code[start - 1] == "_")):
+                return match.group(0)
+            # Keep everything before the name as written, only the name changes
+            prefix = match.group(0)[:match.start("name") - start]
+            return f"{prefix}{full_name}{match.group('quote')}"
+
+        return LOAD_DATASET_PATTERN.sub(substitute, code)
+
+def _default_registry() -> DatasetRegistry:
+    registry = DatasetRegistry(KNOWN_DATASETS)
+    if DATASET_ALIASES_PATH:
+        try:
+            registry.load(DATASET_ALIASES_PATH)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Warning: Could not load dataset aliases from {DATASET_ALIASES_PATH} ({e}).")
+    return registry
+
+# Registry used by replace_known_datasets; extend it with update() or load()
+registry = _default_registry()
+
+def replace_known_datasets(code: str, aliases: Optional[DatasetRegistry] = None) -> str:
     """
     Replace short dataset names with full HuggingFace dataset paths in load_dataset calls.
-    
-    Uses regex to match load_dataset calls more precisely, avoiding false matches
-    in comments or strings.
-    
+
+    Matches load_dataset('name'), load_dataset("name", split="train", ...) and
+    load_dataset(path="name"), keeping the quotes and the other arguments.
+
     Args:
         code: The code string to process
-        
+        aliases: Registry to use (defaults to the module registry)
+
     Returns:
         Code string with dataset names replaced
     """
-    for short_name, full_name in KNOWN_DATASETS.items():
-        # Match load_dataset('short_name') or load_dataset("short_name")
-        # Using word boundaries and precise pattern matching
-        pattern_single = re.compile(
-            rf"load_dataset\s*\(\s*['\"]{re.escape(short_name)}['\"]\s*\)",
-            re.IGNORECASE
-        )
-        code = pattern_single.sub(f"load_dataset('{full_name}')", code)
-    
-    return code
+    return (aliases if aliases is not None else registry).replace(code)
@@ -0,0 +1,613 @@
+import codecs
+import contextvars
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, TextIO
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from config import (
+    EXEC_POOL_ENABLED, EXEC_PRELOAD_MODULES, EXEC_TIMEOUT_SECONDS, EXEC_CPU_SECONDS,
+    EXEC_MEMORY_MB, EXEC_MAX_OPEN_FILES, EXEC_OUTPUT_HEAD_LINES, EXEC_OUTPUT_TAIL_LINES, EXEC_SPOOL_OUTPUT
+)
+
+# Forking needs POSIX; SCM_RIGHTS (passing pipes to the fork server) needs Python 3.9+
+FORK_SUPPORTED = hasattr(os, "fork") and hasattr(socket, "send_fds") and resource is not None
+
+# A line longer than this is passed on in pieces, so output without newlines stays bounded
+MAX_LINE_CHARS = 64 * 1024
+
+# Receives (stream name, line) as the script writes, stream name being "stdout" or "stderr"
+OutputCallback = Callable[[str, str], None]
+
+class ExecutionResult:
+    """Outcome of running one script."""
+
+    def __init__(self, returncode: Optional[int], stdout: str, stderr: str, seconds: float,
+                 timed_out: bool = False, cancelled: bool = False, error: str = "", pooled: bool = False,
+                 max_rss_kb: Optional[int] = None, truncated: bool = False, spool_path: Optional[str] = None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+        self.error = error
+        self.pooled = pooled
+        self.max_rss_kb = max_rss_kb
+        self.truncated = truncated
+        self.spool_path = spool_path
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not (self.timed_out or self.cancelled or self.error)
+
+    def summary(self) -> str:
+        """One line with exit code, wall time, peak memory and where the full output went."""
+        parts = [f"exit code {self.returncode}", f"{self.seconds:.2f}s"]
+        if self.max_rss_kb:
+            parts.append(f"peak memory {self.max_rss_kb / 1024:.1f} MB")
+        text = ", ".join(parts)
+        if self.spool_path:
+            text += f"; full output in {self.spool_path}"
+        return text
+
+class OutputBuffer:
+    """
+    Keeps the first head_lines and the last tail_lines of a stream.
+
+    Lines in between are counted and dropped, so a script printing without
+    end costs a fixed amount of memory.
+    """
+
+    def __init__(self, head_lines: int = EXEC_OUTPUT_HEAD_LINES, tail_lines: int = EXEC_OUTPUT_TAIL_LINES):
+        self.head_lines = head_lines
+        self.head: List[str] = []
+        self.tail: Deque[str] = deque(maxlen=tail_lines)
+        self.lines = 0
+        self.dropped = 0
+
+    def add(self, line: str) -> None:
+        self.lines += 1
+        if len(self.head) < self.head_lines:
+            self.head.append(line)
+            return
+        if self.tail.maxlen == 0 or len(self.tail) == self.tail.maxlen:
+            self.dropped += 1
+        if self.tail.maxlen:
+            self.tail.append(line)
+
+    def text(self) -> str:
+        if not self.dropped:
+            return "".join(self.head) + "".join(self.tail)
+        marker = f"... {self.dropped} lines omitted ...\n"
+        if self.head and not self.head[-1].endswith("\n"):
+            marker = "\n" + marker
+        return "".join(self.head) + marker + "".join(self.tail)
+
+class _Capture:
+    """Reads a script's stdout and stderr line by line into OutputBuffers and an optional spool file."""
+
+    def __init__(self, on_output: Optional[OutputCallback] = None, spool: bool = EXEC_SPOOL_OUTPUT):
+        self.on_output = on_output
+        self.buffers = {"stdout": OutputBuffer(), "stderr": OutputBuffer()}
+        self._lock = threading.Lock()
+        self.spool: Optional[TextIO] = None
+        if spool:
+            self.spool = tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", prefix="exec-", suffix=".log", delete=False
+            )
+
+    def _emit(self, name: str, line: str) -> None:
+        with self._lock:
+            self.buffers[name].add(line)
+            if self.spool is not None:
+                self.spool.write(line)
+        if self.on_output is not None:
+            try:
+                self.on_output(name, line)
+            except Exception:
+                pass
+
+    def _pump(self, name: str, fd: int) -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        while True:
+            data = os.read(fd, 65536)
+            pending += decoder.decode(data, final=not data)
+            lines = pending.splitlines(keepends=True)
+            pending = ""
+            if lines and not lines[-1].endswith(("\n", "\r")):
+                pending = lines.pop()
+            for line in lines:
+                self._emit(name, line)
+            while len(pending) > MAX_LINE_CHARS:
+                self._emit(name, pending[:MAX_LINE_CHARS])
+                pending = pending[MAX_LINE_CHARS:]
+            if not data:
+                break
+        if pending:
+            self._emit(name, pending)
+
+    def drain(self, out_fd: int, err_fd: int) -> None:
+        """Read both pipes until the script closes them."""
+        # A copy of the caller's context, so the daemon routes stderr to the same client as stdout
+        reader = threading.Thread(target=contextvars.copy_context().run, args=(self._pump, "stderr", err_fd),
+                                  daemon=True)
+        reader.start()
+        self._pump("stdout", out_fd)
+        reader.join()
+
+    def close(self) -> Optional[str]:
+        """Close the spool file and return its path."""
+        if self.spool is None:
+            return None
+        self.spool.close()
+        return self.spool.name
+
+    def result(self, returncode: Optional[int], seconds: float, **kwargs: Any) -> ExecutionResult:
+        truncated = any(buffer.dropped for buffer in self.buffers.values())
+        return ExecutionResult(returncode, self.buffers["stdout"].text(), self.buffers["stderr"].text(), seconds,
+                               truncated=truncated, spool_path=self.close(), **kwargs)
+
+def _maxrss_kb(value: int) -> int:
+    """ru_maxrss is in bytes on macOS and KiB elsewhere."""
+    return value // 1024 if sys.platform == "darwin" else value
+
+def _set_limits(cpu_seconds: int, memory_mb: int, max_files: int) -> None:
+    """Apply resource limits to the current process (0 leaves a limit unchanged)."""
+    if resource is None:
+        return
+    limits = [
+        (resource.RLIMIT_CPU, cpu_seconds),
+        (resource.RLIMIT_AS, memory_mb * 1024 * 1024),
+        (resource.RLIMIT_NOFILE, max_files),
+    ]
+    for which, value in limits:
+        if value <= 0:
+            continue
+        soft, hard = resource.getrlimit(which)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        try:
+            resource.setrlimit(which, (value, hard))
+        except (ValueError, OSError):
+            pass
+
+def _run_child(request: Dict[str, Any], out_fd: int, err_fd: int) -> None:
+    """Body of a forked worker: become the script and never return."""
+    code = 1
+    path = request["path"]
+    try:
+        os.setsid()
+        os.dup2(out_fd, 1)
+        os.dup2(err_fd, 2)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        for fd in (out_fd, err_fd, null):
+            os.close(fd)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        sys.stdout.reconfigure(line_buffering=True)
+        sys.stderr.reconfigure(line_buffering=True)
+        os.chdir(request["cwd"])
+        _set_limits(request["cpu_seconds"], request["memory_mb"], request["max_files"])
+
+        import runpy
+        sys.argv = [path] + list(request.get("argv", []))
+        sys.path[0] = os.path.dirname(os.path.abspath(path))
+        code = 0
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException as e:
+        # Hide the runpy frames so the traceback reads like `python script.py`
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+def _serve(sock_fd: int, preload: Sequence[str]) -> None:
+    """
+    Fork server main loop.
+
+    Imports the preload modules once, then forks a fresh worker for every
+    request received on the socket and reports its pid and exit status.
+    The server stays single-threaded so forking it is safe.
+    """
+    sock = socket.socket(fileno=sock_fd)
+    for name in preload:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+    try:
+        sock.sendall(json.dumps({"ready": True}).encode() + b"\n")
+    except OSError:
+        # The parent already exited, e.g. a short-lived CLI run
+        return
+
+    # SIGCHLD writes to this pipe, waking select() as soon as a worker exits
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    children: Dict[int, str] = {}
+    buffer = b""
+    while True:
+        readable, _, _ = select.select([sock, wakeup_r], [], [])
+        if wakeup_r in readable:
+            os.read(wakeup_r, 4096)
+        if sock in readable:
+            try:
+                data, fds, _, _ = socket.recv_fds(sock, 65536, 64)
+            except OSError:
+                data, fds = b"", []
+            if not data:
+                break
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                request = json.loads(line)
+                out_fd, err_fd = fds[:2]
+                fds = fds[2:]
+                pid = os.fork()
+                if pid == 0:
+                    sock.close()
+                    signal.set_wakeup_fd(-1)
+                    os.close(wakeup_r)
+                    os.close(wakeup_w)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    for fd in fds:
+                        os.close(fd)
+                    _run_child(request, out_fd, err_fd)
+                os.close(out_fd)
+                os.close(err_fd)
+                children[pid] = request["id"]
+                sock.sendall(json.dumps({"id": request["id"], "pid": pid}).encode() + b"\n")
+
+        while children:
+            try:
+                pid, status, usage = os.wait4(-1, os.WNOHANG)
+            except ChildProcessError:
+                children.clear()
+                break
+            if pid == 0:
+                break
+            run_id = children.pop(pid, None)
+            if run_id is not None:
+                message = {"id": run_id, "returncode": os.waitstatus_to_exitcode(status),
+                           "maxrss_kb": _maxrss_kb(usage.ru_maxrss)}
+                sock.sendall(json.dumps(message).encode() + b"\n")
+
+    for pid in children:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+class _Run:
+    """Book-keeping for one script running in the fork server."""
+
+    def __init__(self, run_id: str):
+        self.id = run_id
+        self.pid: Optional[int] = None
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.returncode: Optional[int] = None
+        self.maxrss_kb: Optional[int] = None
+
+class ExecutionPool:
+    """
+    Runs generated scripts in clean forks of a warm Python process.
+
+    A fork server is started once and imports EXEC_PRELOAD_MODULES (pandas,
+    sklearn, ...). Each run is a fresh fork of it, so imports that would take
+    seconds in a new interpreter are already in memory, while runs cannot
+    affect each other. Every fork gets its own working directory, captured
+    stdout/stderr, a timeout and CPU, memory and open-file limits. Where
+    forking is unavailable, or the server dies, scripts run in a new
+    `sys.executable` process as before.
+    """
+
+    def __init__(self, preload: Sequence[str] = EXEC_PRELOAD_MODULES, enabled: bool = EXEC_POOL_ENABLED):
+        """
+        Args:
+            preload: Modules the fork server imports before forking workers
+            enabled: Use the fork server at all (otherwise always spawn a new interpreter)
+        """
+        self.preload = list(preload)
+        self.enabled = enabled and FORK_SUPPORTED
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._process: Optional[subprocess.Popen] = None
+        self._sock: Optional[socket.socket] = None
+        self._runs: Dict[str, _Run] = {}
+        self._counter = 0
+        self.ready = threading.Event()
+
+    def start(self) -> bool:
+        """Start the fork server in the background if it is not running. Returns True if usable."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return True
+            parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self._process = subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "--serve", str(child.fileno())] + self.preload,
+                    pass_fds=[child.fileno()],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    # Ctrl+C in the terminal is meant for the CLI, which kills the running script itself
+                    start_new_session=True
+                )
+            except OSError:
+                parent.close()
+                child.close()
+                self.enabled = False
+                return False
+            child.close()
+            self._sock = parent
+            self.ready.clear()
+            threading.Thread(target=self._read_replies, args=(parent,), name="exec-pool", daemon=True).start()
+            return True
+
+    def _read_replies(self, sock: socket.socket) -> None:
+        """Dispatch the fork server's messages to the waiting runs."""
+        buffer = b""
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                break
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = json.loads(line)
+                if message.get("ready"):
+                    self.ready.set()
+                    continue
+                run = self._runs.get(message.get("id"))
+                if run is None:
+                    continue
+                if "pid" in message:
+                    run.pid = message["pid"]
+                    run.started.set()
+                else:
+                    run.returncode = message["returncode"]
+                    run.maxrss_kb = message.get("maxrss_kb")
+                    run.finished.set()
+        # Server gone: release everyone still waiting
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+            for run in list(self._runs.values()):
+                run.started.set()
+                run.finished.set()
+
+    def run(self, path: str, cwd: Optional[str] = None, timeout: float = EXEC_TIMEOUT_SECONDS,
+            argv: Sequence[str] = (), cancel: Optional[Any] = None,
+            on_output: Optional[OutputCallback] = None) -> ExecutionResult:
+        """
+        Run a Python script, streaming and capturing its output.
+
+        The result keeps the first and last lines of each stream
+        (OLLAMA_EXEC_HEAD_LINES / OLLAMA_EXEC_TAIL_LINES); with OLLAMA_EXEC_SPOOL
+        the complete output is also written to a temporary file.
+
+        Args:
+            path: Script to run
+            cwd: Working directory (defaults to the current one)
+            timeout: Seconds before the script is killed
+            argv: Extra command line arguments
+            cancel: CancelToken-like object; cancelling it kills the script
+            on_output: Called with (stream name, line) for every line as it is written
+
+        Returns:
+            ExecutionResult
+        """
+        cwd = os.path.abspath(cwd or os.getcwd())
+        path = os.path.abspath(path)
+        if self.start():
+            result = self._run_forked(path, cwd, timeout, argv, cancel, on_output)
+            if result is not None:
+                return result
+        return self._run_subprocess(path, cwd, timeout, argv, cancel, on_output)
+
+    def _run_forked(self, path: str, cwd: str, timeout: float, argv: Sequence[str],
+                    cancel: Optional[Any], on_output: Optional[OutputCallback]) -> Optional[ExecutionResult]:
+        """Run through the fork server, or return None if it is unavailable."""
+        with self._lock:
+            sock = self._sock
+            self._counter += 1
+            run = _Run(str(self._counter))
+            self._runs[run.id] = run
+        if sock is None:
+            self._runs.pop(run.id, None)
+            return None
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        request = {
+            "id": run.id, "path": path, "cwd": cwd, "argv": list(argv),
+            "cpu_seconds": EXEC_CPU_SECONDS, "memory_mb": EXEC_MEMORY_MB, "max_files": EXEC_MAX_OPEN_FILES,
+        }
+        start = time.monotonic()
+        try:
+            with self._send_lock:
+                socket.send_fds(sock, [json.dumps(request).encode() + b"\n"], [out_w, err_w])
+        except OSError:
+            for fd in (out_r, out_w, err_r, err_w):
+                os.close(fd)
+            self._runs.pop(run.id, None)
+            return None
+        finally:
+            # The server holds its own copies now
+            for fd in (out_w, err_w):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+        killed = {"timeout": False, "cancelled": False}
+
+        def kill(reason: Optional[str] = None) -> None:
+            if reason:
+                killed[reason] = True
+            run.started.wait(5)
+            if run.pid is not None and not run.finished.is_set():
+                try:
+                    os.killpg(run.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+        cancel_kill = lambda: kill("cancelled")
+        if cancel is not None:
+            cancel.register(cancel_kill)
+        timer = threading.Timer(timeout, kill, args=("timeout",))
+        timer.daemon = True
+        timer.start()
+        capture = _Capture(on_output)
+        try:
+            capture.drain(out_r, err_r)
+            run.finished.wait()
+        except BaseException:
+            # Interrupted (Ctrl+C): the script runs in its own session, so stop it here
+            kill("cancelled")
+            raise
+        finally:
+            os.close(out_r)
+            os.close(err_r)
+            timer.cancel()
+            if cancel is not None:
+                cancel.unregister(cancel_kill)
+            self._runs.pop(run.id, None)
+
+        error = "" if run.returncode is not None else "execution server exited"
+        return capture.result(run.returncode, time.monotonic() - start, timed_out=killed["timeout"],
+                              cancelled=killed["cancelled"], error=error, pooled=True,
+                              max_rss_kb=run.maxrss_kb)
+
+    def _run_subprocess(self, path: str, cwd: str, timeout: float, argv: Sequence[str],
+                        cancel: Optional[Any], on_output: Optional[OutputCallback]) -> ExecutionResult:
+        """Fallback: run the script in a new interpreter."""
+        start = time.monotonic()
+        preexec: Optional[Callable[[], None]] = None
+        if resource is not None:
+            preexec = lambda: _set_limits(EXEC_CPU_SECONDS, EXEC_MEMORY_MB, EXEC_MAX_OPEN_FILES)
+        try:
+            process = subprocess.Popen(
+                [sys.executable, "-u", path] + list(argv),
+                cwd=cwd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                preexec_fn=preexec,
+                start_new_session=hasattr(os, "killpg")
+            )
+        except OSError as e:
+            return ExecutionResult(None, "", "", 0.0, error=str(e))
+
+        killed = {"timeout": False, "cancelled": False}
+
+        def kill(reason: str) -> None:
+            if process.returncode is not None:
+                return
+            killed[reason] = True
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+            except OSError:
+                pass
+
+        cancel_kill = lambda: kill("cancelled")
+        if cancel is not None:
+            cancel.register(cancel_kill)
+        timer = threading.Timer(timeout, kill, args=("timeout",))
+        timer.daemon = True
+        timer.start()
+        capture = _Capture(on_output)
+        max_rss_kb = None
+        try:
+            capture.drain(process.stdout.fileno(), process.stderr.fileno())
+            if hasattr(os, "wait4"):
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                max_rss_kb = _maxrss_kb(usage.ru_maxrss)
+            else:
+                process.wait()
+        except BaseException:
+            # Interrupted (Ctrl+C): the script runs in its own session, so stop it here
+            kill("cancelled")
+            process.wait()
+            raise
+        finally:
+            timer.cancel()
+            if cancel is not None:
+                cancel.unregister(cancel_kill)
+            process.stdout.close()
+            process.stderr.close()
+        return capture.result(process.returncode, time.monotonic() - start, timed_out=killed["timeout"],
+                              cancelled=killed["cancelled"], max_rss_kb=max_rss_kb)
+
+    def close(self) -> None:
+        """Stop the fork server."""
+        with self._lock:
+            sock, process = self._sock, self._process
+            self._sock = None
+            self._process = None
+        if sock is not None:
+            sock.close()
+        if process is not None:
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+_pool: Optional[ExecutionPool] = None
+_pool_lock = threading.Lock()
+
+def get_execution_pool() -> ExecutionPool:
+    """Return the process-wide ExecutionPool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExecutionPool()
+        return _pool
+
+if __name__ == "__main__" and len(sys.argv) >= 3 and sys.argv[1] == "--serve":
+    _serve(int(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,240 @@
+"""
+Incremental extraction of the code block from a streamed model answer.
+
+Models asked for bare code often wrap it in a markdown fence, introduce it
+("Here is the code:") or explain it afterwards. CodeExtractor is fed the
+answer chunk by chunk and passes on only the code, as soon as each part of
+it is known to be code; once the block is over it reports `closed`, so the
+caller can cancel the request instead of paying for the rest.
+"""
+import codeop
+import io
+import re
+import tokenize
+import warnings
+from typing import Any, Dict, List
+
+_FENCE = "```"
+
+# Clauses that continue a block from column 0 and never start prose
+_DEDENT_CLAUSE = re.compile(r"(else|elif|except|finally)\b")
+
+# Operators and brackets: a line with any of them is taken for (possibly broken) code
+_CODE_CHARS = re.compile(r"[()\[\]{}=<>+*/%&|^~@]")
+
+# Fewer words than this is too little to tell a sentence from a broken statement
+_SENTENCE_MIN_WORDS = 3
+
+def _is_prose(line: str) -> bool:
+    """Whether a line at column 0 reads as English rather than Python ("Here is the code:")."""
+    if not line[:1].isalpha():
+        return False
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            codeop.compile_command(line, symbol="exec")
+    except SyntaxError:
+        return True
+    except (OverflowError, ValueError):
+        return False
+    # Complete or incomplete statements such as "for x in y:" are code
+    return False
+
+def _is_sentence(line: str) -> bool:
+    """
+    Whether a line is prose beyond doubt: several words and no operators or brackets.
+
+    Code is only ended by such a line, so a broken statement like `print "hi"`
+    stays in for the checks to report instead of cutting the code short.
+    """
+    return len(line.split()) >= _SENTENCE_MIN_WORDS and not _CODE_CHARS.search(line) and _is_prose(line)
+
+def _compiles(source: str) -> bool:
+    """Whether source is valid Python, complete or not yet."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            codeop.compile_command(source, symbol="exec")
+    except (SyntaxError, OverflowError, ValueError):
+        return False
+    return True
+
+def _brackets_open(source: str) -> bool:
+    """Whether source ends inside an open bracket, where any line may follow."""
+    depth = 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type == tokenize.OP:
+                if token.string in "([{":
+                    depth += 1
+                elif token.string in ")]}":
+                    depth = max(depth - 1, 0)
+    except tokenize.TokenError:
+        # Raised at the end of input inside brackets or a multi-line string
+        return depth > 0
+    except (SyntaxError, ValueError):
+        return False
+    return depth > 0
+
+class CodeExtractor:
+    """
+    Stream filter keeping only the code of a model's answer.
+
+    - Leading blank and prose lines are dropped, as is an opening fence.
+    - In a fenced block, the closing fence ends the code.
+    - In unfenced code, a fence line or a prose line after a blank line
+      (trailing explanation) ends the code. A line is only prose if it
+      cannot continue the code so far: clauses such as `else:`, lines
+      inside open brackets and anything that compiles with the code
+      before it are kept.
+    - Fences inside triple-quoted strings are kept.
+
+    Text is held back only while the current line could still turn out to
+    be a fence or prose; everything else is passed on as it arrives. An
+    answer without any code is returned unchanged by finish().
+    """
+
+    def __init__(self):
+        self.state = "start"  # "start", "fenced", "code" or "closed"
+        self.received_chars = 0
+        self.kept_chars = 0
+        self._line = ""  # the current incomplete line
+        self._line_released = 0  # characters of it already passed on
+        self._previous_blank = False
+        self._quote = ""  # open triple quote, if inside a multi-line string
+        self._held: List[str] = []  # dropped lines, returned if no code follows
+        self._code: List[str] = []  # complete lines of code passed on so far
+
+    @property
+    def closed(self) -> bool:
+        """Whether the code block is over, so the rest of the answer can be discarded."""
+        return self.state == "closed"
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of the answer.
+
+        Returns:
+            The code it completes (possibly empty)
+        """
+        self.received_chars += len(chunk)
+        if self.closed:
+            return ""
+        out = []
+        lines = (self._line + chunk).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            out.append(self._complete_line(line, "\n"))
+            self._line_released = 0
+            if self.closed:
+                self._line = ""
+                break
+        if self._line and self._can_release():
+            out.append(self._line[self._line_released:])
+            self._line_released = len(self._line)
+        return self._keep("".join(out))
+
+    def finish(self) -> str:
+        """
+        End of the answer: flush the last line.
+
+        Returns:
+            The remaining code, or the whole answer if it contained no code
+        """
+        out = ""
+        if not self.closed and self._line:
+            out = self._complete_line(self._line, "")
+        self._line = ""
+        self._line_released = 0
+        if not self.kept_chars and not out:
+            out = "\n".join(self._held).strip()
+            self._held = []
+        return self._keep(out)
+
+    def report(self) -> Dict[str, Any]:
+        """Characters and estimated tokens received, kept and dropped, and whether the code closed early."""
+        dropped = max(self.received_chars - self.kept_chars, 0)
+        return {
+            "received_chars": self.received_chars,
+            "kept_chars": self.kept_chars,
+            "dropped_chars": dropped,
+            # About four characters per token, as in symbol_index.estimate_tokens
+            "dropped_tokens": (dropped + 3) // 4,
+            "closed": self.closed,
+        }
+
+    def _keep(self, text: str) -> str:
+        self.kept_chars += len(text)
+        return text
+
+    def _can_release(self) -> bool:
+        """Whether the partial current line is code whatever follows."""
+        if self._line_released:
+            return True
+        if self.state == "start":
+            return False
+        if self._quote:
+            return True
+        stripped = self._line.lstrip()
+        if not stripped or stripped.startswith("`"):
+            return False  # could still become a fence
+        return not (self.state == "code" and self._previous_blank and self._line[0].isalpha())
+
+    def _complete_line(self, line: str, end: str) -> str:
+        """Classify a complete line and return what of it is code."""
+        if self._line_released:
+            self._track_strings(line)
+            self._previous_blank = False
+            self._code.append(line + "\n")
+            return line[self._line_released:] + end
+        stripped = line.strip()
+        if self.state == "start":
+            if not stripped or _is_prose(line):
+                self._held.append(line)
+                return ""
+            if stripped.startswith(_FENCE):
+                self._held.append(line)
+                self.state = "fenced"
+                return ""
+            self.state = "code"
+        elif not self._quote:
+            if stripped.startswith(_FENCE):
+                self.state = "closed"
+                return ""
+            if self.state == "code" and self._previous_blank and _is_sentence(line) and not self._continues(line):
+                self.state = "closed"
+                return ""
+        self._track_strings(line)
+        self._previous_blank = not stripped
+        self._code.append(line + "\n")
+        return line + end
+
+    def _continues(self, line: str) -> bool:
+        """Whether a line that is not code on its own still continues the code before it."""
+        if _DEDENT_CLAUSE.match(line):
+            return True
+        code = "".join(self._code)
+        return _brackets_open(code) or _compiles(code + line + "\n")
+
+    def _track_strings(self, line: str) -> None:
+        """Follow triple-quoted strings across lines, so fences inside them are not taken as the end."""
+        i = 0
+        while True:
+            if self._quote:
+                j = line.find(self._quote, i)
+                if j < 0:
+                    return
+                self._quote = ""
+                i = j + 3
+            else:
+                found = [(line.find(q, i), q) for q in ('"""', "'''")]
+                found = [(j, q) for j, q in found if j >= 0]
+                if not found:
+                    return
+                j, self._quote = min(found)
+                i = j + 3
+
+def extract_code(text: str) -> str:
+    """The code of a complete answer, without fences and surrounding prose."""
+    extractor = CodeExtractor()
+    return (extractor.feed(text) + extractor.finish()).strip()
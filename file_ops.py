@@ -1,5 +1,4 @@
 import os
-import subprocess
 import sys
 
 # Fix Windows encoding issues - must be before any print statements
@@ -17,17 +16,107 @@ if sys.platform == 'win32':
     except (AttributeError, ValueError, TypeError):
         pass
 
+import mmap
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
+
+from config import CONTEXT_MAX_FILE_BYTES, CONTEXT_CACHE_ENTRIES, EXEC_TIMEOUT_SECONDS
+from exec_pool import get_execution_pool
+from extraction import extract_code
+import telemetry
+
+# Files at least this large are decoded straight from a memory map instead of read() into a buffer
+MMAP_THRESHOLD_BYTES = 256 * 1024
+
+# Bytes inspected when deciding whether a file is binary
+BINARY_SNIFF_BYTES = 8192
+
+class FileContentCache:
+    """
+    Decoded text of context files, reused until the file changes.
+    
+    Entries are keyed by resolved path and validated against the file's
+    (inode, mtime, size), so an unchanged file costs one stat() per read.
+    Binary files and files above max_bytes are rejected before they are
+    decoded; large files are decoded from an mmap in a single pass.
+    """
+    
+    def __init__(self, max_entries: int = CONTEXT_CACHE_ENTRIES, max_bytes: int = CONTEXT_MAX_FILE_BYTES):
+        """
+        Args:
+            max_entries: Maximum number of files kept, least recently used evicted first
+            max_bytes: Largest file size accepted
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int, int], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "rejected": 0}
+    
+    def read(self, path: Path) -> str:
+        """
+        Return the text of path, decoded as UTF-8 with invalid bytes replaced.
+        
+        Raises:
+            ValueError: If the file is binary or larger than max_bytes
+            OSError: If the file cannot be opened
+        """
+        key = str(path)
+        info = os.stat(path)
+        signature = (info.st_ino, info.st_mtime_ns, info.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[1]
+            self._counters["misses"] += 1
+        
+        if info.st_size > self.max_bytes:
+            self._reject()
+            raise ValueError(f"file is {info.st_size} bytes, the limit is {self.max_bytes}")
+        text = self._decode(path, info.st_size)
+        
+        with self._lock:
+            self._entries[key] = (signature, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return text
+    
+    def _reject(self) -> None:
+        with self._lock:
+            self._counters["rejected"] += 1
+    
+    def _decode(self, path: Path, size: int) -> str:
+        with open(path, "rb") as f:
+            # Only the first bytes are read before deciding, so a binary file costs one small read
+            head = f.read(BINARY_SNIFF_BYTES)
+            if b"\0" in head:
+                self._reject()
+                raise ValueError("binary file")
+            if size >= MMAP_THRESHOLD_BYTES:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        return str(view, "utf-8", "replace")
+                    finally:
+                        view.release()
+            data = head + f.read(self.max_bytes + 1 - len(head))
+        return data.decode("utf-8", errors="replace")
+    
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/rejection counters and the number of cached files."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            return stats
 
 def clean_code(raw_output: str) -> str:
-    """Remove markdown code blocks from raw output."""
-    lines = raw_output.strip().splitlines()
-    if lines and lines[0].startswith("```"):
-        lines = lines[1:]
-    if lines and lines[-1].startswith("```"):
-        lines = lines[:-1]
-    return "\n".join(lines).strip()
+    """Remove markdown fences and any explanation before or after the code (see extraction.extract_code)."""
+    return extract_code(raw_output)
 
 def sanitize_filename(filename: str) -> Optional[str]:
     """Sanitize filename to prevent path traversal attacks."""
@@ -48,8 +137,16 @@ def sanitize_filename(filename: str) -> Optional[str]:
     
     return filename
 
-def save_to_file(filename: str, content: str) -> bool:
-    """Save content to a file with proper error handling."""
+def save_to_file(filename: str, content: str, directory: Optional[str] = None, clean: bool = True) -> bool:
+    """
+    Save content to a file with proper error handling.
+    
+    Args:
+        filename: Target file name; any path components are stripped
+        content: Raw model output, cleaned of markdown fences before writing
+        directory: Optional output directory (created if missing), defaults to the current directory
+        clean: Extract the code from content first; False writes it as is, e.g. an edited file
+    """
     try:
         sanitized = sanitize_filename(filename)
         if not sanitized:
@@ -62,9 +159,17 @@ def save_to_file(filename: str, content: str) -> bool:
             print("❌ Invalid file path. Please use a simple filename.")
             return False
         
-        with open(filepath, "w", encoding="utf-8") as f:
-            cleaned = clean_code(content)
-            f.write(cleaned)
+        if directory:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            filepath = Path(directory) / filepath
+        
+        with telemetry.request("save", filename=filepath.name):
+            cleaned = content
+            if clean:
+                with telemetry.span("clean_code"):
+                    cleaned = clean_code(content)
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(cleaned)
         print(f"✅ Saved to {filepath}")
         return True
     except PermissionError:
@@ -77,37 +182,51 @@ def save_to_file(filename: str, content: str) -> bool:
         print(f"❌ Unexpected error: {e}")
         return False
 
-def execute_file(filename: str) -> bool:
-    """Execute a Python file using subprocess with proper error handling."""
+def execute_file(filename: str, stream: bool = True) -> bool:
+    """
+    Execute a Python file in the execution pool with proper error handling.
+    
+    With stream=True output is printed line by line as the script runs;
+    otherwise the captured output is printed once it exits.
+    """
     try:
         if not os.path.exists(filename):
             print("❌ File not found.")
             return False
         
-        # Use sys.executable for cross-platform compatibility
-        result = subprocess.run(
-            [sys.executable, filename],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='replace',
-            timeout=300  # 5 minute timeout
-        )
+        def echo(name: str, line: str) -> None:
+            target = sys.stdout if name == "stdout" else sys.stderr
+            target.write(line)
+            target.flush()
         
-        if result.stdout:
-            print(result.stdout)
+        # Runs in a fork of the warm execution server, or a new interpreter where forking is unavailable
+        with telemetry.request("execute", script=os.path.basename(filename)) as fields:
+            result = get_execution_pool().run(filename, on_output=echo if stream else None)
+            fields.update(returncode=result.returncode, pooled=result.pooled, max_rss_kb=result.max_rss_kb)
+            if not result.ok:
+                fields["status"] = "cancelled" if result.cancelled else "error"
         
-        if result.stderr:
-            print(result.stderr, file=sys.stderr)
+        if not stream:
+            if result.stdout:
+                print(result.stdout)
+            if result.stderr:
+                print(result.stderr, file=sys.stderr)
+        
+        if result.error:
+            print(f"❌ Error executing file: {result.error}")
+            return False
+        
+        print(f"⏱️ {result.summary()}")
+        
+        if result.timed_out:
+            print(f"❌ Script execution timed out after {EXEC_TIMEOUT_SECONDS} seconds.")
+            return False
         
         if result.returncode != 0:
             print(f"❌ Script exited with code {result.returncode}")
             return False
         
         return True
-    except subprocess.TimeoutExpired:
-        print("❌ Script execution timed out after 5 minutes.")
-        return False
     except Exception as e:
         print(f"❌ Error executing file: {e}")
         return False
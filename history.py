@@ -0,0 +1,268 @@
+"""
+History of generated answers, searchable by instruction similarity.
+
+A request worded differently from an earlier one ("make a calculator python
+script" / "create a calculator in python") finds that answer through a
+MinHash LSH index over the instructions' meaningful words, so it can be
+offered or served without asking the model again.
+"""
+import hashlib
+import re
+import sqlite3
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import MODEL_NAME, HISTORY_PATH, HISTORY_THRESHOLD, HISTORY_MAX_ENTRIES
+
+# Words that say how to phrase a request rather than what it asks for, so
+# "make a calculator python script" and "create a calculator in python" match
+STOPWORDS = frozenset("""
+a an the and or but of to in on for with without that which this these those it its is are be
+as by at from into using use me my i we you your please can could would will should do does
+just also then so some any simple small basic quick little new python py script program code
+app application make create write build generate implement develop give show need want let
+lets how what
+""".split())
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# MinHash values and LSH bands: 16 bands of 3 rows make two instructions with
+# Jaccard similarity s share a bucket with probability 1 - (1 - s^3)^16, 98% at
+# s = 0.6 but 0.2% at s = 0.05, so few unrelated entries have to be compared.
+# Each value is a 64-bit slice of keyed BLAKE2b digests of the shingle, 8 per digest
+NUM_PERMUTATIONS = 48
+BANDS = 16
+_PERSONS = [f"minhash{i}".encode("ascii") for i in range(NUM_PERMUTATIONS // 8)]
+_UNPACK = struct.Struct(f"<{NUM_PERMUTATIONS}Q").unpack
+
+# Candidates compared exactly per lookup; more only happens for near-identical instructions
+MAX_CANDIDATES = 200
+
+def instruction_shingles(instruction: str) -> Set[str]:
+    """
+    The words of an instruction that carry its meaning, and adjacent pairs of them.
+
+    Filler words are dropped and plurals reduced, so rephrasings give the same
+    words; the pairs keep "celsius to fahrenheit" apart from "fahrenheit to celsius".
+    """
+    words = []
+    for word in _WORD_RE.findall(instruction.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    shingles = set(words)
+    shingles.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return shingles
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """Share of shingles two instructions have in common."""
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def minhash(shingles: Set[str]) -> List[int]:
+    """MinHash signature of a shingle set, NUM_PERMUTATIONS values."""
+    rows = []
+    for shingle in shingles:
+        data = shingle.encode("utf-8")
+        rows.append(_UNPACK(b"".join(hashlib.blake2b(data, digest_size=64, person=person).digest()
+                                     for person in _PERSONS)))
+    return [min(column) for column in zip(*rows)]
+
+def band_keys(signature: List[int], scope: str) -> List[int]:
+    """
+    LSH bucket keys of a signature, one per band.
+
+    scope (model and context hash) is part of every key, so only entries made
+    for the same model and context can be found.
+    """
+    rows = NUM_PERMUTATIONS // BANDS
+    prefix = scope.encode("utf-8") + b"\0"
+    keys = []
+    for band in range(BANDS):
+        data = prefix + band.to_bytes(2, "big") + b"".join(
+            value.to_bytes(8, "big") for value in signature[band * rows:(band + 1) * rows])
+        keys.append(int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big", signed=True))
+    return keys
+
+class HistoryMatch:
+    """An earlier generation similar to a new instruction."""
+
+    def __init__(self, entry_id: int, instruction: str, code: str, similarity: float, created: float):
+        self.id = entry_id
+        self.instruction = instruction
+        self.code = code
+        self.similarity = similarity
+        self.created = created
+
+    def describe(self) -> str:
+        """One line for status messages, e.g. 92% similar to "make a calculator"."""
+        instruction = self.instruction if len(self.instruction) <= 60 else self.instruction[:57] + "..."
+        return f'{self.similarity:.0%} similar to "{instruction}"'
+
+class GenerationHistory:
+    """
+    Every generated result, searchable by instruction similarity.
+
+    Entries are kept in SQLite with a MinHash LSH index over the instruction's
+    shingles, scoped to the model and a hash of the context, so a lookup is a
+    single indexed query however large the history grows. Candidates are then
+    compared exactly and the most similar one above the threshold is returned.
+    """
+
+    def __init__(self, path: Optional[str] = HISTORY_PATH, threshold: float = HISTORY_THRESHOLD,
+                 max_entries: int = HISTORY_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite file, or None to keep the history in memory only
+            threshold: Minimum Jaccard similarity of instruction shingles for a match
+            max_entries: Entries kept; the least recently used are dropped beyond that
+        """
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"lookups": 0, "matches": 0, "reuses": 0, "stores": 0, "evictions": 0}
+        try:
+            self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=5)
+        except sqlite3.Error as e:
+            print(f"⚠️ Warning: Generation history kept in memory only ({path}): {e}")
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL UNIQUE, instruction TEXT NOT NULL, "
+            "shingles TEXT NOT NULL, code TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL, "
+            "reuses INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS generations_used ON generations(used);"
+            "CREATE TABLE IF NOT EXISTS lsh (key INTEGER NOT NULL, id INTEGER NOT NULL, "
+            "PRIMARY KEY (key, id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS lsh_id ON lsh(id);"
+        )
+        self._size = self._db.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+    def add(self, instruction: str, context_hash: str, code: str, model: str = MODEL_NAME) -> Optional[int]:
+        """
+        Store a result; the same request made again replaces the earlier code.
+
+        Returns:
+            The entry id, or None if the instruction has no meaningful words to index
+        """
+        return self.add_many([(instruction, context_hash, code)], model)[0]
+
+    def add_many(self, entries: Iterable[Tuple[str, str, str]], model: str = MODEL_NAME) -> List[Optional[int]]:
+        """Store (instruction, context_hash, code) results in one transaction; see add."""
+        entries = list(entries)
+        ids: List[Optional[int]] = []
+        now = time.time()
+        with self._lock:
+            try:
+                for instruction, context_hash, code in entries:
+                    ids.append(self._insert(instruction, context_hash, code, model, now))
+                if self._size > self.max_entries:
+                    self._trim()
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                print(f"⚠️ Warning: Could not store generation history: {e}")
+                ids = [None] * len(entries)
+        return ids
+
+    def _insert(self, instruction: str, context_hash: str, code: str, model: str, now: float) -> Optional[int]:
+        """Insert or refresh one entry. Lock must be held."""
+        shingles = instruction_shingles(instruction)
+        if not shingles or not code.strip():
+            return None
+        scope = f"{model}\0{context_hash}"
+        text = "\n".join(sorted(shingles))
+        fingerprint = hashlib.sha256(f"{scope}\0{text}".encode("utf-8")).hexdigest()
+        row = self._db.execute("SELECT id FROM generations WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is not None:
+            self._db.execute("UPDATE generations SET instruction = ?, code = ?, created = ?, used = ? WHERE id = ?",
+                             (instruction, code, now, now, row[0]))
+            return row[0]
+        cursor = self._db.execute(
+            "INSERT INTO generations (fingerprint, instruction, shingles, code, created, used) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (fingerprint, instruction, text, code, now, now))
+        entry_id = cursor.lastrowid
+        self._db.executemany("INSERT OR IGNORE INTO lsh (key, id) VALUES (?, ?)",
+                             [(key, entry_id) for key in band_keys(minhash(shingles), scope)])
+        self._size += 1
+        self._counters["stores"] += 1
+        return entry_id
+
+    def _trim(self) -> None:
+        """Drop the least recently used entries beyond max_entries, plus a tenth for headroom. Lock must be held."""
+        excess = self._size - self.max_entries + self.max_entries // 10
+        ids = [row[0] for row in self._db.execute(
+            "SELECT id FROM generations ORDER BY used LIMIT ?", (excess,))]
+        self._db.executemany("DELETE FROM lsh WHERE id = ?", [(i,) for i in ids])
+        self._db.executemany("DELETE FROM generations WHERE id = ?", [(i,) for i in ids])
+        self._size -= len(ids)
+        self._counters["evictions"] += len(ids)
+
+    def find(self, instruction: str, context_hash: str, model: str = MODEL_NAME,
+             threshold: Optional[float] = None) -> Optional[HistoryMatch]:
+        """
+        The stored result whose instruction is most similar to this one.
+
+        Args:
+            threshold: Minimum similarity (defaults to self.threshold)
+
+        Returns:
+            The best match at or above the threshold, or None
+        """
+        shingles = instruction_shingles(instruction)
+        if not shingles:
+            return None
+        keys = band_keys(minhash(shingles), f"{model}\0{context_hash}")
+        threshold = self.threshold if threshold is None else threshold
+        best: Optional[HistoryMatch] = None
+        with self._lock:
+            self._counters["lookups"] += 1
+            try:
+                rows = self._db.execute(
+                    "SELECT id, instruction, shingles, code, created FROM generations WHERE id IN ("
+                    f"SELECT DISTINCT id FROM lsh WHERE key IN ({','.join('?' * len(keys))}) LIMIT ?)",
+                    (*keys, MAX_CANDIDATES)).fetchall()
+            except sqlite3.Error:
+                return None
+            for entry_id, stored, text, code, created in rows:
+                similarity = jaccard(shingles, set(text.split("\n")))
+                if similarity >= threshold and (best is None or similarity > best.similarity):
+                    best = HistoryMatch(entry_id, stored, code, similarity, created)
+            if best is not None:
+                self._counters["matches"] += 1
+        return best
+
+    def use(self, entry_id: int) -> None:
+        """Count a reuse of an entry, which also keeps it from being trimmed."""
+        with self._lock:
+            self._counters["reuses"] += 1
+            try:
+                self._db.execute("UPDATE generations SET used = ?, reuses = reuses + 1 WHERE id = ?",
+                                 (time.time(), entry_id))
+                self._db.commit()
+            except sqlite3.Error:
+                pass
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._db.execute("DELETE FROM lsh")
+            self._db.execute("DELETE FROM generations")
+            self._db.commit()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return lookup, match and reuse counters and the number of entries."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = self._size
+            return stats
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            self._db.close()
@@ -1,6 +1,17 @@
 import sys
+
+# With --profile-startup, time every import below; must come before them
+import startup_profile
+if "--profile-startup" in sys.argv[1:]:
+    startup_profile.install()
+
+import os
+import json
+import math
+import time
 import signal
-from typing import Optional
+import argparse
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 # Fix Windows encoding issues - must be before any imports that use print
 if sys.platform == 'win32':
@@ -17,21 +28,272 @@ if sys.platform == 'win32':
     except (AttributeError, ValueError, TypeError):
         pass
 
-from agent import CodingAgent
+# The agent is imported where it is needed, so `main.py "instruction"` stays a thin daemon client
+from config import SPECULATIVE_CANDIDATES
+import telemetry
+import daemon
+
+if TYPE_CHECKING:
+    from agent import CodingAgent
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully."""
     print("\n\n👋 Goodbye!")
     sys.exit(0)
 
-def main() -> None:
+def interrupt_handler(sig, frame):
+    """
+    Ctrl+C in the interactive loop or an in-process one-shot: interrupt whatever is running.
+    
+    Unwinding the KeyboardInterrupt closes the model stream (aborting the HTTP
+    request or killing `ollama run`) and kills a running script; main() then
+    returns to the prompt, where Ctrl+C exits, or exits with status 130.
+    """
+    telemetry.interrupted()
+    raise KeyboardInterrupt
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line options."""
+    parser = argparse.ArgumentParser(description="AI Coding Assistant powered by a local Ollama model.")
+    parser.add_argument(
+        "instruction",
+        nargs="?",
+        help="answer one instruction and exit, through the agent daemon of the working directory "
+             "(started automatically); without it an interactive session starts"
+    )
+    parser.add_argument("--context", metavar="FILES", help="context file paths or glob patterns, comma-separated")
+    parser.add_argument("--save", metavar="FILE", help="write the result to FILE (the context file applies an edit)")
+    parser.add_argument("--session", metavar="NAME", help="continue the named conversation kept by the daemon")
+    parser.add_argument("--no-daemon", action="store_true", help="answer the instruction in this process")
+    parser.add_argument("--daemon", action="store_true", help="run the agent daemon for the working directory")
+    parser.add_argument("--stop-daemon", action="store_true", help="stop the agent daemon of the working directory")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always ask the model instead of serving cached responses"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="run non-interactively over a JSONL file of jobs "
+             '({"instruction": ..., "context": optional path(s), "filename": ...} per line)'
+    )
+    parser.add_argument("--out", metavar="DIR", default=".", help="directory for batch outputs (default: current directory)")
+    parser.add_argument("--workers", type=int, default=4, help="number of parallel batch jobs (default: 4)")
+    parser.add_argument("--run", action="store_true", help="execute each generated file after saving it (batch or --save)")
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        metavar="N",
+        help="generate N answers at once and keep the first valid one (default: OLLAMA_CANDIDATES)"
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print the import time of each module and the time of each init step before starting"
+    )
+    args = parser.parse_args(argv)
+    if args.workers <= 0:
+        parser.error("--workers must be a positive integer")
+    if args.candidates is not None and args.candidates <= 0:
+        parser.error("--candidates must be a positive integer")
+    if args.instruction is None:
+        for flag, value in (("--context", args.context), ("--save", args.save), ("--session", args.session),
+                            ("--no-daemon", args.no_daemon)):
+            if value:
+                parser.error(f"{flag} needs an instruction")
+    elif args.batch:
+        parser.error("give either an instruction or --batch")
+    elif args.run and not args.save:
+        parser.error("--run needs --save")
+    elif args.candidates is not None and not args.no_daemon:
+        parser.error("--candidates only applies with --no-daemon (the daemon uses OLLAMA_CANDIDATES)")
+    return args
+
+def load_batch_jobs(path: str) -> List[Dict[str, Any]]:
+    """
+    Read batch jobs from a JSONL file.
+    
+    Blank lines and lines starting with '#' are skipped. Malformed lines are
+    kept as jobs carrying an "error" so they show up in the summary.
+    """
+    from file_ops import sanitize_filename
+    jobs: List[Dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job: Dict[str, Any] = {"line": line_no}
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                job["error"] = f"invalid JSON: {e}"
+                jobs.append(job)
+                continue
+            if not isinstance(data, dict) or not str(data.get("instruction", "")).strip():
+                job["error"] = "missing instruction"
+                jobs.append(job)
+                continue
+            job["instruction"] = str(data["instruction"])
+            job["context"] = data.get("context") or None
+            job["filename"] = sanitize_filename(str(data.get("filename") or f"job_{line_no}.py"))
+            jobs.append(job)
+    return jobs
+
+@telemetry.traced("batch_job", status=lambda result: "✅" if result["ok"] else result.get("status", "❌"))
+def _run_batch_job(agent: "CodingAgent", job: Dict[str, Any], out_dir: str, run: bool) -> Dict[str, Any]:
+    """Generate, save and optionally execute one batch job."""
+    from file_ops import save_to_file, execute_file
+    result = {"line": job["line"], "filename": job.get("filename"), "ok": False, "seconds": 0.0}
+    if job.get("error"):
+        result["status"] = f"❌ {job['error']}"
+        return result
+    
+    start = time.perf_counter()
+    code, status = agent.generate_code(job["instruction"], job["context"])
+    result["seconds"] = time.perf_counter() - start
+    result["status"] = status
+    if not code:
+        return result
+    
+    if not save_to_file(job["filename"], code, directory=out_dir):
+        result["status"] = "❌ Failed to save file."
+        return result
+    
+    if run:
+        result["ran"] = execute_file(os.path.join(out_dir, job["filename"]), stream=False)
+        if not result["ran"]:
+            result["status"] = "❌ Script failed."
+            return result
+    
+    result["ok"] = True
+    return result
+
+def _percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+def _rate(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.0%}"
+
+def run_batch(agent: "CodingAgent", path: str, out_dir: str, workers: int, run: bool = False) -> int:
+    """
+    Process a JSONL file of instructions in parallel.
+    
+    Returns:
+        Process exit code: 0 if every job succeeded, 1 otherwise
+    """
+    # Only batch runs need a thread pool, so interactive startup skips the import
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    try:
+        jobs = load_batch_jobs(path)
+    except OSError as e:
+        print(f"❌ Cannot read batch file '{path}': {e}")
+        return 1
+    if not jobs:
+        print("❌ Batch file contains no jobs.")
+        return 1
+    
+    print(f"📦 Running {len(jobs)} job(s) with {workers} worker(s)...")
+    results: List[Dict[str, Any]] = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_batch_job, agent, job, out_dir, run) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            label = f"[{done}/{len(jobs)}] {result['filename'] or 'line ' + str(result['line'])}"
+            if result["ok"]:
+                print(f"✅ {label} ({result['seconds']:.1f}s)")
+            else:
+                print(f"❌ {label}: {result['status'].lstrip('❌ ')}")
+    elapsed = time.perf_counter() - start
+    
+    succeeded = sum(1 for r in results if r["ok"])
+    latencies = [r["seconds"] for r in results if r["seconds"] > 0]
+    print("\n📊 Batch summary")
+    print(f"   Jobs:       {succeeded}/{len(results)} succeeded")
+    print(f"   Wall time:  {elapsed:.1f}s")
+    print(f"   Throughput: {len(results) / elapsed * 60:.1f} jobs/min" if elapsed > 0 else "   Throughput: n/a")
+    if latencies:
+        print(f"   Latency:    p50 {_percentile(latencies, 50):.1f}s, "
+              f"p95 {_percentile(latencies, 95):.1f}s, max {max(latencies):.1f}s")
+    speculation = agent.speculation.stats()
+    if speculation["requests"]:
+        print(f"   Candidates: {agent.candidates} per job, {_rate(speculation['hit_rate'])} with valid code "
+              f"(single-shot {_rate(speculation['single_shot_hit_rate'])}), wins by candidate "
+              f"{speculation['wins_by_candidate']}")
+        if speculation["single_shot_p50_latency"] is not None:
+            print(f"   Speculative p50 {speculation['p50_latency']:.1f}s vs "
+                  f"single-shot p50 {speculation['single_shot_p50_latency']:.1f}s")
+    return 0 if succeeded == len(results) else 1
+
+def main(argv: Optional[List[str]] = None) -> None:
     """Main entry point for the AI Coding Assistant."""
+    args = parse_args(argv)
+    
+    if args.daemon:
+        sys.exit(daemon.serve())
+    if args.stop_daemon:
+        if daemon.stop_daemon():
+            print("⏹️ Agent daemon stopped.")
+            sys.exit(0)
+        print("❌ No agent daemon is running for this directory.")
+        sys.exit(1)
+    
     # Register signal handler for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
     
+    use_cache = False if args.no_cache else None
+    if args.instruction is not None and not args.no_daemon:
+        startup_profile.report()
+        sys.exit(daemon.run_instruction(args.instruction, args.context, args.save, args.run, args.session, use_cache))
+    
+    from agent import CodingAgent
+    from exec_pool import get_execution_pool
+    
+    if args.instruction is not None:
+        with startup_profile.phase("agent"):
+            agent = CodingAgent(use_cache=not args.no_cache, warmup=False, candidates=args.candidates)
+        startup_profile.report()
+        signal.signal(signal.SIGINT, interrupt_handler)
+        try:
+            ok = agent.run_instruction(args.instruction, args.context, args.save, args.run)
+        except KeyboardInterrupt:
+            aborted = time.perf_counter() - telemetry.interrupted_at()
+            print(f"\n⏹️ Cancelled (stopped in {aborted * 1000:.0f} ms)")
+            # 128 + SIGINT, like a shell reports a command stopped with Ctrl+C
+            sys.exit(130)
+        finally:
+            agent.close()
+        sys.exit(0 if ok else 1)
+    
+    if args.batch:
+        # Each job's candidates run side by side
+        candidates = args.candidates or SPECULATIVE_CANDIDATES
+        with startup_profile.phase("agent"):
+            agent = CodingAgent(use_cache=not args.no_cache, pool_size=args.workers * candidates, candidates=candidates)
+        if args.run:
+            with startup_profile.phase("execution pool"):
+                get_execution_pool().start()
+        startup_profile.report()
+        sys.exit(run_batch(agent, args.batch, args.out, args.workers, args.run))
+    
     try:
-        agent = CodingAgent()
-        print("📎 AI Coding Assistant (type 'exit' or 'quit' to quit)\n")
+        with startup_profile.phase("agent"):
+            agent = CodingAgent(use_cache=not args.no_cache, candidates=args.candidates)
+        # Preload heavy imports for running generated scripts while the user types
+        with startup_profile.phase("execution pool"):
+            get_execution_pool().start()
+        with startup_profile.phase("session"):
+            session = agent.new_session()
+        startup_profile.report()
+        print("📎 AI Coding Assistant (type 'new' to start a new conversation, 'exit' or 'quit' to quit)\n")
+        print("   Ctrl+C stops the current generation or script; at the prompt it exits.\n")
+        signal.signal(signal.SIGINT, interrupt_handler)
         
         while True:
             try:
@@ -44,16 +306,26 @@ def main() -> None:
                     print("👋 Goodbye!")
                     break
 
-                # Ask user if they want to provide a file as context
-                use_file = input("Do you want to provide a file for context? (y/n): ").lower().strip()
+                if user_input.lower() == "new":
+                    session.reset()
+                    print("🆕 Started a new conversation.\n")
+                    continue
+
+                # Ask user if they want to provide files as context
+                use_file = input("Do you want to provide files for context? (y/n): ").lower().strip()
                 context_file: Optional[str] = None
                 
                 if use_file == "y":
-                    context_file = input("Enter file path: ").strip()
+                    context_file = input("Enter file paths or glob patterns (comma-separated): ").strip()
                     if not context_file:
                         context_file = None
 
-                agent.handle_instruction(user_input, context_file=context_file)
+                try:
+                    agent.handle_instruction(user_input, context_file=context_file, session=session)
+                except KeyboardInterrupt:
+                    # Ctrl+C during an instruction stops it; the model call and script are gone by now
+                    aborted = time.perf_counter() - telemetry.interrupted_at()
+                    print(f"\n⏹️ Cancelled (stopped in {aborted * 1000:.0f} ms)")
                 print()  # Add spacing between interactions
                 
             except EOFError:
@@ -0,0 +1,173 @@
+import ast
+import difflib
+import re
+from typing import Callable, List, Optional, Tuple
+
+_SEARCH_REPLACE_RE = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.MULTILINE | re.DOTALL
+)
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+class PatchError(ValueError):
+    """Raised when a model's edit cannot be parsed or applied cleanly."""
+
+def parse_search_replace(text: str) -> List[Tuple[str, str]]:
+    """
+    Extract SEARCH/REPLACE blocks:
+
+        <<<<<<< SEARCH
+        old lines
+        =======
+        new lines
+        >>>>>>> REPLACE
+
+    Returns:
+        list: (search, replace) pairs in order
+    """
+    return [(m.group(1), m.group(2)) for m in _SEARCH_REPLACE_RE.finditer(text)]
+
+def _find_block(lines: List[str], block: List[str], hint: Optional[int] = None) -> int:
+    """
+    Locate block in lines, ignoring trailing whitespace.
+
+    Args:
+        hint: Index the block is expected at (a diff hunk's line number); a match
+            there wins over the others
+
+    Returns:
+        Index of the match
+
+    Raises:
+        PatchError: If the block is missing, or ambiguous and not at hint
+    """
+    if not block:
+        return min(max(hint or 0, 0), len(lines))
+    wanted = [line.rstrip() for line in block]
+    stripped = [line.rstrip() for line in lines]
+    n = len(wanted)
+    matches = [i for i in range(len(stripped) - n + 1) if stripped[i:i + n] == wanted]
+    if not matches:
+        raise PatchError(f"could not find the lines to replace: {block[0].strip()!r}")
+    if hint is not None and hint in matches:
+        return hint
+    if len(matches) > 1:
+        raise PatchError(f"lines to replace occur {len(matches)} times: {block[0].strip()!r}")
+    return matches[0]
+
+def apply_search_replace(original: str, blocks: List[Tuple[str, str]]) -> str:
+    """Apply SEARCH/REPLACE blocks in order. An empty SEARCH appends REPLACE to the file."""
+    lines = original.splitlines(keepends=True)
+    for search, replace in blocks:
+        new_lines = replace.splitlines(keepends=True)
+        if not search.strip():
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            lines.extend(new_lines)
+            continue
+        old_lines = search.splitlines(keepends=True)
+        start = _find_block(lines, old_lines)
+        lines[start:start + len(old_lines)] = new_lines
+    return "".join(lines)
+
+def parse_unified_diff(text: str) -> List[Tuple[int, List[str], List[str]]]:
+    """
+    Extract the hunks of a unified diff.
+
+    Returns:
+        list: (old_start, old_lines, new_lines) per hunk, old_start 1-based
+    """
+    hunks = []
+    current: Optional[Tuple[int, List[str], List[str]]] = None
+    for line in text.splitlines(keepends=True):
+        header = _HUNK_RE.match(line)
+        if header:
+            current = (int(header.group(1)), [], [])
+            hunks.append(current)
+            continue
+        if current is None or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+        if line.startswith("```"):
+            current = None
+            continue
+        body = line[1:] if line[:1] in (" ", "-", "+") else line
+        if line.startswith("-"):
+            current[1].append(body)
+        elif line.startswith("+"):
+            current[2].append(body)
+        else:
+            # Context line; models often drop the leading space of blank lines
+            current[1].append(body)
+            current[2].append(body)
+    return hunks
+
+def apply_unified_diff(original: str, hunks: List[Tuple[int, List[str], List[str]]]) -> str:
+    """Apply diff hunks, trusting the lines over the (often wrong) line numbers."""
+    lines = original.splitlines(keepends=True)
+    offset = 0
+    for old_start, old_lines, new_lines in hunks:
+        start = _find_block(lines, old_lines, old_start - 1 + offset)
+        if new_lines and not new_lines[-1].endswith("\n") and start + len(old_lines) < len(lines):
+            new_lines = new_lines[:-1] + [new_lines[-1] + "\n"]
+        lines[start:start + len(old_lines)] = new_lines
+        offset += len(new_lines) - len(old_lines)
+    return "".join(lines)
+
+def apply_edit(original: str, response: str) -> str:
+    """
+    Apply a model's edit, given as SEARCH/REPLACE blocks or a unified diff.
+
+    The result must still parse if the original did.
+
+    Returns:
+        The edited file content
+
+    Raises:
+        PatchError: If no edit is found, it does not apply, or it breaks the syntax
+    """
+    blocks = parse_search_replace(response)
+    if blocks:
+        edited = apply_search_replace(original, blocks)
+    else:
+        hunks = parse_unified_diff(response)
+        if not hunks:
+            raise PatchError("the response contains no SEARCH/REPLACE blocks or diff hunks")
+        edited = apply_unified_diff(original, hunks)
+
+    if edited == original:
+        raise PatchError("the edit does not change the file")
+    try:
+        ast.parse(original)
+    except SyntaxError:
+        return edited
+    try:
+        ast.parse(edited)
+    except SyntaxError as e:
+        raise PatchError(f"the edited code has a syntax error on line {e.lineno}: {e.msg}") from e
+    return edited
+
+def make_patch(original: str, edited: str, filename: str) -> str:
+    """Render the change as a unified diff for display."""
+    return "".join(difflib.unified_diff(
+        original.splitlines(keepends=True), edited.splitlines(keepends=True),
+        fromfile=f"a/{filename}", tofile=f"b/{filename}"
+    ))
+
+def rewrite_changed_lines(original: str, edited: str, rewrite: Callable[[str], str]) -> str:
+    """
+    Apply rewrite to the lines an edit added or changed, keeping the lines it left alone as they were.
+
+    Returns:
+        The edited content with each changed run of lines rewritten
+    """
+    old = original.splitlines(keepends=True)
+    new = edited.splitlines(keepends=True)
+    parts = []
+    for tag, _, _, start, end in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        changed = "".join(new[start:end])
+        parts.append(changed if tag == "equal" else rewrite(changed))
+    return "".join(parts)
+
+def count_changed_lines(patch: str) -> int:
+    """Number of added and removed lines in a unified diff."""
+    return sum(1 for line in patch.splitlines() if line[:1] in "+-" and line[:3] not in ("+++", "---"))
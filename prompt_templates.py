@@ -13,3 +13,51 @@ Instruction: {instruction}
 
 Generate the Python code now:
 """
+
+# Later turns of a session whose earlier turns Ollama still holds as context
+SESSION_FOLLOWUP_PROMPT = """Follow-up instruction: {instruction}
+
+Apply it to the code from your previous answer. Follow the same rules and return the complete updated Python code only.
+"""
+
+# Instruction used to restart a session whose model context was dropped; rendered into SYSTEM_PROMPT
+SESSION_RESUME_PROMPT = """{summary}The current code is:
+```python
+{code}
+```
+
+Now: {instruction}"""
+
+# Edit mode: ask for the changes only instead of regenerating a whole file
+EDIT_PROMPT = """You are a skilled AI Python assistant that edits existing code.
+
+Your task is to change the code below as instructed, returning ONLY the edits.
+
+Rules:
+1. Describe each change as a SEARCH/REPLACE block:
+<<<<<<< SEARCH
+exact existing lines, including indentation
+=======
+the new lines
+>>>>>>> REPLACE
+2. SEARCH must copy enough existing lines to be unique in the file; keep blocks small
+3. Use several blocks for changes in different places; an empty SEARCH appends to the end of the file
+4. Do NOT repeat unchanged code outside the blocks and do NOT add explanations
+
+{instruction}
+
+Return the SEARCH/REPLACE blocks now:
+"""
+
+# Repair round: the code failed static checks; {instruction} carries the request, the code and the problems
+REPAIR_PROMPT = """You are a skilled AI Python assistant fixing generated code that fails static checks.
+
+Rules:
+1. Return ONLY the complete corrected Python code - no explanations, no markdown formatting
+2. Fix every problem listed below and keep everything else unchanged
+3. Do NOT remove requested functionality to make a problem go away
+
+{instruction}
+
+Return the corrected Python code now:
+"""
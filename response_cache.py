@@ -0,0 +1,188 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import CACHE_PATH, CACHE_MEMORY_ENTRIES, CACHE_DISK_ENTRIES, CACHE_TTL_SECONDS
+
+def make_cache_key(model: str, full_prompt: str, context_digest: str = "",
+                   settings: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the cache key for a model call.
+
+    Args:
+        model: Ollama model name
+        full_prompt: The fully rendered SYSTEM_PROMPT sent to the model
+        context_digest: Hash of the context file content, if any
+        settings: Anything else that changes the answer, e.g. generation options
+            and how the response is post-processed (must be JSON-serializable)
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    h = hashlib.sha256()
+    for part in (model, full_prompt, context_digest, json.dumps(settings or {}, sort_keys=True)):
+        data = part.encode("utf-8", errors="replace")
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+def content_digest(content: str) -> str:
+    """Hash file content for use in cache keys."""
+    if not content:
+        return ""
+    return hashlib.sha256(content.encode("utf-8", errors="replace")).hexdigest()
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses: an in-memory LRU in front of a SQLite file.
+
+    Entries older than ttl_seconds are ignored and purged (0 disables expiry).
+    Each tier is trimmed to its own size limit, least recently used first.
+    """
+
+    def __init__(self, path: Optional[str] = CACHE_PATH, memory_entries: int = CACHE_MEMORY_ENTRIES,
+                 disk_entries: int = CACHE_DISK_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS):
+        """
+        Args:
+            path: SQLite file for the persistent tier, or None for memory only
+            memory_entries: Maximum number of entries kept in memory
+            disk_entries: Maximum number of entries kept on disk
+            ttl_seconds: Entry lifetime in seconds, 0 to keep entries forever
+        """
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._counters: Dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Warning: Response cache disabled on disk ({path}): {e}")
+                self._db = None
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        """Insert into the memory tier, evicting the least recently used entries. Lock must be held."""
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value, created FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        value, created = row
+                        if not self._expired(created, now):
+                            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                            self._db.commit()
+                            self._remember(key, created, value)
+                            self._counters["disk_hits"] += 1
+                            return value
+                        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self._db.commit()
+                except sqlite3.Error:
+                    pass
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        """Store a response in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self._counters["stores"] += 1
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._trim_disk(now)
+                self._db.commit()
+            except sqlite3.Error:
+                pass
+
+    def _trim_disk(self, now: float) -> None:
+        """Drop expired rows and keep at most disk_entries rows. Lock must be held."""
+        if self.ttl_seconds > 0:
+            cursor = self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+            self._counters["evictions"] += max(cursor.rowcount, 0)
+        cursor = self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,)
+        )
+        self._counters["evictions"] += max(cursor.rowcount, 0)
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM responses")
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            stats["memory_size"] = len(self._memory)
+            stats["disk_size"] = 0
+            if self._db is not None:
+                try:
+                    stats["disk_size"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            return stats
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,137 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import SESSION_MAX_TURNS, SESSION_MAX_CONTEXT_TOKENS
+from file_ops import clean_code
+from prompt_templates import SYSTEM_PROMPT, SESSION_FOLLOWUP_PROMPT, SESSION_RESUME_PROMPT
+
+# Longest instruction kept verbatim in the rolling summary
+SUMMARY_INSTRUCTION_CHARS = 200
+
+# Number of instructions the rolling summary remembers
+SUMMARY_ITEMS = 20
+
+class Session:
+    """
+    Conversation state for iterative refinement ("now add error handling").
+
+    After each turn Ollama returns its context, the tokens of the conversation
+    so far. Sending that context with the next turn means only the new
+    instruction is evaluated; the system prompt, the context files and the
+    previous code are not sent again. History is bounded. When the context grows past
+    max_context_tokens, or no context is available (CLI backend, cached
+    answer), the next turn restarts from a rolling summary of earlier
+    instructions and the latest code.
+    """
+
+    def __init__(self, max_turns: int = SESSION_MAX_TURNS,
+                 max_context_tokens: int = SESSION_MAX_CONTEXT_TOKENS):
+        """
+        Args:
+            max_turns: Turns kept verbatim; older instructions move into the summary
+            max_context_tokens: Largest model context carried into the next turn
+        """
+        self.max_turns = max_turns
+        self.max_context_tokens = max_context_tokens
+        self.turns: Deque[Tuple[str, str]] = deque()
+        self.summary: Deque[str] = deque(maxlen=SUMMARY_ITEMS)
+        self.context: Optional[List[int]] = None
+        self.last_prompt_tokens: Optional[int] = None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "turns": 0,
+            "continued": 0,
+            "resumed": 0,
+            "context_resets": 0,
+            "prompt_tokens": 0,
+        }
+
+    def render(self, instruction: str, prompt: str, continuation: bool = True) -> Tuple[str, Dict[str, Any]]:
+        """
+        Build the model input for the next turn.
+
+        Args:
+            instruction: The user's instruction as typed
+            prompt: The prepared prompt (instruction plus any context files)
+            continuation: Whether the backend accepts Ollama's context
+
+        Returns:
+            tuple: (full_prompt, extra /api/generate fields)
+        """
+        with self._lock:
+            if continuation and self.context:
+                return SESSION_FOLLOWUP_PROMPT.format(instruction=prompt), {"context": list(self.context)}
+            if not self.turns:
+                return SYSTEM_PROMPT.format(instruction=prompt), {}
+            summary = "".join(f"- {item}\n" for item in list(self.summary) + [i for i, _ in self.turns])
+            summary = f"Earlier requests in this conversation:\n{summary}\n"
+            code = clean_code(self.turns[-1][1])
+            resume = SESSION_RESUME_PROMPT.format(summary=summary, code=code, instruction=prompt)
+            return SYSTEM_PROMPT.format(instruction=resume), {}
+
+    def record(self, instruction: str, response: str, final: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Store a finished turn.
+
+        Args:
+            instruction: The user's instruction as typed
+            response: The model's answer
+            final: The last /api/generate message, carrying `context` and token counts
+        """
+        final = final or {}
+        with self._lock:
+            self._counters["turns"] += 1
+            if self.context:
+                self._counters["continued"] += 1
+            elif self.turns:
+                self._counters["resumed"] += 1
+
+            self.turns.append((self._shorten(instruction), response))
+            while len(self.turns) > self.max_turns:
+                self.summary.append(self.turns.popleft()[0])
+
+            self.last_prompt_tokens = final.get("prompt_eval_count")
+            if isinstance(self.last_prompt_tokens, int):
+                self._counters["prompt_tokens"] += self.last_prompt_tokens
+            context = final.get("context")
+            if context and len(context) <= self.max_context_tokens:
+                self.context = context
+            else:
+                if context:
+                    self._counters["context_resets"] += 1
+                self.context = None
+
+    def amend(self, response: str) -> None:
+        """
+        Replace the last turn's answer, e.g. with a repaired version.
+
+        Ollama's context still holds the old answer, so it is dropped and the
+        next turn resumes from the summary and the amended code.
+        """
+        with self._lock:
+            if self.turns:
+                self.turns[-1] = (self.turns[-1][0], response)
+                self.context = None
+
+    @staticmethod
+    def _shorten(instruction: str) -> str:
+        instruction = " ".join(instruction.split())
+        if len(instruction) > SUMMARY_INSTRUCTION_CHARS:
+            return instruction[:SUMMARY_INSTRUCTION_CHARS - 3] + "..."
+        return instruction
+
+    def reset(self) -> None:
+        """Forget the conversation and start over."""
+        with self._lock:
+            self.turns.clear()
+            self.summary.clear()
+            self.context = None
+            self.last_prompt_tokens = None
+
+    def stats(self) -> Dict[str, int]:
+        """Return turn counters, tokens evaluated and the size of the carried context."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["context_tokens"] = len(self.context) if self.context else 0
+            return stats
@@ -0,0 +1,120 @@
+import random
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import SPECULATIVE_TEMPERATURES
+from validation import ValidationReport
+
+def candidate_options(count: int, temperatures: List[float] = SPECULATIVE_TEMPERATURES,
+                      seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Ollama `options` for each of count candidate generations.
+
+    Candidate 0 keeps the model's defaults, so it is exactly what a
+    single-shot request would have produced; the others get their own seed
+    and a temperature from the list, cycling through it.
+    """
+    base = random.randrange(1 << 30) if seed is None else seed
+    options: List[Dict[str, Any]] = [{}]
+    for i in range(1, count):
+        options.append({"temperature": temperatures[(i - 1) % len(temperatures)], "seed": base + i})
+    return options
+
+class SpeculationReport:
+    """How one speculative request went."""
+
+    def __init__(self, candidates: int):
+        self.candidates = candidates
+        self.winner: Optional[int] = None
+        self.latency: Optional[float] = None
+        self.finished = 0
+        self.valid = 0
+        # Whether candidate 0, i.e. single-shot generation, produced valid code;
+        # None when it was cancelled before finishing
+        self.baseline_valid: Optional[bool] = None
+        self.baseline_latency: Optional[float] = None
+
+    @property
+    def hit(self) -> bool:
+        """A candidate passed the checks."""
+        return self.valid > 0
+
+    def summary(self) -> str:
+        if self.winner is None:
+            return f"no usable candidate out of {self.candidates}"
+        text = f"candidate {self.winner + 1} of {self.candidates} in {self.latency:.1f}s"
+        if not self.hit:
+            text += ", none passed the checks"
+        return text
+
+class CandidatePicker:
+    """Chooses among finished candidates: the first valid one, else the one with the fewest errors."""
+
+    def __init__(self, candidates: int):
+        self.report = SpeculationReport(candidates)
+        self.best: Optional[Tuple[str, Dict[str, Any]]] = None
+        self._best_errors = 0
+
+    def offer(self, index: int, text: str, validation: ValidationReport, final: Dict[str, Any],
+              elapsed: float) -> bool:
+        """
+        Consider a finished candidate.
+
+        Returns:
+            True if it is valid, so the remaining candidates can be cancelled
+        """
+        report = self.report
+        report.finished += 1
+        if index == 0:
+            report.baseline_valid = validation.ok
+            report.baseline_latency = elapsed
+        if validation.ok:
+            report.valid += 1
+        if self.best is None or len(validation.errors) < self._best_errors:
+            self.best, self._best_errors = (text, final), len(validation.errors)
+            report.winner, report.latency = index, elapsed
+        return validation.ok
+
+class SpeculationStats:
+    """
+    Totals over speculative requests, compared with single-shot generation.
+
+    The single-shot hit rate counts only requests whose candidate 0 ran to
+    completion; it is cancelled whenever another candidate wins first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.baseline_runs = 0
+        self.baseline_hits = 0
+        self.latencies: List[float] = []
+        self.baseline_latencies: List[float] = []
+        self.wins: Dict[int, int] = {}
+
+    def record(self, report: SpeculationReport) -> None:
+        with self._lock:
+            self.requests += 1
+            self.hits += report.hit
+            if report.winner is not None:
+                self.wins[report.winner] = self.wins.get(report.winner, 0) + 1
+                self.latencies.append(report.latency)
+            if report.baseline_valid is not None:
+                self.baseline_runs += 1
+                self.baseline_hits += report.baseline_valid
+                self.baseline_latencies.append(report.baseline_latency)
+
+    def stats(self) -> Dict[str, Any]:
+        def median(values: List[float]) -> Optional[float]:
+            return sorted(values)[len(values) // 2] if values else None
+
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hit_rate": self.hits / self.requests if self.requests else None,
+                "single_shot_hit_rate": self.baseline_hits / self.baseline_runs if self.baseline_runs else None,
+                "p50_latency": median(self.latencies),
+                "single_shot_p50_latency": median(self.baseline_latencies),
+                "wins_by_candidate": dict(sorted(self.wins.items())),
+            }
@@ -0,0 +1,143 @@
+"""
+Startup profiler for `main.py --profile-startup`.
+
+Times every module imported after install() and named init phases such as
+building the agent, then prints where the time to the first prompt went.
+Only the standard library is used, so it can be installed before anything
+else is imported.
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+class _TimedLoader:
+    """Wraps a module loader to time executing the module's body."""
+
+    def __init__(self, loader: Any, profiler: "StartupProfiler"):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._loader, name)
+
+    def create_module(self, spec: Any) -> Any:
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module: Any) -> None:
+        self._profiler._exec(self._loader, module)
+
+class StartupProfiler:
+    """
+    Import hook recording the import time of each module.
+
+    Like `python -X importtime`, each module gets its own time and the
+    cumulative time including the modules it imported.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports: List[Dict[str, Any]] = []
+        self.phases: List[tuple[str, float]] = []
+        self._local = threading.local()
+
+    def find_spec(self, fullname: str, path: Any, target: Any = None) -> Any:
+        """Find the module with the other finders and wrap its loader."""
+        if getattr(self._local, "finding", False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                find_spec = getattr(finder, "find_spec", None)
+                if finder is self or find_spec is None:
+                    continue
+                spec = find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def _exec(self, loader: Any, module: Any) -> None:
+        stack = self._local.__dict__.setdefault("stack", [])
+        entry = {"module": module.__name__, "depth": len(stack), "children": 0.0}
+        stack.append(entry)
+        start = time.perf_counter()
+        try:
+            loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1]["children"] += total
+            entry["total"] = total
+            entry["self"] = total - entry.pop("children")
+            self.imports.append(entry)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time an init step, e.g. building the agent."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, file: Optional[TextIO] = None, limit: int = 25) -> None:
+        """
+        Print the slowest imports and every init phase.
+
+        Args:
+            file: Where to print (defaults to stderr, so it does not mix with program output)
+            limit: Number of modules listed
+        """
+        file = file or sys.stderr
+        elapsed = time.perf_counter() - self.started
+        top_level = sum(entry["total"] for entry in self.imports if entry["depth"] == 0)
+        print(f"⏱️ Startup profile: {elapsed * 1000:.1f} ms until ready", file=file)
+        print(f"   Imports: {top_level * 1000:.1f} ms for {len(self.imports)} modules "
+              f"(slowest {min(limit, len(self.imports))} by own time)", file=file)
+        print(f"   {'self ms':>9} {'total ms':>9}  module", file=file)
+        for entry in sorted(self.imports, key=lambda item: item["self"], reverse=True)[:limit]:
+            print(f"   {entry['self'] * 1000:9.2f} {entry['total'] * 1000:9.2f}  {entry['module']}", file=file)
+        if self.phases:
+            print("   Init:", file=file)
+            for name, seconds in self.phases:
+                print(f"   {seconds * 1000:9.2f} ms  {name}", file=file)
+
+# The installed profiler, if any
+profiler: Optional[StartupProfiler] = None
+
+def install() -> StartupProfiler:
+    """Start timing imports; modules imported before this call are not seen."""
+    global profiler
+    if profiler is None:
+        profiler = StartupProfiler()
+        sys.meta_path.insert(0, profiler)
+    return profiler
+
+def uninstall() -> None:
+    """Stop timing imports, keeping what was recorded."""
+    if profiler is not None and profiler in sys.meta_path:
+        sys.meta_path.remove(profiler)
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time an init step when profiling; does nothing otherwise."""
+    if profiler is None:
+        yield
+        return
+    with profiler.phase(name):
+        yield
+
+def report() -> None:
+    """Print the profile and stop timing imports; does nothing when not profiling."""
+    if profiler is None:
+        return
+    uninstall()
+    profiler.report()
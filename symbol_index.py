@@ -0,0 +1,364 @@
+import ast
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from config import SYMBOL_INDEX_PATH, CONTEXT_TOKEN_BUDGET
+
+# Directories never worth indexing
+SKIP_DIRS = {"__pycache__", "venv", "env", "node_modules", "site-packages", "build", "dist"}
+
+# Files larger than this are not parsed
+MAX_INDEXED_BYTES = 2 * 1024 * 1024
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9]*")
+_CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z0-9]+")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of text (about four characters per token for code and English)."""
+    return (len(text) + 3) // 4
+
+def _terms(text: str) -> Set[str]:
+    """Lower-case words of text, with snake_case and CamelCase identifiers split into parts."""
+    terms = set()
+    for word in _WORD_RE.findall(text.replace("_", " ")):
+        terms.add(word.lower())
+        terms.update(part.lower() for part in _CAMEL_RE.findall(word))
+    return {t for t in terms if len(t) > 1}
+
+def _called_name(node: ast.Call) -> Optional[str]:
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+def parse_source(source: str) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+    """
+    Extract the definitions, imports and call references of a Python module.
+
+    Returns:
+        tuple: (symbols, imports, refs) where symbols are
+        (qualname, name, kind, lineno, end_lineno, doc), imports are
+        (name, module, lineno, end_lineno) and refs are (caller_qualname, callee_name)
+
+    Raises:
+        SyntaxError: If the source does not parse
+    """
+    tree = ast.parse(source)
+    symbols: List[tuple] = []
+    imports: List[tuple] = []
+    refs: Set[tuple] = set()
+
+    def visit(node: ast.AST, prefix: str, in_class: bool) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = prefix + child.name
+                if isinstance(child, ast.ClassDef):
+                    kind = "class"
+                else:
+                    kind = "method" if in_class else "function"
+                start = min([child.lineno] + [d.lineno for d in child.decorator_list])
+                doc = (ast.get_docstring(child) or "").strip().split("\n")[0]
+                symbols.append((qualname, child.name, kind, start, child.end_lineno or child.lineno, doc))
+                if kind != "class":
+                    for sub in ast.walk(child):
+                        if isinstance(sub, ast.Call):
+                            callee = _called_name(sub)
+                            if callee and callee != child.name:
+                                refs.add((qualname, callee))
+                    # Nested functions are part of their parent's source
+                    continue
+                visit(child, qualname + ".", True)
+            elif isinstance(child, (ast.Import, ast.ImportFrom)) and not prefix:
+                module = getattr(child, "module", None) or ""
+                for alias in child.names:
+                    name = alias.asname or alias.name.split(".")[0]
+                    full = f"{module}.{alias.name}" if module else alias.name
+                    # Imports nested in module-level blocks resolve names but are not shown
+                    lineno = child.lineno if node is tree else 0
+                    imports.append((name, full, lineno, (child.end_lineno or child.lineno) if lineno else 0))
+            elif not prefix:
+                visit(child, prefix, in_class)
+
+    visit(tree, "", False)
+    return symbols, imports, sorted(refs)
+
+class SymbolIndex:
+    """
+    Persistent AST index of the Python files under a directory.
+
+    Records every function, class and method with its line span, module-level
+    imports, and which names each definition calls. refresh() re-parses only
+    files whose (mtime, size) changed and whose content hash differs, so
+    keeping the index current costs one stat per file. select() uses the
+    index to pick the definitions relevant to an instruction within a token
+    budget, instead of pasting whole files into the prompt.
+    """
+
+    def __init__(self, root: str = ".", path: Optional[str] = SYMBOL_INDEX_PATH):
+        """
+        Args:
+            root: Directory to index
+            path: SQLite file for the index, relative to root, or None to keep it in memory
+        """
+        self.root = Path(root).resolve()
+        self.path = path
+        self._lock = threading.Lock()
+        location = ":memory:"
+        if path:
+            location = str(path if os.path.isabs(path) else self.root / path)
+        try:
+            self._db = sqlite3.connect(location, check_same_thread=False, timeout=5)
+            self._create_tables()
+        except sqlite3.Error as e:
+            print(f"⚠️ Warning: Symbol index kept in memory ({location}): {e}")
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+            self._create_tables()
+
+    def _create_tables(self) -> None:
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, hash TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS symbols ("
+            "path TEXT NOT NULL, qualname TEXT NOT NULL, name TEXT NOT NULL, kind TEXT NOT NULL, "
+            "lineno INTEGER NOT NULL, end_lineno INTEGER NOT NULL, doc TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS imports ("
+            "path TEXT NOT NULL, name TEXT NOT NULL, module TEXT NOT NULL, "
+            "lineno INTEGER NOT NULL, end_lineno INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS refs ("
+            "path TEXT NOT NULL, caller TEXT NOT NULL, callee TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS symbols_path ON symbols(path);"
+            "CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);"
+            "CREATE INDEX IF NOT EXISTS imports_path ON imports(path);"
+            "CREATE INDEX IF NOT EXISTS refs_path ON refs(path);"
+            "CREATE INDEX IF NOT EXISTS refs_callee ON refs(callee);"
+        )
+        self._db.commit()
+
+    def _python_files(self) -> Iterator[Tuple[str, os.stat_result]]:
+        """Yield (relative path, stat) for every indexable .py file under root."""
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS:
+                            stack.append(Path(entry.path))
+                    elif entry.name.endswith(".py") and entry.is_file():
+                        info = entry.stat()
+                        if info.st_size <= MAX_INDEXED_BYTES:
+                            yield Path(entry.path).relative_to(self.root).as_posix(), info
+                except OSError:
+                    continue
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Bring the index up to date with the files on disk.
+
+        Returns:
+            Counts of files scanned, parsed and removed
+        """
+        counts = {"scanned": 0, "parsed": 0, "removed": 0}
+        with self._lock:
+            known = {row[0]: (row[1], row[2], row[3])
+                     for row in self._db.execute("SELECT path, mtime, size, hash FROM files")}
+            seen = set()
+            for rel, info in self._python_files():
+                counts["scanned"] += 1
+                seen.add(rel)
+                previous = known.get(rel)
+                if previous and previous[0] == info.st_mtime and previous[1] == info.st_size:
+                    continue
+                if self._index_file(rel, info, previous[2] if previous else None):
+                    counts["parsed"] += 1
+            for rel in set(known) - seen:
+                self._forget(rel)
+                self._db.execute("DELETE FROM files WHERE path = ?", (rel,))
+                counts["removed"] += 1
+            self._db.commit()
+        return counts
+
+    def _forget(self, rel: str) -> None:
+        for table in ("symbols", "imports", "refs"):
+            self._db.execute(f"DELETE FROM {table} WHERE path = ?", (rel,))
+
+    def _index_file(self, rel: str, info: os.stat_result, old_hash: Optional[str]) -> bool:
+        """Re-index one file if its content changed. Lock must be held. Returns True if it was parsed."""
+        try:
+            data = (self.root / rel).read_bytes()
+        except OSError:
+            return False
+        digest = hashlib.sha1(data).hexdigest()
+        self._db.execute(
+            "INSERT OR REPLACE INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+            (rel, info.st_mtime, info.st_size, digest)
+        )
+        if digest == old_hash:
+            return False
+        self._forget(rel)
+        try:
+            symbols, imports, refs = parse_source(data.decode("utf-8", errors="replace"))
+        except (SyntaxError, ValueError):
+            # Keep the file row so an unchanged broken file is not re-parsed every refresh
+            return True
+        self._db.executemany(
+            "INSERT INTO symbols (path, qualname, name, kind, lineno, end_lineno, doc) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(rel,) + s for s in symbols]
+        )
+        self._db.executemany("INSERT INTO imports (path, name, module, lineno, end_lineno) VALUES (?, ?, ?, ?, ?)",
+                             [(rel,) + i for i in imports])
+        self._db.executemany("INSERT INTO refs (path, caller, callee) VALUES (?, ?, ?)",
+                             [(rel,) + r for r in refs])
+        return True
+
+    def _relative(self, filepath: str) -> Optional[str]:
+        path = Path(filepath)
+        if not path.is_absolute():
+            path = Path.cwd() / path
+        try:
+            return path.resolve().relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+
+    def _score(self, instruction: str, focus: Set[str]) -> Dict[Tuple[str, str], float]:
+        """Score every symbol by overlap with the instruction, then spread score along call references."""
+        wanted = _terms(instruction)
+        words = {w.lower() for w in _WORD_RE.findall(instruction)}
+        symbols = {}
+        scores: Dict[Tuple[str, str], float] = {}
+        for path, qualname, name, doc in self._db.execute("SELECT path, qualname, name, doc FROM symbols"):
+            key = (path, qualname)
+            symbols.setdefault(name, []).append(key)
+            score = 3.0 if name.lower() in words else 0.0
+            score += len(_terms(name) & wanted)
+            score += 0.5 * len(_terms(doc) & wanted)
+            if score and path in focus:
+                score += 1.0
+            if score:
+                scores[key] = score
+
+        # Definitions called by a relevant symbol are likely needed too: resolve each
+        # callee to the same file, else to the module it was imported from
+        seeds = sorted(scores.items(), key=lambda item: -item[1])
+        for (path, qualname), score in seeds:
+            imported = dict(self._db.execute("SELECT name, module FROM imports WHERE path = ?", (path,)))
+            for (callee,) in self._db.execute(
+                "SELECT callee FROM refs WHERE path = ? AND caller = ?", (path, qualname)
+            ):
+                targets = symbols.get(callee, [])
+                resolved = [t for t in targets if t[0] == path]
+                if not resolved and callee in imported:
+                    resolved = [t for t in targets
+                                if imported[callee].startswith(t[0][:-3].replace("/", ".") + ".")]
+                for target in resolved:
+                    scores[target] = max(scores.get(target, 0.0), score * 0.5)
+        return scores
+
+    def select(self, instruction: str, context_files: Sequence[str] = (),
+               budget_tokens: int = CONTEXT_TOKEN_BUDGET) -> str:
+        """
+        Return the source of the definitions most relevant to instruction.
+
+        Args:
+            instruction: The user's request
+            context_files: Files the user pointed at; their definitions are preferred and,
+                if nothing matches, their top-level definitions are used in order
+            budget_tokens: Maximum estimated tokens of the returned context
+
+        Returns:
+            Definitions grouped per file with their imports, or "" if nothing fits
+        """
+        self.refresh()
+        focus = {rel for rel in map(self._relative, context_files) if rel}
+        with self._lock:
+            scores = self._score(instruction, focus)
+            if not scores:
+                for path in focus:
+                    rows = self._db.execute(
+                        "SELECT qualname FROM symbols WHERE path = ? AND kind != 'method' ORDER BY lineno", (path,)
+                    ).fetchall()
+                    scores.update({(path, q): 1.0 / (i + 1) for i, (q,) in enumerate(rows)})
+            spans: Dict[Tuple[str, str], Tuple[str, int, int]] = {}
+            members: Dict[Tuple[str, str], List[int]] = {}
+            for path, qualname, kind, lineno, end_lineno in self._db.execute(
+                "SELECT path, qualname, kind, lineno, end_lineno FROM symbols"
+            ):
+                spans[(path, qualname)] = (kind, lineno, end_lineno)
+                if "." in qualname:
+                    members.setdefault((path, qualname.rsplit(".", 1)[0]), []).append(lineno)
+            imports: Dict[str, Set[Tuple[int, int]]] = {}
+            for path, lineno, end_lineno in self._db.execute(
+                "SELECT path, lineno, end_lineno FROM imports WHERE lineno > 0"
+            ):
+                imports.setdefault(path, set()).add((lineno, end_lineno))
+
+        def import_lines(path: str, lines: List[str]) -> List[str]:
+            return [line for start, end in sorted(imports.get(path, ())) for line in lines[start - 1:end]]
+
+        ranked = sorted(scores, key=lambda key: (-scores[key], key[0] not in focus, key))
+        lines_cache: Dict[str, List[str]] = {}
+        chosen: Dict[str, List[Tuple[int, str]]] = {}
+        used = 0
+        for path, qualname in ranked:
+            kind, lineno, end_lineno = spans[(path, qualname)]
+            if path not in lines_cache:
+                try:
+                    lines_cache[path] = (self.root / path).read_text(encoding="utf-8", errors="replace").splitlines()
+                except OSError:
+                    continue
+            lines = lines_cache[path]
+            nested = sorted(members.get((path, qualname), []))
+            if kind == "class" and nested:
+                # Classes are outlined (header, docstring, attributes, method signatures);
+                # the methods that matter are selected on their own
+                body = lines[lineno - 1:nested[0] - 1]
+                body += [lines[n - 1].rstrip() + " ..." for n in nested if n <= len(lines)]
+                snippet = "\n".join(body)
+            else:
+                snippet = "\n".join(lines[lineno - 1:end_lineno])
+            if kind == "method":
+                owner = qualname.rsplit(".", 1)[0].rsplit(".", 1)[-1]
+                snippet = f"class {owner}:  # excerpt\n{snippet}"
+            header = ""
+            if path not in chosen:
+                header = "\n".join([f"# File: {path}"] + import_lines(path, lines)) + "\n"
+            cost = estimate_tokens(header + snippet) + 1
+            if used + cost > budget_tokens:
+                continue
+            used += cost
+            chosen.setdefault(path, []).append((lineno, snippet))
+
+        parts = []
+        for path in sorted(chosen, key=lambda p: (p not in focus, p)):
+            lines = lines_cache[path]
+            block = [f"# File: {path}"]
+            block += import_lines(path, lines)
+            for _, snippet in sorted(chosen[path]):
+                block.append("")
+                block.append(snippet)
+            parts.append("\n".join(block))
+        return "\n\n".join(parts)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of indexed files, symbols, imports and references."""
+        with self._lock:
+            return {table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("files", "symbols", "imports", "refs")}
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,445 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from config import TRACE_LOG_PATH, TRACE_LOG_MAX_MB
+
+# Histogram upper bounds in seconds, from sub-millisecond local steps to long generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   120.0, 300.0)
+# Histogram upper bounds for generation speed in tokens per second
+TOKEN_RATE_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0, 320.0)
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+# Code object flags telling generators and coroutines apart (inspect.CO_*), read
+# directly because importing inspect costs more than the rest of this module
+_CO_GENERATOR = 0x20
+_CO_COROUTINE = 0x80
+_CO_ASYNC_GENERATOR = 0x200
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("trace", default=None)
+
+def outcome(status_message: str) -> str:
+    """Map a status message to a trace status: "ok", "cancelled" or "error"."""
+    if status_message.startswith("✅"):
+        return "ok"
+    if status_message.startswith("⏹️"):
+        return "cancelled"
+    return "error"
+
+class Trace:
+    """
+    Timing spans of one request.
+
+    Spans are measured relative to the start of the trace and may overlap,
+    e.g. the model call contains its time to first token. Spans can be added
+    from any thread; threads and asyncio tasks started while the trace is
+    current (see request()) inherit it through a context variable.
+    """
+
+    def __init__(self, operation: str, **attributes: Any):
+        """
+        Args:
+            operation: What the request does, e.g. "generate" or "ui.run"
+            attributes: Extra fields written with the trace
+        """
+        self.id = os.urandom(8).hex()
+        self.operation = operation
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.status = "ok"
+        self.started_at = time.time()
+        self.seconds: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def add(self, name: str, seconds: float, ago: float = 0.0, **attributes: Any) -> None:
+        """Record a span that lasted seconds and ended ago seconds before now."""
+        span = {"name": name, "start": max(self.elapsed() - ago - seconds, 0.0), "seconds": seconds}
+        span.update(attributes)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block; the yielded dict takes further attributes."""
+        began = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.add(name, time.perf_counter() - began, **attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        return {
+            "trace_id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "started_at": self.started_at,
+            "seconds": self.seconds if self.seconds is not None else self.elapsed(),
+            "attributes": self.attributes,
+            "spans": spans,
+        }
+
+class Histogram:
+    """Cumulative Prometheus-style histogram."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+def _format_labels(labels: _Labels, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metrics:
+    """Counters and histograms exported in the Prometheus text format."""
+
+    def __init__(self, prefix: str = "coding_agent_"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help: Dict[str, str] = {}
+        self._counters: Dict[str, Dict[_Labels, float]] = {}
+        self._histograms: Dict[str, Dict[_Labels, Histogram]] = {}
+
+    def describe(self, name: str, text: str) -> None:
+        """Set the HELP text of a metric."""
+        with self._lock:
+            self._help[name] = text
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels: Any) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full = self.prefix + name
+                lines += [f"# HELP {full} {self._help.get(name, name)}", f"# TYPE {full} counter"]
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                full = self.prefix + name
+                lines += [f"# HELP {full} {self._help.get(name, name)}", f"# TYPE {full} histogram"]
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket = _format_labels(labels, 'le="%g"' % bound)
+                        lines.append(f"{full}_bucket{bucket} {count}")
+                    bucket = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f"{full}_bucket{bucket} {histogram.count}")
+                    lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+class TraceLog:
+    """Appends finished traces to a JSONL file, rotating it to <path>.1 past max_bytes."""
+
+    def __init__(self, path: str = TRACE_LOG_PATH, max_bytes: int = TRACE_LOG_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def write(self, trace: Trace) -> None:
+        if not self.path or self._failed:
+            return
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() > self.max_bytes:
+                    self._file.close()
+                    self._file = None
+                    os.replace(self.path, self.path + ".1")
+            except OSError as e:
+                self._failed = True
+                print(f"⚠️ Warning: Could not write trace log {self.path} ({e}). Tracing to file disabled.")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+metrics = Metrics()
+metrics.describe("requests_total", "Finished requests by operation and status.")
+metrics.describe("request_seconds", "Wall time of finished requests.")
+metrics.describe("span_seconds", "Duration of request steps (prompt, model, ttft, clean_code, save, ...).")
+metrics.describe("ollama_prompt_tokens_total", "Prompt tokens evaluated, as reported by Ollama.")
+metrics.describe("ollama_generated_tokens_total", "Tokens generated, as reported by Ollama.")
+metrics.describe("ollama_prompt_eval_seconds_total", "Prompt evaluation time reported by Ollama.")
+metrics.describe("ollama_eval_seconds_total", "Generation time reported by Ollama.")
+metrics.describe("ollama_tokens_per_second", "Generation speed reported by Ollama.")
+metrics.describe("extract_chatter_tokens_total", "Estimated tokens of fences and chatter dropped from around generated code.")
+metrics.describe("extract_early_stops_total", "Generations stopped as soon as their code block closed.")
+metrics.describe("history_lookups_total", "Generation history lookups, by whether a similar earlier answer was found.")
+trace_log = TraceLog()
+
+# perf_counter() when Ctrl+C was last pressed, see interrupted()
+_interrupted_at: Optional[float] = None
+
+def interrupted() -> None:
+    """
+    Note that Ctrl+C was pressed, from a SIGINT handler about to raise KeyboardInterrupt.
+
+    The request the interrupt stops gets an "abort" span: the time from the
+    key press until its cleanup (closing model streams, killing processes) is done.
+    """
+    global _interrupted_at
+    _interrupted_at = time.perf_counter()
+
+def interrupted_at() -> float:
+    """perf_counter() of the last interrupted() call (now if there was none)."""
+    return _interrupted_at if _interrupted_at is not None else time.perf_counter()
+
+def current() -> Optional[Trace]:
+    """The trace of the request running in this context, if any."""
+    return _current.get()
+
+def record(name: str, seconds: float, **attributes: Any) -> None:
+    """Add a span that just ended to the current trace (no-op outside a request)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds, **attributes)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """Time the enclosed block as a span of the current trace (no-op outside a request)."""
+    trace = _current.get()
+    if trace is None:
+        yield attributes
+        return
+    with trace.span(name, **attributes) as fields:
+        yield fields
+
+def record_model(final: Dict[str, Any], ttft: Optional[float] = None) -> None:
+    """
+    Add the timings Ollama reports in its final message to the current trace.
+
+    Args:
+        final: Last /api/generate or /api/chat message (durations in nanoseconds)
+        ttft: Seconds from sending the request to the first token, when streamed;
+            what it leaves after model loading and prompt evaluation is time spent
+            waiting in the server's queue and on the network
+    """
+    trace = _current.get()
+    if trace is None:
+        return
+    load = final.get("load_duration", 0) / 1e9
+    prompt_eval = final.get("prompt_eval_duration", 0) / 1e9
+    evaluation = final.get("eval_duration", 0) / 1e9
+    prompt_tokens = final.get("prompt_eval_count", 0)
+    tokens = final.get("eval_count", 0)
+    # Ollama runs these back to back, ending with the final message
+    trace.add("eval", evaluation, tokens=tokens,
+              tokens_per_second=round(tokens / evaluation, 2) if evaluation else None)
+    trace.add("prompt_eval", prompt_eval, ago=evaluation, tokens=prompt_tokens)
+    if load:
+        trace.add("load", load, ago=evaluation + prompt_eval)
+    if ttft is not None:
+        trace.add("server_queue", max(ttft - load - prompt_eval, 0.0), ago=evaluation + prompt_eval + load)
+
+def _is_cancellation(exc: BaseException) -> bool:
+    """Whether an exception ending a request means it was stopped rather than failed."""
+    if isinstance(exc, (GeneratorExit, KeyboardInterrupt)):
+        return True
+    # Only code that already imported asyncio can have a task cancelled
+    asyncio = sys.modules.get("asyncio")
+    return asyncio is not None and isinstance(exc, asyncio.CancelledError)
+
+def _finish(trace: Trace) -> None:
+    trace.seconds = trace.elapsed()
+    metrics.inc("requests_total", operation=trace.operation, status=trace.status)
+    metrics.observe("request_seconds", trace.seconds, operation=trace.operation)
+    for item in trace.to_dict()["spans"]:
+        metrics.observe("span_seconds", item["seconds"], span=item["name"])
+        if item["name"] == "prompt_eval":
+            metrics.inc("ollama_prompt_tokens_total", item.get("tokens") or 0)
+            metrics.inc("ollama_prompt_eval_seconds_total", item["seconds"])
+        elif item["name"] == "eval":
+            metrics.inc("ollama_generated_tokens_total", item.get("tokens") or 0)
+            metrics.inc("ollama_eval_seconds_total", item["seconds"])
+            if item.get("tokens_per_second"):
+                metrics.observe("ollama_tokens_per_second", item["tokens_per_second"], TOKEN_RATE_BUCKETS)
+        elif item["name"] == "extract":
+            metrics.inc("extract_chatter_tokens_total", item.get("chatter_tokens") or 0)
+            if item.get("early_stop"):
+                metrics.inc("extract_early_stops_total")
+        elif item["name"] == "history":
+            metrics.inc("history_lookups_total", hit=str(bool(item.get("hit"))).lower())
+    trace_log.write(trace)
+
+@contextmanager
+def request(operation: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Trace the enclosed block as one request.
+
+    Inside another request this is just a span of the outer trace. Otherwise
+    a new trace becomes current, and when the block exits it is written to
+    the trace log and counted in the metrics.
+
+    Yields:
+        Attributes of the request or span; set "status" (see outcome()) to
+        report failures that do not raise
+    """
+    outer = _current.get()
+    if outer is not None:
+        with outer.span(operation, **attributes) as fields:
+            yield fields
+        return
+
+    trace = Trace(operation, **attributes)
+    token = _current.set(trace)
+    try:
+        yield trace.attributes
+    except BaseException as e:
+        trace.status = "cancelled" if _is_cancellation(e) else "error"
+        if isinstance(e, KeyboardInterrupt) and _interrupted_at is not None:
+            trace.add("abort", max(time.perf_counter() - _interrupted_at, 0.0))
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A generator finished in a different context than it started in
+            pass
+        status = trace.attributes.pop("status", None)
+        if status and trace.status == "ok":
+            trace.status = status
+        _finish(trace)
+
+def _last_item(result: Any) -> Any:
+    return result[-1] if isinstance(result, tuple) and result else None
+
+def traced(operation: str, status: Callable[[Any], Any] = _last_item) -> Callable[[_F], _F]:
+    """
+    Decorator running every call as request(operation).
+
+    Works on functions, coroutines and (async) generators; closing a wrapped
+    generator early closes the original one.
+
+    Args:
+        operation: Name of the request
+        status: Picks the status message out of a result (or of each item a
+            generator yields; the last one counts). The default suits the
+            agent's (..., status_message) tuples.
+    """
+    def _note_status(fields: Dict[str, Any], result: Any) -> None:
+        message = status(result)
+        if isinstance(message, str) and message:
+            fields["status"] = outcome(message)
+
+    def decorate(fn: _F) -> _F:
+        flags = fn.__code__.co_flags
+        if flags & _CO_ASYNC_GENERATOR:
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with request(operation) as fields:
+                    stream = fn(*args, **kwargs)
+                    try:
+                        async for item in stream:
+                            _note_status(fields, item)
+                            yield item
+                    finally:
+                        await stream.aclose()
+        elif flags & _CO_GENERATOR:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with request(operation) as fields:
+                    stream = fn(*args, **kwargs)
+                    try:
+                        for item in stream:
+                            _note_status(fields, item)
+                            yield item
+                    finally:
+                        stream.close()
+        elif flags & _CO_COROUTINE:
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with request(operation) as fields:
+                    result = await fn(*args, **kwargs)
+                    _note_status(fields, result)
+                    return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with request(operation) as fields:
+                    result = fn(*args, **kwargs)
+                    _note_status(fields, result)
+                    return result
+        return wrapper
+    return decorate
+
+def serve_metrics(host: str = "127.0.0.1", port: int = 0) -> "ThreadingHTTPServer":
+    """
+    Serve GET /metrics on a background thread.
+
+    Returns:
+        The server; port 0 picks a free port (see server.server_port)
+    """
+    # Imported here so processes that never serve metrics do not pay for http.server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agent import CancelToken, CodingAgent, cancellable
+from async_agent import AsyncCodingAgent
+from bench.fake_ollama import FakeModel, start_server
+from response_cache import ResponseCache
+
+@pytest.fixture
+def slow_agent():
+    """An agent talking to a fake server that streams 5 tokens per second."""
+    server = start_server(FakeModel(token_rate=5, latency=0))
+    agent = CodingAgent(backend="http", host=f"http://127.0.0.1:{server.server_port}",
+                        cache=ResponseCache(path=None), warmup=False, ping_interval=0, candidates=1)
+    yield agent
+    agent.close()
+    server.shutdown()
+
+def test_cancelling_the_request_closes_a_session_turn(slow_agent):
+    session = slow_agent.new_session()
+    token = CancelToken()
+    statuses = []
+
+    def turn() -> None:
+        with cancellable(token):
+            for _, status in slow_agent.generate_code_stream("write a helper", session=session):
+                statuses.append(status)
+
+    worker = threading.Thread(target=turn)
+    worker.start()
+    time.sleep(0.5)
+    started = time.perf_counter()
+    token.cancel()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert time.perf_counter() - started < 1
+    assert statuses[-1] == "⏹️ Generation cancelled."
+
+def test_cancelling_a_task_stops_its_model_call(slow_agent):
+    async_agent = AsyncCodingAgent(slow_agent)
+
+    async def generate() -> float:
+        task = asyncio.ensure_future(async_agent.generate_code("write a helper"))
+        await asyncio.sleep(0.5)
+        started = time.perf_counter()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.perf_counter() - started
+
+    assert asyncio.run(generate()) < 1
+    stats = slow_agent.flights.stats()
+    assert stats["cancelled"] == 1
+    assert stats["in_flight"] == 0
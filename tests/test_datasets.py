@@ -0,0 +1,27 @@
+from dataset_utils import replace_known_datasets
+from file_ops import save_to_file
+from patching import apply_edit, make_patch, rewrite_changed_lines
+
+ORIGINAL = 'a = load_dataset("iris")\n\ndef train():\n    return a\n'
+
+def test_generated_code_gets_full_dataset_paths():
+    code = 'ds = load_dataset("imdb", split="train")\nem = load_dataset(path="emotion")\n'
+    assert replace_known_datasets(code) == (
+        'ds = load_dataset("imdb", split="train")\nem = load_dataset(path="dair-ai/emotion")\n'
+    )
+
+def test_edit_resolves_only_the_lines_it_changes():
+    response = (
+        "<<<<<<< SEARCH\n    return a\n=======\n"
+        '    b = load_dataset("emotion")\n    return a, b\n>>>>>>> REPLACE\n'
+    )
+    edited = rewrite_changed_lines(ORIGINAL, apply_edit(ORIGINAL, response), replace_known_datasets)
+    assert edited.startswith('a = load_dataset("iris")\n')
+    assert 'b = load_dataset("dair-ai/emotion")' in edited
+    patch = make_patch(ORIGINAL, edited, "train.py")
+    assert "scikit-learn/iris" not in edited
+    assert '+    b = load_dataset("dair-ai/emotion")' in patch
+
+def test_save_to_file_writes_what_it_is_given(tmp_path):
+    assert save_to_file("train.py", ORIGINAL, directory=str(tmp_path), clean=False)
+    assert (tmp_path / "train.py").read_text(encoding="utf-8") == ORIGINAL
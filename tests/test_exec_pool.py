@@ -0,0 +1,27 @@
+import sys
+
+import pytest
+
+import daemon
+import file_ops
+from exec_pool import ExecutionPool
+
+SCRIPT = "import sys\nprint('out-line')\nprint('err-line', file=sys.stderr)\n"
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_script_output_goes_to_the_requesting_client(monkeypatch, tmp_path, enabled):
+    pool = ExecutionPool(preload=[], enabled=enabled)
+    monkeypatch.setattr(file_ops, "get_execution_pool", lambda: pool)
+    monkeypatch.setattr(sys, "stdout", daemon._RoutedStream("stdout", sys.stdout))
+    monkeypatch.setattr(sys, "stderr", daemon._RoutedStream("stderr", sys.stderr))
+    script = tmp_path / "script.py"
+    script.write_text(SCRIPT, encoding="utf-8")
+    received = []
+    token = daemon._client_output.set(lambda name, text: received.append((name, text)))
+    try:
+        assert file_ops.execute_file(str(script))
+    finally:
+        daemon._client_output.reset(token)
+        pool.close()
+    assert ("stdout", "out-line\n") in received
+    assert ("stderr", "err-line\n") in received
@@ -0,0 +1,52 @@
+import pytest
+
+from extraction import CodeExtractor, extract_code
+
+def stream(text: str, size: int = 3) -> str:
+    """Feed text in small chunks, like a streamed answer."""
+    extractor = CodeExtractor()
+    out = "".join(extractor.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return out + extractor.finish()
+
+@pytest.mark.parametrize("code", [
+    "if c:\n    x = 1\n\nelse:\n    x = 2\n",
+    "if c:\n    x = 1\n\nelif d:\n    x = 2\n",
+    "try:\n    run()\n\nexcept ValueError:\n    pass\n\nfinally:\n    done()\n",
+    "x = [\n1,\n\nfoo(y) for y in z]\n",
+    "call(\n    a,\n\nb)\n",
+])
+def test_continuation_after_blank_line_is_kept(code):
+    assert extract_code(code) == code.strip()
+    assert stream(code).strip() == code.strip()
+
+def test_clause_after_blank_line_is_kept_when_fenced_answer_has_prose():
+    code = "try:\n    run()\n\nexcept OSError:\n    pass"
+    answer = f"Here is the code:\n```python\n{code}\n```\nThis retries on errors."
+    assert extract_code(answer) == code
+
+def test_trailing_explanation_is_dropped():
+    answer = "import os\nprint(os.getcwd())\n\nThis prints the working directory.\n"
+    assert extract_code(answer) == "import os\nprint(os.getcwd())"
+
+@pytest.mark.parametrize("code", [
+    'x = 1\n\nprint "hi"\ny = 2\n',
+    "x = 1\n\nresult = compute(x\ny = 2\n",
+    "x = 1\n\nfor i in range(3) print(i)\ny = 2\n",
+])
+def test_broken_code_after_blank_line_is_kept_for_the_checks(code):
+    assert extract_code(code) == code.strip()
+    assert stream(code).strip() == code.strip()
+
+def test_closing_fence_ends_the_code():
+    extractor = CodeExtractor()
+    assert extractor.feed("```python\nprint(1)\n```\n") == "print(1)\n"
+    assert extractor.closed
+
+def test_answer_without_code_is_returned_unchanged():
+    assert extract_code("Sorry, I cannot help with that.") == "Sorry, I cannot help with that."
+
+def test_save_to_file_keeps_edited_files_as_is(tmp_path):
+    from file_ops import save_to_file
+    content = "x = 1\n\nHere is a line the user wrote in a string-free file\n"
+    assert save_to_file("edited.py", content, directory=str(tmp_path), clean=False)
+    assert (tmp_path / "edited.py").read_text(encoding="utf-8") == content
@@ -0,0 +1,30 @@
+import pytest
+
+from file_ops import BINARY_SNIFF_BYTES, MMAP_THRESHOLD_BYTES, FileContentCache
+
+@pytest.mark.parametrize("size", [BINARY_SNIFF_BYTES * 4, MMAP_THRESHOLD_BYTES * 2])
+def test_binary_file_is_rejected_after_reading_its_head(tmp_path, monkeypatch, size):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"\0" + b"x" * (size - 1))
+    reads = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        f = real_open(*args, **kwargs)
+        real_read = f.read
+        f.read = lambda n=-1: reads.append(n) or real_read(n)
+        return f
+
+    monkeypatch.setattr("builtins.open", tracking_open)
+    cache = FileContentCache()
+    with pytest.raises(ValueError, match="binary"):
+        cache.read(path)
+    assert reads == [BINARY_SNIFF_BYTES]
+    assert cache.stats()["rejected"] == 1
+
+@pytest.mark.parametrize("size", [10, BINARY_SNIFF_BYTES + 10, MMAP_THRESHOLD_BYTES + 10])
+def test_text_file_is_read_whole(tmp_path, size):
+    path = tmp_path / "module.py"
+    text = ("x = 1\n" * size)[:size]
+    path.write_text(text, encoding="utf-8")
+    assert FileContentCache(max_bytes=size).read(path) == text
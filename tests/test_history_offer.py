@@ -0,0 +1,42 @@
+import io
+import sys
+
+import pytest
+
+import agent as agent_module
+from agent import CodingAgent
+from history import HistoryMatch
+from response_cache import ResponseCache
+
+@pytest.fixture
+def offering_agent(monkeypatch):
+    """An agent with HISTORY_MODE "offer" that always finds an earlier answer."""
+    monkeypatch.setattr(agent_module, "HISTORY_MODE", "offer")
+    agent = CodingAgent(backend="http", host="http://127.0.0.1:9", cache=ResponseCache(path=None),
+                        warmup=False, ping_interval=0, candidates=1)
+    match = HistoryMatch(1, "set x to one", "x = 1\n", 0.9, 0.0)
+    monkeypatch.setattr(agent, "find_similar", lambda *args, **kwargs: match)
+    monkeypatch.setattr(agent, "remember", lambda *args, **kwargs: None)
+
+    def offer_reuse(match):
+        raise AssertionError("asked whether to reuse an earlier answer")
+
+    monkeypatch.setattr(agent, "_offer_reuse", offer_reuse)
+
+    def generate_code_stream_with_source(instruction, context_file=None, context_code=None, use_cache=None,
+                                         session=None):
+        yield "x = 2\n", "", ""
+        yield "", "✅ Code generated successfully!", "model"
+
+    monkeypatch.setattr(agent, "generate_code_stream_with_source", generate_code_stream_with_source)
+    yield agent
+    agent.close()
+
+def test_one_shot_instruction_does_not_ask(offering_agent):
+    assert offering_agent.run_instruction("set x to two")
+
+def test_piped_interactive_input_is_not_asked(offering_agent, monkeypatch):
+    # Only the save question reads from the pipe
+    monkeypatch.setattr(sys, "stdin", io.StringIO("n\n"))
+    offering_agent.handle_instruction("set x to two")
+    assert sys.stdin.read() == ""
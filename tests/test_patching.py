@@ -0,0 +1,82 @@
+import pytest
+
+from patching import (
+    PatchError, apply_edit, apply_search_replace, apply_unified_diff, count_changed_lines, make_patch,
+    parse_search_replace, parse_unified_diff, rewrite_changed_lines
+)
+
+ORIGINAL = "def total(xs):\n    return sum(xs)\n\ndef mean(xs):\n    return sum(xs) / len(xs)\n"
+
+def block(search: str, replace: str, markers: int = 7) -> str:
+    return f"{'<' * markers} SEARCH\n{search}{'=' * markers}\n{replace}{'>' * markers} REPLACE\n"
+
+def test_search_replace_blocks_are_parsed_in_order():
+    response = ("Here you go:\n" + block("a = 1\n", "a = 2\n")
+                + "and\n" + block("b = 1\n", "", markers=5).replace("SEARCH", "SEARCH (tool.py)"))
+    assert parse_search_replace(response) == [("a = 1\n", "a = 2\n"), ("b = 1\n", "")]
+
+def test_search_replace_ignores_trailing_whitespace():
+    edited = apply_search_replace(ORIGINAL, [("    return sum(xs)   \n", "    return sum(xs, 0)\n")])
+    assert edited == ORIGINAL.replace("    return sum(xs)\n", "    return sum(xs, 0)\n", 1)
+
+def test_empty_search_appends():
+    assert apply_search_replace("x = 1", [("", "y = 2\n")]) == "x = 1\ny = 2\n"
+
+def test_missing_search_block_is_reported():
+    with pytest.raises(PatchError, match="could not find the lines to replace: 'return max"):
+        apply_search_replace(ORIGINAL, [("    return max(xs)\n", "    return 0\n")])
+
+def test_ambiguous_search_block_is_reported():
+    original = "x = 1\nprint(x)\nx = 1\n"
+    with pytest.raises(PatchError, match="occur 2 times"):
+        apply_search_replace(original, [("x = 1\n", "x = 2\n")])
+
+def test_unified_diff_is_parsed_with_blank_context_and_closing_fence():
+    diff = ("```diff\n--- a/stats.py\n+++ b/stats.py\n@@ -1,3 +1,3 @@\n def total(xs):\n"
+            "-    return sum(xs)\n+    return sum(xs, 0)\n\n```\nThat handles empty input.\n")
+    assert parse_unified_diff(diff) == [
+        (1, ["def total(xs):\n", "    return sum(xs)\n", "\n"], ["def total(xs):\n", "    return sum(xs, 0)\n", "\n"])
+    ]
+
+def test_unified_diff_trusts_lines_over_wrong_line_numbers():
+    hunks = [(40, ["def mean(xs):\n", "    return sum(xs) / len(xs)\n"],
+              ["def mean(xs):\n", "    return total(xs) / len(xs)\n"])]
+    assert apply_unified_diff(ORIGINAL, hunks) == ORIGINAL.replace("sum(xs) / len", "total(xs) / len")
+
+def test_unified_diff_line_number_picks_between_repeated_lines():
+    original = "x = 1\nprint(x)\nx = 1\n"
+    assert apply_unified_diff(original, [(3, ["x = 1\n"], ["x = 3\n"])]) == "x = 1\nprint(x)\nx = 3\n"
+    with pytest.raises(PatchError, match="occur 2 times"):
+        apply_unified_diff(original, [(2, ["x = 1\n"], ["x = 3\n"])])
+
+def test_unified_diff_hunks_account_for_earlier_hunks():
+    hunks = [(1, ["def total(xs):\n"], ["# Sums\n", "def total(xs):\n"]),
+             (4, ["def mean(xs):\n"], ["# Averages\n", "def mean(xs):\n"])]
+    assert apply_unified_diff(ORIGINAL, hunks) == "# Sums\n" + ORIGINAL.replace("def mean", "# Averages\ndef mean")
+
+def test_edit_without_blocks_or_hunks_is_rejected():
+    with pytest.raises(PatchError, match="no SEARCH/REPLACE blocks or diff hunks"):
+        apply_edit(ORIGINAL, "I would rename the function.")
+
+def test_edit_that_changes_nothing_is_rejected():
+    with pytest.raises(PatchError, match="does not change the file"):
+        apply_edit(ORIGINAL, block("    return sum(xs)\n", "    return sum(xs)\n"))
+
+def test_edit_that_breaks_the_syntax_is_rejected():
+    with pytest.raises(PatchError, match="syntax error on line 2"):
+        apply_edit(ORIGINAL, block("    return sum(xs)\n", "    return sum(xs\n"))
+
+def test_edit_of_a_file_that_did_not_parse_is_applied():
+    original = "def broken(:\n    pass\n"
+    assert apply_edit(original, block("def broken(:\n", "def fixed():\n")) == "def fixed():\n    pass\n"
+
+def test_patch_of_an_edit_counts_its_lines():
+    edited = apply_edit(ORIGINAL, block("    return sum(xs)\n", "    return sum(xs, 0)\n"))
+    patch = make_patch(ORIGINAL, edited, "stats.py")
+    assert patch.startswith("--- a/stats.py\n+++ b/stats.py\n")
+    assert count_changed_lines(patch) == 2
+
+def test_rewrite_touches_only_changed_lines():
+    edited = ORIGINAL.replace("    return sum(xs)\n", "    return sum(xs, 0)\n    # done\n", 1)
+    rewritten = rewrite_changed_lines(ORIGINAL, edited, str.upper)
+    assert rewritten == ORIGINAL.replace("    return sum(xs)\n", "    RETURN SUM(XS, 0)\n    # DONE\n", 1)
@@ -0,0 +1,29 @@
+import pytest
+
+import agent as agent_module
+from agent import CodingAgent
+from bench.fake_ollama import FakeModel, start_server
+from response_cache import ResponseCache
+
+@pytest.fixture
+def chatty_agent(monkeypatch):
+    """An agent whose fake server wraps code in a fence and an explanation."""
+    monkeypatch.setattr(agent_module, "EXTRACT_ENABLED", True)
+    server = start_server(FakeModel(token_rate=0, latency=0, chatter=True))
+    agent = CodingAgent(backend="http", host=f"http://127.0.0.1:{server.server_port}",
+                        cache=ResponseCache(path=None), warmup=False, ping_interval=0, candidates=1)
+    yield agent
+    agent.close()
+    server.shutdown()
+
+def test_raw_and_extracted_answers_are_cached_apart(chatty_agent):
+    raw = "".join(chunk for chunk, _, _ in chatty_agent._stream_ollama_cached("write fib", None, "", extract=False))
+    code, error, from_cache = chatty_agent._call_ollama_cached("write fib", None, "")
+    assert not error and not from_cache
+    assert "```" in raw and "```" not in code
+    assert chatty_agent._call_ollama_cached("write fib", None, "") == (code, "", True)
+
+def test_generation_options_are_part_of_the_key(chatty_agent, monkeypatch):
+    code, _, _ = chatty_agent._call_ollama_cached("write fib", None, "")
+    monkeypatch.setattr(agent_module, "NUM_PREDICT", 7)
+    assert not chatty_agent._call_ollama_cached("write fib", None, "")[2]
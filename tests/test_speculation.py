@@ -0,0 +1,20 @@
+from agent import CodingAgent
+from response_cache import ResponseCache
+
+def test_candidates_fall_back_to_the_cli(monkeypatch):
+    agent = CodingAgent(backend="auto", host="http://127.0.0.1:9", cache=ResponseCache(path=None),
+                        warmup=False, ping_interval=0, candidates=2)
+    prompts = []
+
+    def stream_cli(full_prompt, cancel=None):
+        prompts.append(full_prompt)
+        yield "x = 1\n", ""
+
+    monkeypatch.setattr(agent, "_stream_cli", stream_cli)
+    try:
+        code, status = agent.generate_code("set x to one")
+    finally:
+        agent.close()
+    assert code.strip() == "x = 1"
+    assert status.startswith("✅")
+    assert prompts
@@ -0,0 +1,15 @@
+import json
+
+from telemetry import Trace, TraceLog
+
+def test_trace_log_is_off_unless_configured(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    TraceLog().write(Trace("generate"))
+    assert list(tmp_path.iterdir()) == []
+
+def test_configured_trace_log_gets_one_line_per_trace(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    log = TraceLog(str(path))
+    log.write(Trace("generate"))
+    log.close()
+    assert json.loads(path.read_text(encoding="utf-8"))["operation"] == "generate"
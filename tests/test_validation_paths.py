@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import agent as agent_module
+from agent import CodingAgent
+from async_agent import AsyncCodingAgent
+from history import HistoryMatch
+from response_cache import ResponseCache
+
+BROKEN = "print(total)\n"
+REPAIRED = "total = 1\nprint(total)\n"
+
+@pytest.fixture
+def coding_agent(monkeypatch, tmp_path):
+    """An agent whose model answers with broken code and repairs it when asked."""
+    monkeypatch.setattr(agent_module, "VALIDATE_ENABLED", True)
+    agent = CodingAgent(backend="http", host="http://127.0.0.1:9", cache=ResponseCache(path=None),
+                        warmup=False, ping_interval=0, candidates=1)
+    monkeypatch.setattr(agent, "remember", lambda *args, **kwargs: None)
+    monkeypatch.setattr(agent, "_served", lambda *args, **kwargs: None)
+
+    def generate_code_stream_with_source(instruction, context_file=None, context_code=None, use_cache=None,
+                                         session=None):
+        if session is not None:
+            session.record(instruction, BROKEN)
+        yield BROKEN, "", ""
+        yield "", "✅ Code generated successfully!", "model"
+
+    monkeypatch.setattr(agent, "generate_code_stream_with_source", generate_code_stream_with_source)
+    monkeypatch.setattr(agent, "_call_ollama_cached", lambda *args, **kwargs: (REPAIRED, "", False))
+    return agent
+
+def edit_that_does_not_apply(monkeypatch, agent, tmp_path):
+    path = tmp_path / "tool.py"
+    path.write_text("x = 1\n", encoding="utf-8")
+    monkeypatch.setattr(agent, "edit_target", lambda context_file, edit=None: (str(path), "x = 1\n"))
+    monkeypatch.setattr(agent, "_prepare_edit", lambda instruction, path, content: ("prompt", "digest"))
+    monkeypatch.setattr(agent, "_stream_ollama_cached",
+                        lambda *args, **kwargs: iter([("no edit blocks here", "", False)]))
+    return str(path)
+
+def test_session_turn_is_checked_and_repaired(coding_agent):
+    session = coding_agent.new_session()
+    code, status = coding_agent.generate_code("print a total", session=session)
+    assert code.strip() == REPAIRED.strip()
+    assert "🧪 Checks:" in status
+    assert session.turns[-1][1].strip() == REPAIRED.strip()
+
+def test_edit_fallback_is_checked_and_repaired(coding_agent, monkeypatch, tmp_path):
+    path = edit_that_does_not_apply(monkeypatch, coding_agent, tmp_path)
+    code, patch, status = coding_agent.edit_code("change x", path)
+    assert code == REPAIRED
+    assert patch == ""
+    assert "🧪 Checks:" in status
+
+def test_history_answer_is_neither_checked_nor_stored_again(coding_agent, monkeypatch):
+    monkeypatch.delattr(coding_agent, "generate_code_stream_with_source")
+    match = HistoryMatch(1, "print a total", BROKEN, 0.95, 0.0)
+    monkeypatch.setattr(coding_agent, "_served", lambda *args, **kwargs: match)
+    # The status does not say "from history"; the stream's source does
+    monkeypatch.setattr(coding_agent, "reuse", lambda *args, **kwargs: "✅ Reused an earlier answer")
+    stored = []
+    monkeypatch.setattr(coding_agent, "remember", lambda *args, **kwargs: stored.append(args))
+    code, status = coding_agent.generate_code("print a total", session=coding_agent.new_session())
+    assert code.strip() == BROKEN.strip()
+    assert status == "✅ Reused an earlier answer"
+    assert stored == []
+
+def test_async_session_turn_is_checked_and_repaired(coding_agent):
+    session = coding_agent.new_session()
+    code, status = asyncio.run(AsyncCodingAgent(coding_agent).generate_code("print a total", session=session))
+    assert code.strip() == REPAIRED.strip()
+    assert "🧪 Checks:" in status
+    assert session.turns[-1][1].strip() == REPAIRED.strip()
@@ -1,5 +1,10 @@
 import sys
 import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import AsyncIterator, Deque, Optional
 
 # Fix Windows encoding issues - must be before any imports that use print
 if sys.platform == 'win32':
@@ -16,60 +21,224 @@ if sys.platform == 'win32':
     except (AttributeError, ValueError, TypeError):
         pass
 
-import gradio as gr
-from agent import CodingAgent
+from agent import CodingAgent, CancelToken
+from async_agent import AsyncCodingAgent
+from session import Session
+from config import (
+    UI_GENERATE_CONCURRENCY, UI_RUN_CONCURRENCY, UI_QUEUE_SIZE, EDIT_MODE, EXEC_TIMEOUT_SECONDS, VALIDATE_ENABLED,
+    UI_METRICS_PORT, HISTORY_MODE
+)
+from exec_pool import OutputBuffer, get_execution_pool
 from file_ops import save_to_file, execute_file, sanitize_filename
+import telemetry
 from pathlib import Path
 
-# Initialize the agent
-agent = CodingAgent()
+# The agents all sessions share (connection pool and cache), created on first use:
+# constructing them opens the cache databases and probes the backend
+_agent: Optional[CodingAgent] = None
+_async_agent: Optional[AsyncCodingAgent] = None
+_agents_lock = threading.Lock()
 
-# Check if Ollama is available and show warning if not
-if not agent._check_ollama_available():
-    print("⚠️ Warning: Ollama not found in PATH. Please install Ollama from https://ollama.ai")
-    print("   After installation, ensure 'ollama' is in your system PATH.")
+def get_agent() -> CodingAgent:
+    """Return the CodingAgent shared by all UI sessions, creating it on first use."""
+    return get_async_agent().agent
 
-def generate_code_ui(instruction: str, context_code: str, context_file_path: str) -> tuple[str, str]:
-    """Generate code from instruction with optional context."""
+def get_async_agent() -> AsyncCodingAgent:
+    """Return the AsyncCodingAgent shared by all UI sessions, creating it on first use."""
+    global _agent, _async_agent
+    with _agents_lock:
+        if _async_agent is None:
+            _agent = CodingAgent()
+            _async_agent = AsyncCodingAgent(_agent, max_concurrency=UI_GENERATE_CONCURRENCY)
+        return _async_agent
+
+execution_pool = get_execution_pool()
+
+# Seconds between refreshes of the run output box while a script is running
+RUN_OUTPUT_INTERVAL = 0.2
+
+class SlotQueue:
+    """
+    FIFO admission control for a fixed number of concurrent slots.
+    
+    Unlike a plain semaphore it knows each waiter's position, so handlers can
+    report queue position and wait time while they wait for a slot.
+    """
+    
+    class Ticket:
+        def __init__(self):
+            self.entered = time.monotonic()
+            self.admitted = asyncio.Event()
+        
+        @property
+        def waited(self) -> float:
+            return time.monotonic() - self.entered
+    
+    def __init__(self, slots: int, max_waiting: int):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._waiting: Deque["SlotQueue.Ticket"] = deque()
+    
+    def enter(self) -> Optional["SlotQueue.Ticket"]:
+        """Join the queue; returns None when the queue is full."""
+        ticket = SlotQueue.Ticket()
+        if self.active < self.slots and not self._waiting:
+            self.active += 1
+            ticket.admitted.set()
+        elif len(self._waiting) >= self.max_waiting:
+            return None
+        else:
+            self._waiting.append(ticket)
+        return ticket
+    
+    def position(self, ticket: "SlotQueue.Ticket") -> int:
+        """1-based position among waiting tickets (0 once admitted)."""
+        try:
+            return self._waiting.index(ticket) + 1
+        except ValueError:
+            return 0
+    
+    def leave(self, ticket: "SlotQueue.Ticket") -> None:
+        """Release the ticket's slot (or its place in line) and admit the next waiter."""
+        if ticket.admitted.is_set():
+            self.active -= 1
+        else:
+            try:
+                self._waiting.remove(ticket)
+            except ValueError:
+                pass
+        while self._waiting and self.active < self.slots:
+            self.active += 1
+            self._waiting.popleft().admitted.set()
+    
+    async def wait(self, ticket: "SlotQueue.Ticket") -> AsyncIterator[str]:
+        """Wait for admission, yielding a status line about once per second."""
+        while not ticket.admitted.is_set():
+            yield f"⏳ Queued: position {self.position(ticket)} of {len(self._waiting)}, waited {ticket.waited:.0f}s"
+            try:
+                await asyncio.wait_for(ticket.admitted.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+generate_slots = SlotQueue(UI_GENERATE_CONCURRENCY, UI_QUEUE_SIZE)
+run_slots = SlotQueue(UI_RUN_CONCURRENCY, UI_QUEUE_SIZE)
+
+@telemetry.traced("ui.generate", status=lambda update: update[1])
+async def generate_code_ui(instruction: str, context_code: str, context_file_path: str,
+                           bypass_cache: bool = False, edit_mode: bool = False,
+                           session: Optional[Session] = None
+                           ) -> AsyncIterator[tuple[str, str, str, Optional[Session]]]:
+    """
+    Generate code from instruction with optional context, streaming partial output.
+    
+    Each browser tab keeps its own Session, so follow-up instructions refine the previous code.
+    In edit mode a single context file is changed through a patch, which is shown separately.
+    When an earlier answer is similar enough, the status offers it (see reuse_similar_ui).
+    """
     if not instruction or not instruction.strip():
-        return "", "❌ Please provide an instruction."
+        yield "", "❌ Please provide an instruction.", "", session
+        return
+    
+    async_agent = get_async_agent()
+    agent = async_agent.agent
+    if session is None:
+        session = agent.new_session()
     
     # Use context file path if provided, otherwise use context code text
-    context_file = None
-    if context_file_path and context_file_path.strip():
-        context_file = context_file_path.strip()
-    elif context_code and context_code.strip():
-        # If context code is provided but no file path, create a temp context
-        # For now, we'll just use the context_code directly in the prompt
-        context_file = None
-        context_code_text = context_code.strip()
-    else:
-        context_code_text = ""
-    
-    # Build prompt with context if provided
-    if context_file:
-        code, status = agent.generate_code(instruction, context_file)
-    elif context_code and context_code.strip():
-        # Inject context code directly into prompt
-        prompt = f"""You are provided this existing code:
-```python
-{context_code.strip()}
-```
-
-Based on this code, {instruction}"""
-        from dataset_utils import replace_known_datasets
-        prompt = replace_known_datasets(prompt)
-        code, error = agent.call_ollama(prompt)
-        if error:
-            status = error
-        elif code:
-            status = "✅ Code generated successfully!"
-        else:
-            status = "❌ No response received from Ollama."
-    else:
-        code, status = agent.generate_code(instruction, None)
+    context_file = context_file_path.strip() if context_file_path and context_file_path.strip() else None
+    edit = None if EDIT_MODE == "auto" else True
+    target = await asyncio.to_thread(agent.edit_target, context_file, edit) if edit_mode and context_file else None
+    first_turn = not session.turns
+    offer = ""
+    if target is None and HISTORY_MODE == "offer":
+        match = await asyncio.to_thread(agent.find_similar, instruction, context_file, context_code,
+                                        not bypass_cache, session)
+        if match is not None:
+            offer = f"\n♻️ An earlier answer is {match.describe()}: press Reuse similar to take it instead"
+    
+    ticket = generate_slots.enter()
+    if ticket is None:
+        yield "", "❌ Server busy: too many queued requests. Please try again shortly.", "", session
+        return
     
-    return code, status
+    code = ""
+    try:
+        async for queued in generate_slots.wait(ticket):
+            yield code, queued + offer, "", session
+        waited = ticket.waited
+        telemetry.record("queue", waited)
+        working = "🤖 Generating..." if waited < 1 else f"🤖 Generating... (waited {waited:.0f}s in queue)"
+        working += offer
+        yield code, working, "", session
+        # Cancelling this task (Stop button) closes the model request inside the stream
+        if target is None and await asyncio.to_thread(agent.speculative, context_file):
+            yield code, f"🎲 Generating {agent.candidates} candidates...", "", session
+            code, status = await async_agent.generate_code(instruction, context_file, context_code,
+                                                           use_cache=not bypass_cache, session=session)
+            yield code, status, "", session
+            return
+        if target is not None:
+            async for code, patch, status in async_agent.edit_code_stream(instruction, target[0],
+                                                                          use_cache=not bypass_cache):
+                if status.startswith("↩️"):
+                    working = status
+                yield code, status or working, patch, session
+                if status.startswith("✅"):
+                    session.record(instruction, code)
+            return
+        async for chunk, status, source in async_agent.generate_code_stream_with_source(
+                instruction, context_file, context_code, use_cache=not bypass_cache, session=session):
+            if chunk:
+                code += chunk
+                yield code, working, "", session
+            elif status:
+                turns = session.stats()["turns"]
+                if status.startswith("✅") and turns > 1:
+                    status += f" (turn {turns} of this conversation)"
+                yield code, status, "", session
+                if VALIDATE_ENABLED and code and status.startswith("✅") and source != "history":
+                    yield code, f"{status}\n🧪 Checking the code...", "", session
+                    checked, report = await async_agent.validate_and_repair(instruction, code,
+                                                                            use_cache=not bypass_cache)
+                    if report.rounds and checked != code:
+                        code = checked
+                        session.amend(code)
+                    status += f"\n🧪 Checks: {report.summary()}"
+                    for warning in report.validations[-1].warnings:
+                        status += f"\n⚠️ {warning}"
+                    yield code, status, "", session
+                if code and status.startswith("✅"):
+                    resolved = agent.resolve_datasets(code)
+                    if resolved != code:
+                        code = resolved
+                        yield code, status, "", session
+                if first_turn and code and status.startswith("✅") and source != "history":
+                    await asyncio.to_thread(agent.remember, instruction, code, context_file, context_code)
+    finally:
+        generate_slots.leave(ticket)
+
+async def reuse_similar_ui(instruction: str, context_code: str, context_file_path: str,
+                           bypass_cache: bool = False, session: Optional[Session] = None
+                           ) -> tuple[str, str, str, Optional[Session]]:
+    """Answer with the earlier generation most similar to the instruction, stopping a running generation."""
+    agent = get_agent()
+    if session is None:
+        session = agent.new_session()
+    context_file = context_file_path.strip() if context_file_path and context_file_path.strip() else None
+    match = None
+    if instruction and instruction.strip():
+        match = await asyncio.to_thread(agent.find_similar, instruction, context_file, context_code,
+                                        not bypass_cache, session)
+    if match is None:
+        return "", "❌ No similar earlier answer for this instruction and context.", "", session
+    return match.code, await asyncio.to_thread(agent.reuse, match, instruction, session), "", session
+
+def new_conversation_ui(session: Optional[Session]) -> tuple[Optional[Session], str]:
+    """Forget the current conversation so the next instruction starts fresh."""
+    if session is not None:
+        session.reset()
+    return session, "🆕 Started a new conversation."
 
 def save_code_ui(code: str, filename: str) -> str:
     """Save generated code to a file."""
@@ -84,132 +253,267 @@ def save_code_ui(code: str, filename: str) -> str:
     else:
         return "❌ Failed to save code."
 
-def run_code_ui(filename: str) -> str:
+def _format_run_output(stdout: str, stderr: str) -> str:
+    """Lay out a script's captured streams for the run output box."""
+    output = ""
+    if stdout:
+        output += f"STDOUT:\n{stdout}\n"
+    if stderr:
+        output += f"STDERR:\n{stderr}\n"
+    return output
+
+async def run_code_ui(filename: str) -> AsyncIterator[str]:
     """Run a Python file and return output."""
     if not filename or not filename.strip():
-        return "❌ Please provide a filename."
+        yield "❌ Please provide a filename."
+        return
     
     sanitized = sanitize_filename(filename)
     if not sanitized:
-        return "❌ Invalid filename."
+        yield "❌ Invalid filename."
+        return
     
     if not os.path.exists(sanitized):
-        return f"❌ File '{sanitized}' not found."
-    
-    import subprocess
-    import sys
+        yield f"❌ File '{sanitized}' not found."
+        return
     
-    try:
-        result = subprocess.run(
-            [sys.executable, sanitized],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='replace',
-            timeout=300
-        )
+    with telemetry.request("ui.run", script=sanitized) as fields:
+        ticket = run_slots.enter()
+        if ticket is None:
+            fields["status"] = "error"
+            yield "❌ Server busy: too many queued runs. Please try again shortly."
+            return
         
-        output = ""
-        if result.stdout:
-            output += f"STDOUT:\n{result.stdout}\n"
-        if result.stderr:
-            output += f"STDERR:\n{result.stderr}\n"
-        if result.returncode != 0:
-            output += f"\nExit code: {result.returncode}"
-        
-        return output if output else "✅ Script executed (no output)"
-    except subprocess.TimeoutExpired:
-        return "❌ Script execution timed out after 5 minutes."
-    except Exception as e:
-        return f"❌ Error executing file: {e}"
-
-# Create the Gradio interface
-with gr.Blocks(title="AI Coding Assistant") as demo:
-    gr.Markdown(
-        """
-        # 🤖 AI Coding Assistant
+        try:
+            async for queued in run_slots.wait(ticket):
+                yield queued
+            telemetry.record("queue", ticket.waited)
+            yield "▶️ Running..."
+            
+            # The script's lines arrive on a worker thread; show them every RUN_OUTPUT_INTERVAL seconds
+            streams = {"stdout": OutputBuffer(), "stderr": OutputBuffer()}
+            streams_lock = threading.Lock()
+            version = [0]
+            
+            def on_output(name: str, line: str) -> None:
+                with streams_lock:
+                    streams[name].add(line)
+                    version[0] += 1
+            
+            cancel = CancelToken()
+            run = asyncio.ensure_future(asyncio.to_thread(
+                execution_pool.run, sanitized, None, EXEC_TIMEOUT_SECONDS, (), cancel, on_output
+            ))
+            shown = 0
+            try:
+                while True:
+                    await asyncio.wait({run}, timeout=RUN_OUTPUT_INTERVAL)
+                    if run.done():
+                        break
+                    with streams_lock:
+                        if version[0] == shown:
+                            continue
+                        shown = version[0]
+                        output = _format_run_output(streams["stdout"].text(), streams["stderr"].text())
+                    yield f"▶️ Running...\n\n{output}"
+                result = run.result()
+            except asyncio.CancelledError:
+                # The Stop button cancelled this task; kill the script too
+                cancel.cancel()
+                raise
+            telemetry.record("execute", result.seconds, returncode=result.returncode, pooled=result.pooled,
+                             max_rss_kb=result.max_rss_kb)
+            if not result.ok:
+                fields["status"] = "cancelled" if result.cancelled else "error"
+            
+            if result.error:
+                yield f"❌ Error executing file: {result.error}"
+                return
+            
+            output = _format_run_output(result.stdout, result.stderr)
+            if result.timed_out:
+                output += f"\n❌ Script execution timed out after {EXEC_TIMEOUT_SECONDS} seconds."
+            elif result.returncode != 0:
+                output += f"\nExit code: {result.returncode}"
+            output += f"\n⏱️ {result.summary()}"
+            
+            yield output if output else "✅ Script executed (no output)"
+        finally:
+            run_slots.leave(ticket)
+
+def stop_ui() -> str:
+    """Report that running generations and script runs of this session were stopped."""
+    return "⏹️ Stopped."
+
+def build_demo() -> "gr.Blocks":
+    """Create the Gradio interface; gradio is imported here so importing this module stays cheap."""
+    import gradio as gr
+    
+    # Create the shared agents with the interface, so the first request does not block the event loop on it
+    get_async_agent()
+    with gr.Blocks(title="AI Coding Assistant") as demo:
+        session_state = gr.State(None)
+        gr.Markdown(
+            """
+            # 🤖 AI Coding Assistant
         
-        Generate Python code using your local Ollama LLM. Enter an instruction and optionally provide context code or a file path.
-        """
-    )
+            Generate Python code using your local Ollama LLM. Enter an instruction and optionally provide context code or a file path.
+            """
+        )
     
-    with gr.Row():
-        with gr.Column(scale=2):
-            instruction = gr.Textbox(
-                label="💡 Instruction",
-                placeholder="e.g., Create a function to calculate fibonacci numbers",
-                lines=3
-            )
+        with gr.Row():
+            with gr.Column(scale=2):
+                instruction = gr.Textbox(
+                    label="💡 Instruction",
+                    placeholder="e.g., Create a function to calculate fibonacci numbers",
+                    lines=3
+                )
+            
+                with gr.Accordion("📄 Optional Context", open=False):
+                    context_code = gr.Textbox(
+                        label="Paste existing code here",
+                        placeholder="Paste your existing code for context...",
+                        lines=10
+                    )
+                    context_file = gr.Textbox(
+                        label="Or provide file paths",
+                        placeholder="e.g., existing_code.py, utils/*.py",
+                        lines=1
+                    )
             
-            with gr.Accordion("📄 Optional Context", open=False):
-                context_code = gr.Textbox(
-                    label="Paste existing code here",
-                    placeholder="Paste your existing code for context...",
-                    lines=10
+                bypass_cache = gr.Checkbox(label="Bypass cache (always ask the model)", value=False)
+                edit_mode = gr.Checkbox(
+                    label="Edit mode (change a single context file through a patch)",
+                    value=EDIT_MODE != "off"
+                )
+                with gr.Row():
+                    generate_btn = gr.Button("🚀 Generate Code", variant="primary", size="lg", scale=3)
+                    stop_btn = gr.Button("⏹️ Stop", variant="stop", size="lg", scale=1)
+                    reuse_btn = gr.Button("♻️ Reuse similar", size="lg", scale=1, visible=HISTORY_MODE == "offer")
+                    new_btn = gr.Button("🆕 New conversation", size="lg", scale=1)
+                status = gr.Textbox(label="Status", interactive=False)
+        
+            with gr.Column(scale=3):
+                generated_code = gr.Code(
+                    label="Generated Code",
+                    language="python",
+                    lines=20,
+                    interactive=True
                 )
-                context_file = gr.Textbox(
-                    label="Or provide file path",
-                    placeholder="e.g., existing_code.py",
-                    lines=1
+                patch_view = gr.Textbox(
+                    label="Patch (edit mode)",
+                    lines=8,
+                    interactive=False
                 )
             
-            generate_btn = gr.Button("🚀 Generate Code", variant="primary", size="lg")
-            status = gr.Textbox(label="Status", interactive=False)
-        
-        with gr.Column(scale=3):
-            generated_code = gr.Code(
-                label="Generated Code",
-                language="python",
-                lines=20,
-                interactive=True
-            )
+                with gr.Row():
+                    filename_input = gr.Textbox(
+                        label="Filename",
+                        placeholder="e.g., my_script.py",
+                        scale=2
+                    )
+                    save_btn = gr.Button("💾 Save", scale=1)
+                    run_btn = gr.Button("▶️ Run", scale=1)
             
-            with gr.Row():
-                filename_input = gr.Textbox(
-                    label="Filename",
-                    placeholder="e.g., my_script.py",
-                    scale=2
+                save_status = gr.Textbox(label="Save Status", interactive=False)
+                run_output = gr.Textbox(
+                    label="Execution Output",
+                    lines=10,
+                    interactive=False
                 )
-                save_btn = gr.Button("💾 Save", scale=1)
-                run_btn = gr.Button("▶️ Run", scale=1)
-            
-            save_status = gr.Textbox(label="Save Status", interactive=False)
-            run_output = gr.Textbox(
-                label="Execution Output",
-                lines=10,
-                interactive=False
-            )
-    
-    # Event handlers
-    generate_btn.click(
-        fn=generate_code_ui,
-        inputs=[instruction, context_code, context_file],
-        outputs=[generated_code, status]
-    )
     
-    save_btn.click(
-        fn=save_code_ui,
-        inputs=[generated_code, filename_input],
-        outputs=[save_status]
-    )
+        # Event handlers. Concurrency is enforced by SlotQueue inside the handlers so they
+        # can report queue position; Gradio itself only bounds the number of pending events.
+        generate_event = generate_btn.click(
+            fn=generate_code_ui,
+            inputs=[instruction, context_code, context_file, bypass_cache, edit_mode, session_state],
+            outputs=[generated_code, status, patch_view, session_state],
+            concurrency_limit=None
+        )
     
-    run_btn.click(
-        fn=run_code_ui,
-        inputs=[filename_input],
-        outputs=[run_output]
-    )
+        # Taking an earlier answer makes the running generation pointless
+        reuse_btn.click(
+            fn=reuse_similar_ui,
+            inputs=[instruction, context_code, context_file, bypass_cache, session_state],
+            outputs=[generated_code, status, patch_view, session_state],
+            cancels=[generate_event]
+        )
     
-    gr.Markdown(
-        """
-        ### 💡 Tips:
-        - Be specific in your instructions for better results
-        - Provide context code when modifying existing files
-        - Review generated code before saving/running
-        - Generated files are saved in the current working directory
-        """
-    )
+        new_btn.click(
+            fn=new_conversation_ui,
+            inputs=[session_state],
+            outputs=[session_state, status],
+            queue=False
+        )
+    
+        save_btn.click(
+            fn=save_code_ui,
+            inputs=[generated_code, filename_input],
+            outputs=[save_status]
+        )
+    
+        run_event = run_btn.click(
+            fn=run_code_ui,
+            inputs=[filename_input],
+            outputs=[run_output],
+            concurrency_limit=None
+        )
+    
+        # Cancelling the events aborts the model request / kills the script and frees the slot
+        stop_btn.click(
+            fn=stop_ui,
+            inputs=None,
+            outputs=[status],
+            cancels=[generate_event, run_event],
+            queue=False
+        )
+    
+        gr.Markdown(
+            """
+            ### 💡 Tips:
+            - Be specific in your instructions for better results
+            - Provide context code when modifying existing files
+            - Follow-up instructions ("now add error handling") refine the last result; use New conversation to start over
+            - Review generated code before saving/running
+            - Generated files are saved in the current working directory
+            """
+        )
+
+    demo.queue(max_size=UI_QUEUE_SIZE + UI_GENERATE_CONCURRENCY + UI_RUN_CONCURRENCY)
+    return demo
+
+_demo: Optional["gr.Blocks"] = None
+_demo_lock = threading.Lock()
+
+def __getattr__(name: str):
+    """
+    Build `demo` (and the agents) on first access, so `gradio ui.py` and
+    `from ui import demo` still find them.
+    """
+    global _demo
+    if name == "agent":
+        return get_agent()
+    if name == "async_agent":
+        return get_async_agent()
+    if name != "demo":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _demo_lock:
+        if _demo is None:
+            _demo = build_demo()
+        return _demo
 
 if __name__ == "__main__":
+    import gradio as gr
+    # Check if Ollama is available and show warning if not
+    if not get_agent()._check_ollama_available():
+        print("⚠️ Warning: Ollama not found in PATH. Please install Ollama from https://ollama.ai")
+        print("   After installation, ensure 'ollama' is in your system PATH.")
+    # Start the warm execution server now so heavy imports are done before the first run
+    execution_pool.start()
+    demo = build_demo()
+    if UI_METRICS_PORT:
+        telemetry.serve_metrics("127.0.0.1", UI_METRICS_PORT)
+        print(f"📈 Metrics at http://127.0.0.1:{UI_METRICS_PORT}/metrics")
     demo.launch(
         share=False, 
         server_name="127.0.0.1", 
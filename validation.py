@@ -0,0 +1,266 @@
+import ast
+import builtins
+import importlib.util
+import os
+import symtable
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from config import VALIDATE_WORKERS
+
+# Names every module has besides the builtins
+MODULE_GLOBALS = {"__file__", "__builtins__", "__annotations__", "__cached__", "__path__"}
+
+# Exceptions that mark an import inside `try` as optional
+_IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+class Diagnostic:
+    """One problem found in generated code."""
+
+    def __init__(self, check: str, message: str, line: Optional[int] = None, severity: str = "error"):
+        """
+        Args:
+            check: Check that found it ("syntax", "names" or "imports")
+            message: Human-readable description
+            line: 1-based line number, if known
+            severity: "error" problems are sent back to the model; "warning" ones are only reported
+        """
+        self.check = check
+        self.message = message
+        self.line = line
+        self.severity = severity
+
+    def __str__(self) -> str:
+        return f"line {self.line}: {self.message}" if self.line else self.message
+
+class ValidationReport:
+    """Diagnostics and per-check timings for one piece of code."""
+
+    def __init__(self, diagnostics: List[Diagnostic], timings: Dict[str, float]):
+        self.diagnostics = diagnostics
+        self.timings = timings
+
+    @property
+    def errors(self) -> List[Diagnostic]:
+        return [d for d in self.diagnostics if d.severity == "error"]
+
+    @property
+    def warnings(self) -> List[Diagnostic]:
+        return [d for d in self.diagnostics if d.severity == "warning"]
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def describe(self) -> str:
+        """The diagnostics as a bullet list, errors first."""
+        return "\n".join(f"- {d}" for d in self.errors + self.warnings)
+
+class RepairReport:
+    """What the validate-repair loop did for one request."""
+
+    def __init__(self):
+        self.validations: List[ValidationReport] = []
+        self.model_seconds = 0.0
+        self.error = ""
+
+    @property
+    def rounds(self) -> int:
+        """Repair requests sent to the model."""
+        return max(len(self.validations) - 1, 0)
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.validations) and self.validations[-1].ok
+
+    def timings(self) -> Dict[str, float]:
+        """Total seconds per check over all rounds, plus time spent waiting for repairs."""
+        totals: Dict[str, float] = {}
+        for report in self.validations:
+            for stage, seconds in report.timings.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        totals["repair"] = self.model_seconds
+        return totals
+
+    def summary(self) -> str:
+        """One status line, e.g. "passed after 1 repair round (syntax 0.4ms, ...)"."""
+        if not self.validations:
+            return "not run"
+        timings = self.timings()
+        parts = [f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items() if stage != "repair"]
+        if self.rounds:
+            parts.append(f"repair {timings['repair']:.1f}s")
+        rounds = f"{self.rounds} repair round{'s' if self.rounds != 1 else ''}"
+        outcome = f"passed after {rounds}" if self.rounds else "passed"
+        if not self.ok:
+            outcome = f"{len(self.validations[-1].errors)} problem(s) left after {rounds}"
+        return f"{outcome} ({', '.join(parts)})"
+
+def _first_use(tree: ast.AST, name: str) -> Optional[int]:
+    lines = [node.lineno for node in ast.walk(tree)
+             if isinstance(node, ast.Name) and node.id == name and isinstance(node.ctx, ast.Load)]
+    return min(lines) if lines else None
+
+def check_undefined_names(code: str, tree: ast.Module) -> List[Diagnostic]:
+    """Report global names that are read but never bound in the module or builtins."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+            # Anything could come from a star import
+            return []
+    try:
+        top = symtable.symtable(code, "<generated>", "exec")
+    except SyntaxError:
+        return []
+
+    defined: Set[str] = set(dir(builtins)) | MODULE_GLOBALS
+    defined.update(s.get_name() for s in top.get_symbols() if s.is_assigned() or s.is_imported() or s.is_namespace())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Global):
+            defined.update(node.names)
+
+    missing: Set[str] = set()
+    tables = [top]
+    while tables:
+        table = tables.pop()
+        for symbol in table.get_symbols():
+            if not symbol.is_referenced() or symbol.get_name() in defined:
+                continue
+            if table is top or symbol.is_global():
+                missing.add(symbol.get_name())
+        tables.extend(table.get_children())
+
+    diagnostics = [Diagnostic("names", f"name '{name}' is not defined", _first_use(tree, name))
+                   for name in missing]
+    return sorted(diagnostics, key=lambda d: d.line or 0)
+
+def _optional_import_lines(tree: ast.Module) -> Set[int]:
+    """Lines of imports guarded by `try: ... except ImportError`."""
+    lines: Set[int] = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Try):
+            continue
+        caught: Set[str] = set()
+        for handler in node.handlers:
+            if handler.type is None:
+                caught.add("BaseException")
+            for exc in ([handler.type] if handler.type is not None else []):
+                names = exc.elts if isinstance(exc, ast.Tuple) else [exc]
+                caught.update(n.id for n in names if isinstance(n, ast.Name))
+        if caught & _IMPORT_ERRORS:
+            for stmt in node.body:
+                lines.update(n.lineno for n in ast.walk(stmt) if isinstance(n, (ast.Import, ast.ImportFrom)))
+    return lines
+
+class Validator:
+    """
+    Static checks for generated code: syntax, undefined names and whether
+    imports can be resolved.
+
+    Parsing comes first since the other checks need the tree; the remaining
+    checks then run side by side on a small thread pool. Nothing in the
+    code is imported or executed.
+    """
+
+    def __init__(self, workers: int = VALIDATE_WORKERS, check_imports: bool = True):
+        """
+        Args:
+            workers: Threads running the checks
+            check_imports: Also verify that imported modules are installed or local
+        """
+        self.workers = workers
+        self.check_imports = check_imports
+        self._pool: Optional["ThreadPoolExecutor"] = None
+        self._pool_lock = threading.Lock()
+        self._spec_cache: Dict[str, bool] = {}
+
+    def _executor(self) -> "ThreadPoolExecutor":
+        with self._pool_lock:
+            if self._pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="validate")
+            return self._pool
+
+    def _module_exists(self, name: str, directory: str) -> bool:
+        if name in sys.builtin_module_names or name in getattr(sys, "stdlib_module_names", ()):
+            return True
+        if os.path.exists(os.path.join(directory, name + ".py")) or os.path.isdir(os.path.join(directory, name)):
+            return True
+        if name not in self._spec_cache:
+            try:
+                self._spec_cache[name] = importlib.util.find_spec(name) is not None
+            except (ImportError, ValueError):
+                self._spec_cache[name] = False
+        return self._spec_cache[name]
+
+    def check_imports_resolve(self, tree: ast.Module, directory: str = ".") -> List[Diagnostic]:
+        """Report imported top-level modules that are neither installed nor next to the script."""
+        optional = _optional_import_lines(tree)
+        diagnostics = []
+        seen: Set[str] = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            if node.lineno in optional:
+                continue
+            for name in names:
+                top = name.split(".")[0]
+                if top in seen:
+                    continue
+                seen.add(top)
+                if not self._module_exists(top, directory):
+                    diagnostics.append(Diagnostic("imports", f"module '{top}' is not installed", node.lineno,
+                                                  severity="warning"))
+        return diagnostics
+
+    def validate(self, code: str, directory: str = ".") -> ValidationReport:
+        """
+        Check code without running it.
+
+        Args:
+            code: Python source (already stripped of markdown fences)
+            directory: Where the code will be saved, for resolving local imports
+
+        Returns:
+            ValidationReport
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        if not code.strip():
+            return ValidationReport([Diagnostic("syntax", "the response contains no code")], {"syntax": 0.0})
+        try:
+            tree = ast.parse(code)
+            # compile() also catches errors the parser lets through, e.g. `return` outside a function
+            compile(tree, "<generated>", "exec", dont_inherit=True)
+        except SyntaxError as e:
+            timings["syntax"] = time.perf_counter() - start
+            return ValidationReport([Diagnostic("syntax", f"syntax error: {e.msg}", e.lineno)], timings)
+        except ValueError as e:
+            timings["syntax"] = time.perf_counter() - start
+            return ValidationReport([Diagnostic("syntax", str(e))], timings)
+        timings["syntax"] = time.perf_counter() - start
+
+        def timed(stage: str, check, *args) -> List[Diagnostic]:
+            began = time.perf_counter()
+            try:
+                return check(*args)
+            finally:
+                timings[stage] = time.perf_counter() - began
+
+        pool = self._executor()
+        futures = [pool.submit(timed, "names", check_undefined_names, code, tree)]
+        if self.check_imports:
+            futures.append(pool.submit(timed, "imports", self.check_imports_resolve, tree, directory))
+        diagnostics = [d for future in futures for d in future.result()]
+        return ValidationReport(diagnostics, timings)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None